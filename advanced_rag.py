@@ -1,10 +1,13 @@
 """Advanced RAG System with Hybrid Search and Reranking."""
 import os
 import json
+import fcntl
 import pickle
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 import hashlib
 
@@ -56,6 +59,27 @@ class Document:
         return f"[{source_name}]"
 
 
+@dataclass(frozen=True)
+class CorpusSnapshot:
+    """Everything a search reads: documents, indices and counters.
+    
+    Never modified once published; ingestion, removal and cache reloads
+    build a new snapshot and replace the retriever's reference in one
+    assignment, so a search running meanwhile keeps a consistent view.
+    """
+    documents: List[Document] = field(default_factory=list)
+    bm25: Any = None
+    index: Any = None  # FAISS index (None for ChromaDB or NumPy search)
+    embeddings: Optional[np.ndarray] = None  # One row per document
+    source_counts: Dict[str, int] = field(default_factory=dict)
+    index_type: str = 'NumPy'
+    corpus_version: int = 0
+    by_id: Dict[str, Document] = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        object.__setattr__(self, 'by_id', {doc.id: doc for doc in self.documents})
+
+
 class HybridRetriever:
     """Advanced retriever with hybrid search capabilities."""
     
@@ -64,21 +88,81 @@ class HybridRetriever:
         self.embedder = SentenceTransformer(embedding_model)
         self.reranker = CrossEncoder(rerank_model) if rerank_model else None
         
-        # Storage
-        self.documents: List[Document] = []
-        self.bm25 = None
-        self.index = None  # FAISS or ChromaDB
+        # Storage: the current corpus snapshot (counters are maintained at
+        # ingest/removal time and cached with the index)
+        self._snapshot = CorpusSnapshot()
         self.use_gpu = torch.cuda.is_available()
         
         # Paths
         self.cache_dir = Path("rag_cache")
         self.cache_dir.mkdir(exist_ok=True)
         
+        # The cache is shared by every process (e.g. API workers) using this directory
+        self._cache_lock = threading.RLock()
+        self._cache_lock_file = None
+        self._cache_stamp = None
+    
+    # ---- Current snapshot ----
+    @property
+    def documents(self) -> List[Document]:
+        return self._snapshot.documents
+    
+    @property
+    def bm25(self):
+        return self._snapshot.bm25
+    
+    @property
+    def index(self):
+        return self._snapshot.index
+    
+    @property
+    def source_counts(self) -> Dict[str, int]:
+        return self._snapshot.source_counts
+    
+    @property
+    def index_type(self) -> str:
+        return self._snapshot.index_type
+    
+    @property
+    def corpus_version(self) -> int:
+        return self._snapshot.corpus_version
+    
+    @contextmanager
+    def cache_lock(self):
+        """Exclusive lock on the cache directory across processes (reentrant within one)."""
+        with self._cache_lock:
+            if self._cache_lock_file is not None:
+                yield
+                return
+            self._cache_lock_file = (self.cache_dir / "cache.lock").open('w')
+            fcntl.flock(self._cache_lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._cache_lock_file.fileno(), fcntl.LOCK_UN)
+                self._cache_lock_file.close()
+                self._cache_lock_file = None
+    
+    def _cache_file_stamp(self):
+        try:
+            return (self.cache_dir / "rag_cache.pkl").stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def refresh_if_stale(self) -> bool:
+        """Reload the cache if another process rewrote it since it was loaded."""
+        if self._cache_stamp is None or self._cache_file_stamp() == self._cache_stamp:
+            return False
+        with self.cache_lock():
+            if self._cache_file_stamp() == self._cache_stamp:
+                return False
+            return self.load_cache()
+        
     def add_documents(self, documents: List[Document], batch_size: int = 32):
         """Add documents to the retriever with batched embedding generation."""
         print(f"Adding {len(documents)} documents to RAG system...")
         
-        # Generate embeddings in batches
+        # Generate embeddings in batches (the documents are not visible to searches yet)
         for i in range(0, len(documents), batch_size):
             batch = documents[i:i + batch_size]
             texts = [doc.text for doc in batch]
@@ -94,60 +178,105 @@ class HybridRetriever:
             # Assign embeddings to documents
             for doc, embedding in zip(batch, embeddings):
                 doc.embedding = embedding
-                self.documents.append(doc)
         
-        # Build indices
-        self._build_sparse_index()
-        self._build_dense_index()
+        with self.cache_lock():
+            current = self._snapshot
+            source_counts = dict(current.source_counts)
+            for doc in documents:
+                source_counts[doc.source] = source_counts.get(doc.source, 0) + 1
+            
+            # Build indices aside, then publish them with the documents
+            self._snapshot = self._build_snapshot(
+                current.documents + list(documents), source_counts, current.corpus_version + 1
+            )
+            
+            # Cache the processed documents
+            self._write_cache()
+    
+    def remove_source(self, source: str) -> int:
+        """Remove every chunk from a source and rebuild the indices.
         
-        # Cache the processed documents
-        self._save_cache()
+        Returns:
+            Number of chunks removed
+        """
+        with self.cache_lock():
+            current = self._snapshot
+            removed = current.source_counts.get(source, 0)
+            if not removed:
+                return 0
+            
+            source_counts = {name: count for name, count in current.source_counts.items() if name != source}
+            self._snapshot = self._build_snapshot(
+                [doc for doc in current.documents if doc.source != source],
+                source_counts, current.corpus_version + 1
+            )
+            if not self._snapshot.documents:
+                (self.cache_dir / "faiss.index").unlink(missing_ok=True)
+            
+            self._write_cache()
+            return removed
+    
+    def _build_snapshot(self, documents: List[Document], source_counts: Dict[str, int],
+                        corpus_version: int) -> CorpusSnapshot:
+        """A new snapshot of ``documents`` with freshly built indices."""
+        if not documents:
+            return CorpusSnapshot(source_counts=source_counts, corpus_version=corpus_version)
+        embeddings = np.vstack([doc.embedding for doc in documents]).astype(np.float32)
+        index, index_type = self._build_dense_index(documents, embeddings)
+        return CorpusSnapshot(
+            documents=documents,
+            bm25=self._build_sparse_index(documents),
+            index=index,
+            embeddings=embeddings,
+            source_counts=source_counts,
+            index_type=index_type,
+            corpus_version=corpus_version
+        )
         
-    def _build_sparse_index(self):
+    def _build_sparse_index(self, documents: List[Document]):
         """Build BM25 index for sparse retrieval."""
         if BM25Okapi is None:
             print("Warning: rank-bm25 not installed. Skipping sparse index.")
-            return
+            return None
             
         # Tokenize documents for BM25
-        tokenized_docs = [doc.text.lower().split() for doc in self.documents]
-        self.bm25 = BM25Okapi(tokenized_docs)
-        
-    def _build_dense_index(self):
-        """Build FAISS/ChromaDB index for dense retrieval."""
-        if not self.documents:
-            return
-            
-        embeddings = np.array([doc.embedding for doc in self.documents])
+        tokenized_docs = [doc.text.lower().split() for doc in documents]
+        return BM25Okapi(tokenized_docs)
         
+    def _build_dense_index(self, documents: List[Document], embeddings: np.ndarray):
+        """Build FAISS/ChromaDB index for dense retrieval; returns the FAISS index (or None) and index type."""
         if faiss is not None:
             # Use FAISS for efficient similarity search
+            embeddings = embeddings.copy()  # Normalized in place below
             dimension = embeddings.shape[1]
             
             # Choose index type based on dataset size
-            if len(self.documents) < 10000:
+            if len(documents) < 10000:
                 # For small datasets, use exact search
-                self.index = faiss.IndexFlatIP(dimension)
+                index = faiss.IndexFlatIP(dimension)
             else:
                 # For larger datasets, use approximate search
-                self.index = faiss.IndexIVFFlat(
+                index = faiss.IndexIVFFlat(
                     faiss.IndexFlatIP(dimension),
                     dimension,
-                    min(len(self.documents) // 10, 100)
+                    min(len(documents) // 10, 100)
                 )
-                self.index.train(embeddings)
+                index.train(embeddings)
             
             # Normalize embeddings for cosine similarity
             faiss.normalize_L2(embeddings)
-            self.index.add(embeddings)
+            index.add(embeddings)
+            return index, 'FAISS'
             
         elif chromadb is not None:
             # Use ChromaDB as alternative
-            self._init_chromadb(embeddings)
+            self._init_chromadb(documents, embeddings)
+            return None, 'ChromaDB'
         else:
             print("Warning: Neither FAISS nor ChromaDB installed. Using numpy for similarity search.")
+            return None, 'NumPy'
             
-    def _init_chromadb(self, embeddings):
+    def _init_chromadb(self, documents: List[Document], embeddings):
         """Initialize ChromaDB collection."""
         client = chromadb.Client(Settings(persist_directory=str(self.cache_dir)))
         
@@ -161,9 +290,9 @@ class HybridRetriever:
         # Add documents
         self.collection.add(
             embeddings=[emb.tolist() for emb in embeddings],
-            documents=[doc.text for doc in self.documents],
-            metadatas=[{"source": doc.source, "page": doc.page} for doc in self.documents],
-            ids=[doc.id for doc in self.documents]
+            documents=[doc.text for doc in documents],
+            metadatas=[{"source": doc.source, "page": doc.page} for doc in documents],
+            ids=[doc.id for doc in documents]
         )
     
     def search(
@@ -175,10 +304,12 @@ class HybridRetriever:
         alpha: float = 0.5  # Weight for hybrid search (0=sparse only, 1=dense only)
     ) -> List[Tuple[Document, float]]:
         """Perform hybrid search with optional reranking."""
+        self.refresh_if_stale()
+        corpus = self._snapshot  # One consistent view, even if the corpus is replaced meanwhile
         
         # Get candidates from both sparse and dense search
-        sparse_results = self._sparse_search(query, k * 3) if alpha < 1 else []
-        dense_results = self._dense_search(query, k * 3) if alpha > 0 else []
+        sparse_results = self._sparse_search(corpus, query, k * 3) if alpha < 1 else []
+        dense_results = self._dense_search(corpus, query, k * 3) if alpha > 0 else []
         
         # Combine results with weighted scores
         combined_scores = {}
@@ -197,8 +328,7 @@ class HybridRetriever:
         # Get top candidates
         candidates = []
         for doc_id, score in combined_scores.items():
-            doc = next(d for d in self.documents if d.id == doc_id)
-            candidates.append((doc, score))
+            candidates.append((corpus.by_id[doc_id], score))
         
         candidates.sort(key=lambda x: x[1], reverse=True)
         candidates = candidates[:k * 2]  # Keep more for reranking
@@ -215,13 +345,13 @@ class HybridRetriever:
         
         return candidates
     
-    def _sparse_search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+    def _sparse_search(self, corpus: CorpusSnapshot, query: str, k: int) -> List[Tuple[Document, float]]:
         """BM25 sparse search."""
-        if self.bm25 is None:
+        if corpus.bm25 is None:
             return []
         
         tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
+        scores = corpus.bm25.get_scores(tokenized_query)
         
         # Get top k documents
         top_indices = np.argsort(scores)[-k:][::-1]
@@ -229,12 +359,15 @@ class HybridRetriever:
         
         for idx in top_indices:
             if scores[idx] > 0:
-                results.append((self.documents[idx], float(scores[idx])))
+                results.append((corpus.documents[idx], float(scores[idx])))
         
         return results
     
-    def _dense_search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+    def _dense_search(self, corpus: CorpusSnapshot, query: str, k: int) -> List[Tuple[Document, float]]:
         """Dense embedding search."""
+        if not corpus.documents:
+            return []
+        
         # Generate query embedding
         query_embedding = self.embedder.encode(
             query,
@@ -242,16 +375,16 @@ class HybridRetriever:
             device='cuda' if self.use_gpu else 'cpu'
         )
         
-        if faiss is not None and self.index is not None:
+        if faiss is not None and corpus.index is not None:
             # FAISS search
             query_embedding = query_embedding.reshape(1, -1)
             faiss.normalize_L2(query_embedding)
-            scores, indices = self.index.search(query_embedding, k)
+            scores, indices = corpus.index.search(query_embedding, k)
             
             results = []
             for idx, score in zip(indices[0], scores[0]):
                 if idx >= 0:  # FAISS returns -1 for missing results
-                    results.append((self.documents[idx], float(score)))
+                    results.append((corpus.documents[idx], float(score)))
             return results
             
         elif chromadb is not None and hasattr(self, 'collection'):
@@ -263,20 +396,21 @@ class HybridRetriever:
             
             doc_results = []
             for i, doc_id in enumerate(results['ids'][0]):
-                doc = next(d for d in self.documents if d.id == doc_id)
+                doc = corpus.by_id.get(doc_id)
+                if doc is None:  # Collection already rebuilt for a newer corpus
+                    continue
                 score = 1 - results['distances'][0][i]  # Convert distance to similarity
                 doc_results.append((doc, score))
             return doc_results
             
         else:
             # Fallback to numpy similarity
-            embeddings = np.array([doc.embedding for doc in self.documents])
-            similarities = np.dot(embeddings, query_embedding)
+            similarities = np.dot(corpus.embeddings, query_embedding)
             top_indices = np.argsort(similarities)[-k:][::-1]
             
             results = []
             for idx in top_indices:
-                results.append((self.documents[idx], float(similarities[idx])))
+                results.append((corpus.documents[idx], float(similarities[idx])))
             return results
     
     def _rerank(self, query: str, candidates: List[Tuple[Document, float]], k: int) -> List[Tuple[Document, float]]:
@@ -330,41 +464,110 @@ class HybridRetriever:
         return filtered
     
     def _save_cache(self):
-        """Save processed documents and indices to cache."""
+        """Save processed documents and indices to cache.
+        
+        Embeddings go to a separate ``.npy`` file so readers can map them
+        instead of unpickling a private copy. Files are replaced atomically
+        and the pickle is written last, since its mtime tells other
+        processes to reload.
+        """
+        with self.cache_lock():
+            self._write_cache()
+    
+    def _write_cache(self):
+        corpus = self._snapshot
         cache_file = self.cache_dir / "rag_cache.pkl"
         
+        embeddings_file = self.cache_dir / "embeddings.npy"
+        if corpus.documents:
+            with (self.cache_dir / "embeddings.tmp.npy").open('wb') as f:
+                np.save(f, corpus.embeddings)
+            (self.cache_dir / "embeddings.tmp.npy").replace(embeddings_file)
+        else:
+            embeddings_file.unlink(missing_ok=True)
+        
+        # Save FAISS index separately
+        if faiss is not None and corpus.index is not None:
+            faiss.write_index(corpus.index, str(self.cache_dir / "faiss.tmp.index"))
+            (self.cache_dir / "faiss.tmp.index").replace(self.cache_dir / "faiss.index")
+        
         cache_data = {
-            'documents': self.documents,
-            'bm25': self.bm25,
+            'documents': [replace(doc, embedding=None) for doc in corpus.documents],
+            'embeddings_file': embeddings_file.name,
+            'bm25': corpus.bm25,
+            'stats': {
+                'source_counts': corpus.source_counts,
+                'index_type': corpus.index_type,
+                'corpus_version': corpus.corpus_version
+            },
             'timestamp': datetime.now().isoformat()
         }
         
-        with cache_file.open('wb') as f:
+        temp_file = cache_file.with_suffix('.tmp')
+        with temp_file.open('wb') as f:
             pickle.dump(cache_data, f)
-        
-        # Save FAISS index separately
-        if faiss is not None and self.index is not None:
-            faiss.write_index(self.index, str(self.cache_dir / "faiss.index"))
+        temp_file.replace(cache_file)
+        self._cache_stamp = self._cache_file_stamp()
     
     def load_cache(self) -> bool:
-        """Load cached documents and indices."""
+        """Load cached documents and indices.
+        
+        Embeddings and the FAISS index are memory-mapped read-only where
+        possible, so processes loading the same cache share those pages. The
+        loaded corpus replaces the current one as a single new snapshot.
+        """
         cache_file = self.cache_dir / "rag_cache.pkl"
         
         if not cache_file.exists():
             return False
         
         try:
+            stamp = self._cache_file_stamp()
             with cache_file.open('rb') as f:
                 cache_data = pickle.load(f)
             
-            self.documents = cache_data['documents']
-            self.bm25 = cache_data['bm25']
+            documents = cache_data['documents']
+            
+            embeddings = None
+            if cache_data.get('embeddings_file'):
+                embeddings = np.load(self.cache_dir / cache_data['embeddings_file'], mmap_mode='r')
+                for doc, embedding in zip(documents, embeddings):
+                    doc.embedding = embedding
+            elif documents and documents[0].embedding is not None:  # Older caches pickled them with the documents
+                embeddings = np.vstack([doc.embedding for doc in documents]).astype(np.float32)
             
             # Load FAISS index
+            index = None
             faiss_index_file = self.cache_dir / "faiss.index"
             if faiss is not None and faiss_index_file.exists():
-                self.index = faiss.read_index(str(faiss_index_file))
+                try:
+                    index = faiss.read_index(str(faiss_index_file), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except Exception:
+                    index = faiss.read_index(str(faiss_index_file))
+            
+            stats = cache_data.get('stats')
+            if stats is not None:
+                source_counts = stats['source_counts']
+                index_type = stats['index_type']
+                corpus_version = stats['corpus_version']
+            else:
+                # Caches written before counters existed: count once at load time
+                source_counts = {}
+                for doc in documents:
+                    source_counts[doc.source] = source_counts.get(doc.source, 0) + 1
+                index_type = 'FAISS' if faiss and index else 'ChromaDB' if chromadb else 'NumPy'
+                corpus_version = 1 if documents else 0
             
+            self._snapshot = CorpusSnapshot(
+                documents=documents,
+                bm25=cache_data['bm25'],
+                index=index,
+                embeddings=embeddings,
+                source_counts=source_counts,
+                index_type=index_type,
+                corpus_version=corpus_version
+            )
+            self._cache_stamp = stamp
             print(f"Loaded RAG cache from {cache_data['timestamp']}")
             return True
             
@@ -389,9 +592,10 @@ class AdvancedRAGSystem:
         self.chunk_overlap = chunk_overlap
         self.retriever = HybridRetriever(embedding_model, rerank_model)
         
-        # Try to load from cache first
-        if not self.retriever.load_cache():
-            self._process_documents()
+        # Try to load from cache first; one process builds it while others wait
+        with self.retriever.cache_lock():
+            if not self.retriever.load_cache():
+                self._process_documents()
     
     def _process_documents(self):
         """Process all documents in the docs directory."""
@@ -543,22 +747,30 @@ class AdvancedRAGSystem:
         
         return combined_context, citations, documents
     
+    def has_documents(self) -> bool:
+        """Cheap check that the corpus is not empty."""
+        return bool(self.retriever.documents)
+    
+    def get_source_breakdown(self) -> Dict[str, int]:
+        """Chunk count per source file name, from the maintained counters."""
+        source_counts = {}
+        for source, count in self.retriever.source_counts.items():
+            source_name = Path(source).name
+            source_counts[source_name] = source_counts.get(source_name, 0) + count
+        return source_counts
+    
+    def remove_source(self, source: str) -> int:
+        """Remove a source document from the index."""
+        return self.retriever.remove_source(source)
+    
     def get_statistics(self) -> Dict[str, Any]:
         """Get statistics about the RAG system."""
-        stats = {
+        return {
             'total_documents': len(self.retriever.documents),
-            'total_sources': len(set(doc.source for doc in self.retriever.documents)),
-            'index_type': 'FAISS' if faiss and self.retriever.index else 'ChromaDB' if chromadb else 'NumPy',
+            'total_sources': len(self.retriever.source_counts),
+            'index_type': self.retriever.index_type,
             'has_sparse_index': self.retriever.bm25 is not None,
-            'has_reranker': self.retriever.reranker is not None
-        }
-        
-        # Source breakdown
-        source_counts = {}
-        for doc in self.retriever.documents:
-            source_name = Path(doc.source).name
-            source_counts[source_name] = source_counts.get(source_name, 0) + 1
-        
-        stats['source_breakdown'] = source_counts
-        
-        return stats 
\ No newline at end of file
+            'has_reranker': self.retriever.reranker is not None,
+            'corpus_version': self.retriever.corpus_version,
+            'source_breakdown': self.get_source_breakdown()
+        } 
\ No newline at end of file
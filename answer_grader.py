@@ -0,0 +1,212 @@
+"""Embedding-based first-stage grader for subjective answers."""
+import argparse
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Combined similarity at or above the pass threshold is a local pass, at or
+# below the fail threshold a local fail; everything else is sent to the LLM.
+# Similarity measures relevance, not correctness, so neither is set by default:
+# a threshold is only used once the agreement report in CALIBRATION_FILE shows
+# its decisions match LLM grading on a labelled set.
+PASS_THRESHOLD = None
+FAIL_THRESHOLD = None
+CALIBRATION_FILE = Path('grader_calibration.json')
+MIN_AGREEMENT = 0.95         # Agreement with the LLM a threshold's decisions need
+MIN_DECISIONS = 50           # Labelled decisions a threshold needs before it is trusted
+
+
+@dataclass
+class GradeResult:
+    """Outcome of local grading."""
+    score: float
+    decided: bool
+    is_correct: Optional[bool] = None
+    reason: str = ""
+
+
+class FastGrader:
+    """Grades subjective answers locally using the already-loaded RAG models.
+
+    The student answer is compared with reference answers (if the question
+    carries one) and retrieved key passages using the sentence-transformer,
+    optionally blended with the cross-encoder. Both score how related the
+    answer is to the material, not whether it is right, so answers are only
+    decided locally by thresholds that ``load_calibration`` accepted; with
+    none set, every answer gets a full LLM grading call.
+    """
+
+    def __init__(self, embedder, reranker=None,
+                 pass_threshold: Optional[float] = PASS_THRESHOLD,
+                 fail_threshold: Optional[float] = FAIL_THRESHOLD):
+        self.embedder = embedder
+        self.reranker = reranker
+        self.pass_threshold = pass_threshold
+        self.fail_threshold = fail_threshold
+
+    def similarity(self, answer: str, references: List[str]) -> float:
+        """Best similarity in [0, 1] between the answer and any reference."""
+        if not references:
+            return 0.0
+
+        vectors = self.embedder.encode(
+            [answer] + references,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        cosine = np.clip(vectors[1:] @ vectors[0], 0.0, 1.0)
+
+        if self.reranker is None:
+            return float(cosine.max())
+
+        logits = np.asarray(self.reranker.predict([[ref, answer] for ref in references]))
+        relevance = 1.0 / (1.0 + np.exp(-logits))
+        return float((0.5 * cosine + 0.5 * relevance).max())
+
+    def grade(self, answer: str, references: List[str]) -> GradeResult:
+        """Decide answers past a calibrated threshold; mark everything else undecided."""
+        if self.pass_threshold is None and self.fail_threshold is None:
+            return GradeResult(score=0.0, decided=False)
+        references = [ref for ref in references if ref and ref.strip()]
+        if not references:
+            return GradeResult(score=0.0, decided=False)
+
+        score = self.similarity(answer, references)
+        if self.pass_threshold is not None and score >= self.pass_threshold:
+            return GradeResult(score=score, decided=True, is_correct=True,
+                               reason="Your answer closely matches the key points in the source material.")
+        if self.fail_threshold is not None and score <= self.fail_threshold:
+            return GradeResult(score=score, decided=True, is_correct=False,
+                               reason="Your answer does not address the key points in the source material.")
+        return GradeResult(score=score, decided=False)
+
+
+def parse_llm_grade(response: str) -> Tuple[Optional[float], str]:
+    """Extract a 0-1 score and feedback from an LLM grading response.
+
+    Tolerates markdown (``**SCORE:** 0.8``), fractions (``8/10``) and
+    percentages, which the plain ``SCORE:`` line parser used to reject.
+    """
+    score = None
+    match = re.search(r'score\W*?(\d+(?:\.\d+)?)\s*(%|/\s*(\d+(?:\.\d+)?))?', response, re.IGNORECASE)
+    if match:
+        value = float(match.group(1))
+        if match.group(3):
+            value = value / float(match.group(3)) if float(match.group(3)) else 0.0
+        elif match.group(2) == '%' or value > 10:
+            value = value / 100
+        elif value > 1:
+            value = value / 10
+        score = min(max(value, 0.0), 1.0)
+
+    feedback_match = re.search(r'feedback\W*(.+)', response, re.IGNORECASE | re.DOTALL)
+    if feedback_match:
+        feedback = feedback_match.group(1).strip()
+    else:
+        feedback = re.sub(r'.*score.*\n?', '', response, flags=re.IGNORECASE).strip()
+    return score, feedback
+
+
+def evaluate_agreement(samples: List[Dict], grader: FastGrader,
+                       llm_grade: Callable[[Dict], bool],
+                       references_for: Callable[[Dict], List[str]]) -> Dict:
+    """Measure how often local decisions agree with LLM grading on a held-out set.
+
+    Each sample needs ``question`` and ``answer``; ``llm_correct`` is used as the
+    label when present, otherwise ``llm_grade(sample)`` is called.
+    """
+    decided = agreed = 0
+    confusion = {'tp': 0, 'tn': 0, 'fp': 0, 'fn': 0}
+
+    for sample in samples:
+        result = grader.grade(sample['answer'], references_for(sample))
+        if not result.decided:
+            continue
+        label = sample['llm_correct'] if 'llm_correct' in sample else llm_grade(sample)
+        decided += 1
+        agreed += int(result.is_correct == label)
+        key = ('t' if result.is_correct == label else 'f') + ('p' if result.is_correct else 'n')
+        confusion[key] += 1
+
+    total = len(samples)
+    passes, fails = confusion['tp'] + confusion['fp'], confusion['tn'] + confusion['fn']
+    return {
+        'samples': total,
+        'decided_locally': decided,
+        'coverage': decided / total if total else 0.0,
+        'agreement': agreed / decided if decided else 0.0,
+        'pass_decisions': passes,
+        'pass_agreement': confusion['tp'] / passes if passes else 0.0,
+        'fail_decisions': fails,
+        'fail_agreement': confusion['tn'] / fails if fails else 0.0,
+        'confusion': confusion,
+        'pass_threshold': grader.pass_threshold,
+        'fail_threshold': grader.fail_threshold
+    }
+
+
+def load_calibration(path: Path = CALIBRATION_FILE) -> Tuple[Optional[float], Optional[float]]:
+    """``(pass_threshold, fail_threshold)`` from an agreement report, each None unless it earned trust.
+
+    A threshold is used only if the report holds at least ``MIN_DECISIONS``
+    labelled decisions on its side that agree with the LLM at least
+    ``MIN_AGREEMENT`` of the time.
+    """
+    if not path.exists():
+        return None, None
+    try:
+        with path.open('r') as f:
+            report = json.load(f)
+    except Exception as e:
+        print(f"Error loading grader calibration {path}: {e}")
+        return None, None
+
+    thresholds = []
+    for side in ('pass', 'fail'):
+        threshold = report.get(f'{side}_threshold')
+        trusted = (report.get(f'{side}_decisions', 0) >= MIN_DECISIONS
+                   and report.get(f'{side}_agreement', 0.0) >= MIN_AGREEMENT)
+        if threshold is not None and not trusted:
+            print(f"Ignoring uncalibrated {side} threshold {threshold} in {path}")
+        thresholds.append(threshold if trusted else None)
+    return thresholds[0], thresholds[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report fast-grader agreement with LLM grading.")
+    parser.add_argument("holdout", type=Path,
+                        help="JSONL file with question, answer and optional reference_answer / llm_correct")
+    parser.add_argument("--pass-threshold", type=float, default=PASS_THRESHOLD,
+                        help="Candidate pass threshold to calibrate (default: no local passes)")
+    parser.add_argument("--fail-threshold", type=float, default=FAIL_THRESHOLD,
+                        help="Candidate fail threshold to calibrate (default: no local fails)")
+    parser.add_argument("--write", action="store_true",
+                        help=f"Save the report to {CALIBRATION_FILE}, where the server reads thresholds from")
+    args = parser.parse_args()
+
+    from domain_expert import fast_grader, grade_with_llm, grading_references, rag_system
+
+    with args.holdout.open('r') as f:
+        holdout = [json.loads(line) for line in f if line.strip()]
+
+    def _references(sample: Dict) -> List[str]:
+        question = {'text': sample['question'], 'reference_answer': sample.get('reference_answer')}
+        _, _, documents = rag_system.retrieve(query=sample['question'], k=5)
+        return grading_references(question, documents)
+
+    def _llm_label(sample: Dict) -> bool:
+        is_correct, _ = grade_with_llm({'text': sample['question']}, sample['answer'])
+        return is_correct
+
+    grader = FastGrader(fast_grader.embedder, fast_grader.reranker, args.pass_threshold, args.fail_threshold)
+    report = evaluate_agreement(holdout, grader, _llm_label, _references)
+    print(json.dumps(report, indent=2))
+    if args.write:
+        with CALIBRATION_FILE.open('w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Thresholds used by the server: {load_calibration()}")
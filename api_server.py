@@ -5,18 +5,26 @@ from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
 import asyncio
 from datetime import datetime
+import uuid
 
 # Import existing modules
 from memory import load_user, save_user, get_weak_areas, get_recommended_review_topics, get_performance_summary, record_learning_session
 from planner import PlannerAgent
 from domain_expert import (
-    generate_question, check_answer, show_available_sources, get_llm_info, 
+    check_answer, show_available_sources, get_llm_info, 
     set_llm_provider, explain_concept, generate_example, generate_summary,
-    query_domain_expert, retrieve_context_with_citations, generate_hint
+    query_domain_expert, retrieve_context_with_citations, generate_hint,
+    retrieve_shared_context
 )
 from interactive_session import InteractiveSession, Command
 from enhanced_memory import EnhancedMemorySystem
 from llm_providers import llm_manager
+from question_bank import serve_question
+from chat_store import chat_store
+from cohort_analytics import cohort_analytics
+from due_scheduler import DUE_SOON_SECONDS, due_scheduler
+from session_store import session_store
+from shared_state import shared_state
 
 app = FastAPI(title="AI Tutoring System API", version="1.0.0")
 
@@ -43,6 +51,7 @@ class QuestionRequest(BaseModel):
     previous_questions: Optional[List[str]] = []
     difficulty: str = "medium"
     question_type: str = "conceptual"
+    username: Optional[str] = None
 
 class AnswerRequest(BaseModel):
     question: str
@@ -74,12 +83,14 @@ class ChatMessage(BaseModel):
     message: str
     username: str
     context: Optional[str] = None
+    lazy_suggestions: bool = False  # Return the answer first, fetch suggestions separately
 
 class ChatResponse(BaseModel):
     response: str
     citations: Optional[List[str]] = None
     suggestions: Optional[List[str]] = None
     context: Optional[str] = None
+    message_id: Optional[str] = None
 
 class CommandRequest(BaseModel):
     command: str
@@ -87,9 +98,10 @@ class CommandRequest(BaseModel):
     username: str
     topic: Optional[str] = None
 
-# Global storage for active sessions (in production, use Redis or similar)
-active_sessions = {}
-chat_histories = {}  # Store chat histories per user
+# Interactive sessions live in session_store (bounded, with idle expiry)
+pending_suggestions: Dict[str, asyncio.Task] = {}  # Lazily computed chat suggestions by message id
+MAX_PENDING_SUGGESTIONS = 200
+SUGGESTION_WAIT_SECONDS = 60  # How long a worker waits for suggestions another worker is computing
 
 @app.get("/")
 async def root():
@@ -97,7 +109,7 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {"status": "healthy", "timestamp": datetime.now().isoformat(), "sessions": session_store.stats()}
 
 # User management endpoints
 @app.post("/api/users/create")
@@ -122,9 +134,9 @@ async def get_user_profile(username: str):
     """Get user profile and performance data."""
     try:
         profile = load_user(username)
-        performance = get_performance_summary(username)
-        weak_areas = get_weak_areas(username)
-        recommended_topics = get_recommended_review_topics(username, limit=5)
+        performance = get_performance_summary(username, profile=profile)
+        weak_areas = get_weak_areas(username, profile=profile)
+        recommended_topics = get_recommended_review_topics(username, limit=5, profile=profile)
         
         return {
             "profile": profile,
@@ -145,6 +157,57 @@ async def get_user_insights(username: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Cohort (class-wide) analytics endpoints
+@app.get("/api/cohort/summary")
+async def get_cohort_summary(top: int = 10):
+    """Class-wide weak topics, score distributions by difficulty and study times."""
+    try:
+        return await asyncio.to_thread(cohort_analytics.summary, top)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/cohort/topics")
+async def get_cohort_topics(top: int = 10):
+    """Topics most students are weak in, and the lowest-scoring topics."""
+    try:
+        summary = await asyncio.to_thread(cohort_analytics.summary, top)
+        return {
+            "students": summary["students"],
+            "weak_topics": summary["weak_topics"],
+            "lowest_scoring_topics": summary["lowest_scoring_topics"]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/cohort/difficulty")
+async def get_cohort_difficulty():
+    """Accuracy distribution across students for each question difficulty."""
+    try:
+        summary = await asyncio.to_thread(cohort_analytics.summary)
+        return {"students": summary["students"], "difficulty_distribution": summary["difficulty_distribution"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/cohort/study-times")
+async def get_cohort_study_times():
+    """Sessions and average score by hour of day across students."""
+    try:
+        summary = await asyncio.to_thread(cohort_analytics.summary)
+        return {"students": summary["students"], **summary["study_times"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Spaced repetition scheduling across users
+@app.get("/api/flashcards/due")
+async def get_due_flashcards(within: float = DUE_SOON_SECONDS, limit: int = 50):
+    """Cards due now and soon across all users, and the users who have them (soonest first)."""
+    try:
+        # Picks up other workers' writes from the change feed (the first call builds, off the event loop)
+        await asyncio.to_thread(due_scheduler.refresh)
+        return due_scheduler.summary(within, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Learning content endpoints
 @app.post("/api/content/explain")
 async def explain_concept_endpoint(request: ConceptRequest):
@@ -168,11 +231,12 @@ async def generate_example_endpoint(request: ExampleRequest):
 async def generate_question_endpoint(request: QuestionRequest):
     """Generate a question for a topic."""
     try:
-        question = generate_question(
+        question = serve_question(
             request.topic, 
             request.previous_questions,
             request.difficulty,
-            request.question_type
+            request.question_type,
+            username=request.username
         )
         return {"question": question, "topic": request.topic}
     except Exception as e:
@@ -202,7 +266,7 @@ async def get_learning_plan(username: str, topic: str):
     """Get a learning plan for a topic."""
     try:
         agent = PlannerAgent(username)
-        plan = agent.build_learning_plan(topic)
+        plan = await asyncio.to_thread(agent.build_learning_plan, topic)
         return plan
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -228,11 +292,12 @@ async def start_interactive_session(username: str, topic: str):
     """Start an interactive learning session."""
     try:
         session_id = f"{username}_{topic}_{datetime.now().timestamp()}"
-        session = InteractiveSession(username, topic)
-        active_sessions[session_id] = session
+        session = await asyncio.to_thread(InteractiveSession, username, topic, prompt_resume=False)
         
-        # Get initial content
-        plan = PlannerAgent(username).build_learning_plan(topic)
+        # Build the plan once and hand it to the session (before it is stored, so a resume keeps it)
+        plan = await asyncio.to_thread(session.planner.build_learning_plan, topic)
+        session.plan = plan
+        session_store.add(session_id, session)
         
         return {
             "session_id": session_id,
@@ -246,10 +311,10 @@ async def start_interactive_session(username: str, topic: str):
 @app.get("/api/sessions/{session_id}/status")
 async def get_session_status(session_id: str):
     """Get the status of an interactive session."""
-    if session_id not in active_sessions:
+    session = await asyncio.to_thread(session_store.get, session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    session = active_sessions[session_id]
     return {
         "session_id": session_id,
         "username": session.username,
@@ -260,8 +325,7 @@ async def get_session_status(session_id: str):
 @app.delete("/api/sessions/{session_id}")
 async def end_session(session_id: str):
     """End an interactive session."""
-    if session_id in active_sessions:
-        del active_sessions[session_id]
+    await asyncio.to_thread(session_store.remove, session_id)
     return {"success": True, "message": "Session ended"}
 
 # Document and source management
@@ -312,65 +376,119 @@ async def test_provider(provider: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Chat API endpoints
+async def _shared_chat_suggestions(message_id: str, message: str, context: str, citations: List[str]) -> List[str]:
+    """Generate suggestions and publish them for every worker."""
+    try:
+        suggestions = await asyncio.to_thread(_generate_chat_suggestions, message, context, citations)
+    except BaseException:
+        await asyncio.to_thread(shared_state.drop_suggestions, message_id)
+        raise
+    await asyncio.to_thread(shared_state.put_suggestions, message_id, suggestions)
+    return suggestions
+
+def _generate_chat_suggestions(message: str, context: str, citations: List[str]) -> List[str]:
+    """Suggest follow-up questions for a chat message from its retrieved context."""
+    if not context:
+        return []
+    suggestion_prompt = f"Based on the topic '{message}', suggest 3 short follow-up questions a student might want to ask. Return as a simple list."
+    suggestions_text = query_domain_expert(suggestion_prompt, context, citations, temperature=0.8)
+    # Parse suggestions (simple implementation)
+    return [s.strip('- ').strip() for s in suggestions_text.split('\n') if s.strip() and s.strip().startswith('-')][:3]
+
 @app.post("/api/chat/message")
 async def send_chat_message(message: ChatMessage):
-    """Send a message to the chatbot and get a response."""
+    """Send a message to the chatbot and get a response.
+    
+    Retrieval runs once; the answer and the follow-up suggestions are then
+    generated concurrently. With ``lazy_suggestions`` the answer is returned
+    immediately and suggestions are fetched from
+    ``/api/chat/message/{message_id}/suggestions``.
+    """
     try:
-        # Initialize chat history for user if not exists
-        if message.username not in chat_histories:
-            chat_histories[message.username] = []
-        
-        # Get context from RAG system
-        context, citations = retrieve_context_with_citations(message.message)
+        # Get context from RAG system (once for both generations)
+        retrieved = await asyncio.to_thread(retrieve_shared_context, message.message)
+        context, citations = retrieved.context, retrieved.citations
+        message_id = uuid.uuid4().hex
         
-        # Generate response using domain expert
-        response = query_domain_expert(
+        response_job = asyncio.to_thread(
+            query_domain_expert,
             f"You are a helpful AI tutor. Answer this question conversationally: {message.message}",
             context,
             citations
         )
-        
-        # Generate suggestions for follow-up questions
-        suggestions = []
-        if context:
-            suggestion_prompt = f"Based on the topic '{message.message}', suggest 3 short follow-up questions a student might want to ask. Return as a simple list."
-            suggestions_text = query_domain_expert(suggestion_prompt, context, citations, temperature=0.8)
-            # Parse suggestions (simple implementation)
-            suggestions = [s.strip('- ').strip() for s in suggestions_text.split('\n') if s.strip() and s.strip().startswith('-')][:3]
+        if message.lazy_suggestions:
+            # Suggestions may be fetched from another worker, which reads them from the shared state
+            await asyncio.to_thread(shared_state.expect_suggestions, message_id)
+            suggestions_task = asyncio.create_task(
+                _shared_chat_suggestions(message_id, message.message, context, citations)
+            )
+            pending_suggestions[message_id] = suggestions_task
+            while len(pending_suggestions) > MAX_PENDING_SUGGESTIONS:
+                pending_suggestions.pop(next(iter(pending_suggestions))).cancel()
+            response = await response_job
+            suggestions = None
+        else:
+            suggestions_task = asyncio.to_thread(_generate_chat_suggestions, message.message, context, citations)
+            response, suggestions = await asyncio.gather(response_job, suggestions_task)
         
         # Store in chat history
-        chat_histories[message.username].append({
-            "type": "user",
-            "message": message.message,
-            "timestamp": datetime.now().isoformat()
-        })
-        chat_histories[message.username].append({
-            "type": "assistant",
-            "message": response,
-            "citations": citations,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Keep chat history manageable (last 50 messages)
-        if len(chat_histories[message.username]) > 50:
-            chat_histories[message.username] = chat_histories[message.username][-50:]
+        await asyncio.to_thread(
+            chat_store.append,
+            message.username,
+            {
+                "type": "user",
+                "message": message.message,
+                "timestamp": datetime.now().isoformat()
+            },
+            {
+                "type": "assistant",
+                "message": response,
+                "citations": citations,
+                "timestamp": datetime.now().isoformat()
+            }
+        )
         
         return ChatResponse(
             response=response,
             citations=citations,
             suggestions=suggestions,
-            context=context[:200] + "..." if context and len(context) > 200 else context
+            context=context[:200] + "..." if context and len(context) > 200 else context,
+            message_id=message_id
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/chat/message/{message_id}/suggestions")
+async def get_message_suggestions(message_id: str):
+    """Get follow-up suggestions computed in the background for a chat message."""
+    task = pending_suggestions.pop(message_id, None)
+    if task is not None:
+        try:
+            return {"message_id": message_id, "suggestions": await task}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    # Started by another worker: wait for it to publish the result
+    deadline = asyncio.get_running_loop().time() + SUGGESTION_WAIT_SECONDS
+    while True:
+        known, suggestions = await asyncio.to_thread(shared_state.get_suggestions, message_id)
+        if not known:
+            raise HTTPException(status_code=404, detail="No pending suggestions for this message")
+        if suggestions is not None:
+            return {"message_id": message_id, "suggestions": suggestions}
+        if asyncio.get_running_loop().time() >= deadline:
+            raise HTTPException(status_code=504, detail="Suggestions are still being generated")
+        await asyncio.sleep(0.25)
+
 @app.get("/api/chat/{username}/history")
-async def get_chat_history(username: str, limit: int = 20):
-    """Get chat history for a user."""
+async def get_chat_history(username: str, limit: int = 20, before: Optional[int] = None):
+    """Get a page of a user's chat history, oldest message first.
+    
+    Pass the returned ``next_cursor`` as ``before`` to get the page of older messages;
+    a ``limit`` of 0 returns the whole history.
+    """
     try:
-        history = chat_histories.get(username, [])
-        # Return last 'limit' messages
-        return {"history": history[-limit:] if limit > 0 else history}
+        return await asyncio.to_thread(chat_store.history, username, limit, before)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -378,8 +496,7 @@ async def get_chat_history(username: str, limit: int = 20):
 async def clear_chat_history(username: str):
     """Clear chat history for a user."""
     try:
-        if username in chat_histories:
-            del chat_histories[username]
+        await asyncio.to_thread(chat_store.clear, username)
         return {"success": True, "message": "Chat history cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -421,7 +538,7 @@ async def execute_chat_command(command_req: CommandRequest):
         elif command_req.command == "!question":
             if not command_req.args:
                 return {"error": "Please specify a topic for question. Usage: !question <topic>"}
-            question = generate_question(command_req.args, [], "medium", "conceptual")
+            question = serve_question(command_req.args, [], "medium", "conceptual", username=command_req.username)
             return {"response": question, "type": "question", "topic": command_req.args}
         
         elif command_req.command == "!hint":
@@ -438,7 +555,7 @@ async def execute_chat_command(command_req: CommandRequest):
             if not command_req.args:
                 return {"error": "Please specify a topic for quiz. Usage: !quiz <topic>"}
             # Generate first question of a quiz
-            question = generate_question(command_req.args, [], "medium", "conceptual")
+            question = serve_question(command_req.args, [], "medium", "conceptual", username=command_req.username)
             return {
                 "response": f"Quiz started on {command_req.args}!\n\nQuestion 1: {question}",
                 "type": "quiz_start",
@@ -510,5 +627,23 @@ async def get_chat_suggestions(username: str):
         ]}
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    
+    parser = argparse.ArgumentParser(description="Run the tutoring API server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes (state is shared through user_data/ and event_log/)")
+    args = parser.parse_args()
+    
+    # Import legacy JSON profiles and upgrade flashcard logs once, before any worker starts serving
+    from profile_store import profile_store
+    from flashcards import migrate_decks
+    profile_store.migrate_json_profiles()
+    migrate_decks()
+    
+    if args.workers > 1:
+        uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port) 
\ No newline at end of file
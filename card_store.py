@@ -0,0 +1,132 @@
+"""Shared, content-addressed store of flashcard bodies."""
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+USER_DATA_DIR = Path('user_data')
+USER_DATA_DIR.mkdir(exist_ok=True)
+CARD_DB = USER_DATA_DIR / 'cards.db'
+
+CONTENT_FIELDS = ('front', 'back', 'subtopic')  # What a card's id is derived from
+MAX_CACHED_BODIES = 20000  # Card bodies kept in memory (least recently used evicted)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS card_bodies (
+    id TEXT PRIMARY KEY,
+    front TEXT NOT NULL,
+    back TEXT NOT NULL,
+    subtopic TEXT,
+    created_at TEXT
+);
+"""
+
+
+def content_id(body: Dict) -> str:
+    """Id of a card body: a hash of its front, back and subtopic."""
+    payload = json.dumps([body.get(field) for field in CONTENT_FIELDS], ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()[:20]
+
+
+class CardStore:
+    """Card text stored once, however many users have the card.
+
+    Users' flashcard state refers to bodies by ``content_id``; identical
+    generated questions across a class share one row. Bodies are immutable
+    (an edit creates a new id), so cached copies never go stale.
+    """
+
+    def __init__(self, db_path: Path = CARD_DB, max_cached: int = MAX_CACHED_BODIES):
+        self.db_path = db_path
+        self.max_cached = max_cached
+        self._local = threading.local()
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, cid: str, body: Dict) -> None:
+        with self._cache_lock:
+            self._cache[cid] = body
+            self._cache.move_to_end(cid)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    # ---- Writes ----
+    def put_many(self, bodies: Iterable[Dict]) -> List[str]:
+        """Store bodies (existing ones are left alone) and return their ids, in order."""
+        new, ids = {}, []
+        for body in bodies:
+            body = {field: body.get(field) for field in CONTENT_FIELDS}
+            cid = content_id(body)
+            ids.append(cid)
+            new[cid] = body
+        with self._cache_lock:
+            new = {cid: body for cid, body in new.items() if cid not in self._cache}
+        if new:
+            created_at = datetime.now().isoformat()
+            rows = [(cid, body['front'], body['back'], body['subtopic'], created_at) for cid, body in new.items()]
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO card_bodies (id, front, back, subtopic, created_at) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            # Cached only once stored, so a failed write leaves no body that exists nowhere else
+            for cid, body in new.items():
+                self._remember(cid, body)
+        return ids
+
+    def put(self, body: Dict) -> str:
+        return self.put_many([body])[0]
+
+    # ---- Reads ----
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        """Bodies by id (shared; do not modify). Unknown ids map to a placeholder."""
+        found, missing = {}, []
+        with self._cache_lock:
+            for cid in dict.fromkeys(ids):
+                body = self._cache.get(cid)
+                if body is None:
+                    missing.append(cid)
+                else:
+                    self._cache.move_to_end(cid)
+                    found[cid] = body
+        conn = self._connect()
+        for start in range(0, len(missing), 500):  # Stay under SQLite's parameter limit
+            chunk = missing[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(f'SELECT * FROM card_bodies WHERE id IN ({placeholders})', chunk):
+                body = {field: row[field] for field in CONTENT_FIELDS}
+                found[row['id']] = body
+                self._remember(row['id'], body)
+        for cid in missing:
+            if cid not in found:
+                print(f"Warning: flashcard body {cid} missing from {self.db_path}")
+                found[cid] = {'front': '[missing card]', 'back': '', 'subtopic': None}
+        return found
+
+    def get(self, cid: str) -> Dict:
+        return self.get_many([cid])[cid]
+
+
+# Global card store instance
+card_store = CardStore()
@@ -0,0 +1,241 @@
+"""Persistent chat history with a bounded in-memory window per user."""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+USER_DATA_DIR = Path('user_data')
+USER_DATA_DIR.mkdir(exist_ok=True)
+CHAT_DB = USER_DATA_DIR / 'chat.db'
+
+RECENT_MESSAGES = 50        # Messages per user kept in memory
+IDLE_SECONDS = 1800         # Users not chatting for this long are dropped from memory
+MAX_CACHED_USERS = 1000     # Users kept in memory (least recently used evicted)
+MARKS_POLL_SECONDS = 2.0    # How often a cached window looks for other processes' writes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    type TEXT NOT NULL,
+    message TEXT NOT NULL,
+    citations TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_user ON chat_messages(username, id);
+CREATE TABLE IF NOT EXISTS chat_cleared (
+    username TEXT PRIMARY KEY,
+    through_id INTEGER NOT NULL
+);
+"""
+
+
+def _row_message(row: sqlite3.Row) -> Dict:
+    message = {'id': row['id'], 'type': row['type'], 'message': row['message'], 'timestamp': row['timestamp']}
+    if row['citations'] is not None:
+        message['citations'] = json.loads(row['citations'])
+    return message
+
+
+class ChatStore:
+    """Chat messages appended to SQLite, with each user's latest ones in memory.
+
+    Messages are only ever inserted; clearing a history records the last
+    message id it hides, and ``compact()`` deletes hidden rows later. Each
+    user active recently has a deque of their last ``RECENT_MESSAGES``
+    messages, so the usual "latest page" read does not touch the database.
+    Older pages are read with a cursor: the id of the oldest message
+    already returned.
+    """
+
+    def __init__(self, db_path: Path = CHAT_DB, recent: int = RECENT_MESSAGES,
+                 idle_seconds: float = IDLE_SECONDS, max_users: int = MAX_CACHED_USERS,
+                 poll_seconds: float = MARKS_POLL_SECONDS):
+        self.db_path = db_path
+        self.recent = recent
+        self.idle_seconds = idle_seconds
+        self.max_users = max_users
+        self.poll_seconds = poll_seconds
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._recent: "OrderedDict[str, deque]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._window_marks: Dict[str, tuple] = {}
+        self._marks_checked: Dict[str, float] = {}
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _cleared_through(self, conn: sqlite3.Connection, username: str) -> int:
+        row = conn.execute('SELECT through_id FROM chat_cleared WHERE username = ?', (username,)).fetchone()
+        return row['through_id'] if row else 0
+
+    def _query(self, username: str, limit: Optional[int], before: Optional[int] = None,
+               after: int = 0) -> List[Dict]:
+        """Visible messages between ``after`` and ``before`` (newest ``limit`` of them), oldest first."""
+        conn = self._connect()
+        sql = 'SELECT * FROM chat_messages WHERE username = ? AND id > ?'
+        params = [username, max(after, self._cleared_through(conn, username))]
+        if before is not None:
+            sql += ' AND id < ?'
+            params.append(before)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(-1 if limit is None else limit)
+        return [_row_message(row) for row in reversed(conn.execute(sql, params).fetchall())]
+
+    def _marks(self, username: str):
+        """``(last message id, cleared through id)`` of a user as stored."""
+        row = self._connect().execute(
+            'SELECT (SELECT MAX(id) FROM chat_messages WHERE username = ?), '
+            '(SELECT through_id FROM chat_cleared WHERE username = ?)',
+            (username, username)
+        ).fetchone()
+        return row[0] or 0, row[1] or 0
+
+    # ---- Memory window ----
+    def _window(self, username: str, check: bool = False) -> deque:
+        """The user's recent messages, loaded on first use (the caller holds the lock).
+
+        Other processes (API workers) may write to the same database, so a
+        cached window is checked against the stored marks and caught up:
+        after this process writes (``check``), and otherwise at most every
+        ``poll_seconds``, so another process's messages show up that late.
+        """
+        window = self._recent.get(username)
+        now = time.time()
+        if window is not None and not check and now - self._marks_checked[username] < self.poll_seconds:
+            self._recent.move_to_end(username)
+            self._last_used[username] = now
+            return window
+        marks = self._marks(username)
+        if window is not None and marks != self._window_marks[username]:
+            last_id, cleared_through = self._window_marks[username]
+            if cleared_through != marks[1]:
+                window = None
+            else:
+                window.extend(self._query(username, self.recent, None, after=last_id))
+        if window is None:
+            window = deque(self._query(username, self.recent), maxlen=self.recent)
+            self._recent[username] = window
+        self._window_marks[username] = marks
+        self._marks_checked[username] = now
+        self._recent.move_to_end(username)
+        self._last_used[username] = now
+        self._evict()
+        return window
+
+    def _evict(self) -> None:
+        now = time.time()
+        while self._recent:
+            username = next(iter(self._recent))
+            if len(self._recent) <= self.max_users and now - self._last_used[username] < self.idle_seconds:
+                break
+            del self._recent[username]
+            del self._last_used[username]
+            del self._window_marks[username]
+            del self._marks_checked[username]
+
+    # ---- Writes ----
+    def append(self, username: str, *messages: Dict) -> List[Dict]:
+        """Store messages (dicts with ``type``, ``message``, ``timestamp`` and optional ``citations``)."""
+        conn = self._connect()
+        stored = []
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for message in messages:
+                    citations = message.get('citations')
+                    cursor = conn.execute(
+                        'INSERT INTO chat_messages (username, type, message, citations, timestamp) VALUES (?, ?, ?, ?, ?)',
+                        (username, message['type'], message['message'],
+                         None if citations is None else json.dumps(citations), message['timestamp'])
+                    )
+                    stored.append(dict(message, id=cursor.lastrowid))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if username in self._recent:
+                self._window(username, check=True)  # Catches up with the rows just written
+        return stored
+
+    def clear(self, username: str) -> None:
+        """Hide every message the user has so far."""
+        conn = self._connect()
+        with self._lock:
+            conn.execute(
+                'INSERT INTO chat_cleared (username, through_id) '
+                'SELECT ?, COALESCE(MAX(id), 0) FROM chat_messages WHERE username = ? '
+                'ON CONFLICT(username) DO UPDATE SET through_id = excluded.through_id',
+                (username, username)
+            )
+            self._recent.pop(username, None)
+            self._last_used.pop(username, None)
+            self._window_marks.pop(username, None)
+            self._marks_checked.pop(username, None)
+
+    def compact(self) -> int:
+        """Delete rows hidden by ``clear``; returns the number removed."""
+        conn = self._connect()
+        cursor = conn.execute(
+            'DELETE FROM chat_messages WHERE id <= '
+            '(SELECT through_id FROM chat_cleared WHERE chat_cleared.username = chat_messages.username)'
+        )
+        return cursor.rowcount
+
+    # ---- Reads ----
+    def history(self, username: str, limit: int = 20, before: Optional[int] = None) -> Dict:
+        """A page of the user's messages, oldest first.
+
+        ``before`` is the cursor from the previous page (None for the latest
+        messages). The returned ``next_cursor`` is None when there is nothing
+        older. A ``limit`` of 0 (or less) returns every visible message
+        before the cursor in one page, read from the database.
+        """
+        if limit <= 0:
+            return {'history': self._query(username, None, before), 'next_cursor': None}
+        with self._lock:
+            window = list(self._window(username))
+        # A window with room left holds every visible message
+        complete = len(window) < self.recent
+        page = [message for message in window if before is None or message['id'] < before][-limit:]
+        if len(page) < limit and not complete:
+            page = self._query(username, limit - len(page), page[0]['id'] if page else before) + page
+
+        if len(page) < limit or not page:
+            next_cursor = None
+        elif complete:
+            next_cursor = page[0]['id'] if page[0]['id'] > window[0]['id'] else None
+        else:
+            next_cursor = page[0]['id'] if self._query(username, 1, page[0]['id']) else None
+        return {'history': page, 'next_cursor': next_cursor}
+
+    def cached_users(self) -> int:
+        with self._lock:
+            self._evict()
+            return len(self._recent)
+
+
+# Global chat store instance
+chat_store = ChatStore()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the chat history store.")
+    parser.add_argument("--compact", action="store_true", help="Delete cleared chat messages")
+    args = parser.parse_args()
+
+    if args.compact:
+        print(f"Removed {chat_store.compact()} cleared messages")
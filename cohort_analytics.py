@@ -0,0 +1,325 @@
+"""Class-wide learning analytics computed over every user at once."""
+import argparse
+import itertools
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from memory import AGGREGATES_SCHEMA, rebuild_aggregates
+from profile_store import ProfileStore, profile_store
+from shared_state import shared_state
+
+DIFFICULTIES = ['easy', 'medium', 'hard']
+MASTERY_LEVELS = ['mastered', 'intermediate', 'beginner']
+HISTOGRAM_BINS = 10        # Accuracy histogram buckets over [0, 1]
+ANALYTICS_DIR = Path('.')  # Where the per-user analytics_<username>.json files live
+ANALYTICS_CHANNEL = 'analytics'  # Change feed channel analytics writers bump with the username
+FULL_SCAN_SECONDS = 600   # Interval between full scans catching writes made outside the change feeds
+
+
+def _grow(array: np.ndarray, rows: int) -> np.ndarray:
+    """Return ``array`` with room for at least ``rows`` rows (doubling capacity)."""
+    if array.shape[0] >= rows:
+        return array
+    grown = np.zeros((max(rows, 2 * array.shape[0]),) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+class CohortAnalytics:
+    """Columnar copy of every user's performance data with vectorized aggregates.
+
+    The first refresh reads all profiles and analytics files in one pass into
+    numpy arrays (one row per user, or per user and topic). Later refreshes
+    ask the profile store's change feed and the shared analytics change feed
+    which users were written since the last call (two indexed queries) and
+    re-read only those, so a refresh with nothing new costs no per-user
+    work. Versions and file stamps are compared for every user only every
+    ``FULL_SCAN_SECONDS``, to catch writes that bypassed the feeds. The
+    computed summary is cached until something changes.
+    """
+
+    def __init__(self, store: ProfileStore = profile_store, analytics_dir: Path = ANALYTICS_DIR):
+        self.store = store
+        self.analytics_dir = analytics_dir
+        self._lock = threading.RLock()
+
+        # Per user: difficulty (total, correct), mastery counts, per-hour (sessions, score sum)
+        self._user_rows: Dict[str, int] = {}
+        self._usernames: List[str] = []
+        self._difficulty = np.zeros((0, len(DIFFICULTIES), 2))
+        self._mastery = np.zeros((0, len(MASTERY_LEVELS)), dtype=np.int64)
+        self._hours = np.zeros((0, 24, 2))
+        self._versions: Dict[str, int] = {}
+        self._analytics_stamps: Dict[str, int] = {}
+        self._profile_seq: Optional[int] = None   # Change feed positions (None until the first load)
+        self._analytics_seq = 0
+        self._last_scan = 0.0
+
+        # Per user and topic: average score and attempts; rows of removed topics are masked out
+        self._topics: Dict[str, int] = {}
+        self._topic_names: List[str] = []
+        self._perf_rows: Dict[tuple, int] = {}
+        self._perf_by_user: Dict[int, List[int]] = {}
+        self._perf_user = np.zeros(0, dtype=np.int64)
+        self._perf_topic = np.zeros(0, dtype=np.int64)
+        self._perf_attempts = np.zeros(0)
+        self._perf_score = np.zeros(0)
+        self._perf_valid = np.zeros(0, dtype=bool)
+        self._perf_count = 0
+
+        # Weak areas as topic indices per user
+        self._weak: Dict[int, List[int]] = {}
+
+        self._summary: Optional[Dict] = None
+
+    # ---- Loading ----
+    def _user_row(self, username: str) -> int:
+        row = self._user_rows.get(username)
+        if row is None:
+            row = len(self._usernames)
+            self._user_rows[username] = row
+            self._usernames.append(username)
+            self._difficulty = _grow(self._difficulty, row + 1)
+            self._mastery = _grow(self._mastery, row + 1)
+            self._hours = _grow(self._hours, row + 1)
+        return row
+
+    def _topic_index(self, topic: str) -> int:
+        index = self._topics.get(topic)
+        if index is None:
+            index = len(self._topic_names)
+            self._topics[topic] = index
+            self._topic_names.append(topic)
+        return index
+
+    def _analytics_stamp(self, username: str) -> Optional[int]:
+        try:
+            return (self.analytics_dir / f'analytics_{username}.json').stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _analytics_files(self) -> Dict[str, int]:
+        stamps = {}
+        for path in self.analytics_dir.glob('analytics_*.json'):
+            try:
+                stamps[path.stem[len('analytics_'):]] = path.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return stamps
+
+    def _load_profiles(self, usernames: Optional[List[str]]) -> None:
+        """Read users' rows (all of them if ``usernames`` is None) into the arrays."""
+        for row in self.store.bulk_users(usernames):
+            user = self._user_row(row['username'])
+            aggregates = json.loads(row['aggregates'])
+            if aggregates.get('schema') != AGGREGATES_SCHEMA:
+                # Profile not written since running aggregates were introduced: compute them here
+                # (reads stay read-only; ``profile_store --verify-aggregates`` stores them)
+                aggregates = rebuild_aggregates(json.loads(row['topic_mastery']),
+                                                self.store.read_performance(row['username']))
+            for j, difficulty in enumerate(DIFFICULTIES):
+                counts = aggregates['difficulties'][difficulty]
+                self._difficulty[user, j] = (counts['total'], counts['correct'])
+            self._mastery[user] = [aggregates['mastery_counts'][level] for level in MASTERY_LEVELS]
+            self._versions[row['username']] = row['version']
+
+        if usernames is None:
+            self._perf_valid[:] = False
+            self._weak.clear()
+        else:
+            for user in {self._user_row(name) for name in usernames}:
+                self._perf_valid[self._perf_by_user.get(user, [])] = False
+                self._weak.pop(user, None)
+
+        for row in self.store.bulk_topic_performance(usernames):
+            user, topic = self._user_row(row['username']), self._topic_index(row['topic'])
+            index = self._perf_rows.get((user, topic))
+            if index is None:
+                index = self._perf_count
+                self._perf_count += 1
+                self._perf_rows[(user, topic)] = index
+                self._perf_by_user.setdefault(user, []).append(index)
+                self._perf_user = _grow(self._perf_user, self._perf_count)
+                self._perf_topic = _grow(self._perf_topic, self._perf_count)
+                self._perf_attempts = _grow(self._perf_attempts, self._perf_count)
+                self._perf_score = _grow(self._perf_score, self._perf_count)
+                self._perf_valid = _grow(self._perf_valid, self._perf_count)
+                self._perf_user[index], self._perf_topic[index] = user, topic
+            self._perf_attempts[index] = row['attempts']
+            self._perf_score[index] = row['average_score']
+            self._perf_valid[index] = True
+
+        for row in self.store.bulk_weak_areas(usernames):
+            self._weak.setdefault(self._user_row(row['username']), []).append(self._topic_index(row['area']))
+
+    def _load_analytics(self, stamps: Dict[str, int]) -> None:
+        """Read per-hour session statistics from users' analytics files."""
+        for username, stamp in stamps.items():
+            path = self.analytics_dir / f'analytics_{username}.json'
+            try:
+                with path.open('r') as f:
+                    hours = json.load(f).get('learning_patterns', {}).get('time_of_day_performance', {})
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+                continue
+            user = self._user_row(username)
+            self._hours[user] = 0
+            for hour, stats in hours.items():
+                if isinstance(stats, list):  # Analytics written before running statistics
+                    self._hours[user, int(hour)] = (len(stats), sum(stats))
+                else:
+                    self._hours[user, int(hour)] = (stats['count'], stats['mean'] * stats['count'])
+            self._analytics_stamps[username] = stamp
+
+    def refresh(self, full_scan: bool = False) -> bool:
+        """Fold in users changed since the last refresh; True if anything changed."""
+        with self._lock:
+            if self._profile_seq is None:
+                # Feed positions first: writes during the load are read again next time
+                self._profile_seq = self.store.change_seq()
+                self._analytics_seq = shared_state.change_seq()
+                self._last_scan = time.time()
+                self._load_profiles(None)
+                self._load_analytics(self._analytics_files())
+                self._summary = None
+                return True
+
+            changed_users, self._profile_seq = self.store.changed_since(self._profile_seq)
+            changed_users = set(changed_users)
+            written, self._analytics_seq = shared_state.changes_since(ANALYTICS_CHANNEL, self._analytics_seq)
+            changed_stamps = {name: self._analytics_stamp(name) for name in written}
+            if full_scan or time.time() - self._last_scan >= FULL_SCAN_SECONDS:
+                self._last_scan = time.time()
+                changed_users.update(name for name, version in self.store.user_versions().items()
+                                     if self._versions.get(name) != version)
+                changed_stamps.update({name: stamp for name, stamp in self._analytics_files().items()
+                                       if self._analytics_stamps.get(name) != stamp})
+            changed_stamps = {name: stamp for name, stamp in changed_stamps.items() if stamp is not None}
+            if not changed_users and not changed_stamps:
+                return False
+            if changed_users:
+                self._load_profiles(sorted(changed_users))
+            self._load_analytics(changed_stamps)
+            self._summary = None
+            return True
+
+    # ---- Aggregates ----
+    def _difficulty_distribution(self, n: int) -> Dict:
+        totals, correct = self._difficulty[:n, :, 0], self._difficulty[:n, :, 1]
+        distribution = {}
+        for j, difficulty in enumerate(DIFFICULTIES):
+            answered = totals[:, j] > 0
+            accuracy = correct[answered, j] / totals[answered, j]
+            histogram, _ = np.histogram(accuracy, bins=HISTOGRAM_BINS, range=(0, 1))
+            quartiles = np.percentile(accuracy, [25, 50, 75]) if accuracy.size else [0.0, 0.0, 0.0]
+            distribution[difficulty] = {
+                'students': int(answered.sum()),
+                'questions': int(totals[:, j].sum()),
+                'mean_accuracy': float(accuracy.mean()) if accuracy.size else 0.0,
+                'p25': float(quartiles[0]),
+                'median': float(quartiles[1]),
+                'p75': float(quartiles[2]),
+                'histogram': histogram.tolist()
+            }
+        return distribution
+
+    def _topic_stats(self, n: int) -> Dict:
+        count = len(self._topic_names)
+        valid = self._perf_valid[:self._perf_count]
+        topics = self._perf_topic[:self._perf_count][valid]
+        students = np.bincount(topics, minlength=count)
+        score_sum = np.bincount(topics, weights=self._perf_score[:self._perf_count][valid], minlength=count)
+        attempt_sum = np.bincount(topics, weights=self._perf_attempts[:self._perf_count][valid], minlength=count)
+        studied = np.flatnonzero(students)
+        mean_score = score_sum[studied] / students[studied]
+
+        weak_indices = np.fromiter(itertools.chain.from_iterable(self._weak.values()), dtype=np.int64)
+        weak_counts = np.bincount(weak_indices, minlength=count)
+
+        lowest = studied[np.argsort(mean_score, kind='stable')]
+        most_weak = np.argsort(-weak_counts, kind='stable')
+        return {
+            'lowest_scoring_topics': [
+                {
+                    'topic': self._topic_names[i],
+                    'students': int(students[i]),
+                    'average_score': float(score_sum[i] / students[i]),
+                    'average_attempts': float(attempt_sum[i] / students[i])
+                }
+                for i in lowest
+            ],
+            'weak_topics': [
+                {
+                    'topic': self._topic_names[i],
+                    'students_weak': int(weak_counts[i]),
+                    'share': float(weak_counts[i] / n) if n else 0.0
+                }
+                for i in most_weak if weak_counts[i]
+            ]
+        }
+
+    def _study_times(self, n: int) -> Dict:
+        sessions, score_sum = self._hours[:n, :, 0], self._hours[:n, :, 1]
+        hour_sessions = sessions.sum(axis=0)
+        hour_average = np.divide(score_sum.sum(axis=0), hour_sessions,
+                                 out=np.zeros(24), where=hour_sessions > 0)
+
+        # Each student's own best hour, by their average score per hour
+        active = sessions.sum(axis=1) > 0
+        user_average = np.where(sessions[active] > 0,
+                                score_sum[active] / np.maximum(sessions[active], 1), -np.inf)
+        students_best = np.bincount(user_average.argmax(axis=1), minlength=24) if active.any() else np.zeros(24, int)
+
+        best_hour = int(np.argmax(np.where(hour_sessions > 0, hour_average, -np.inf))) if hour_sessions.any() else None
+        return {
+            'best_hour': best_hour,
+            'by_hour': [
+                {
+                    'hour': hour,
+                    'sessions': int(hour_sessions[hour]),
+                    'average_score': float(hour_average[hour]),
+                    'students_best_hour': int(students_best[hour])
+                }
+                for hour in range(24)
+            ]
+        }
+
+    def summary(self, top: int = 10) -> Dict:
+        """Cohort-wide aggregates with the ``top`` topics of each ranking.
+
+        The aggregates are recomputed only when a user's data changed.
+        """
+        with self._lock:
+            self.refresh()
+            if self._summary is None:
+                n = len(self._usernames)
+                self._summary = {
+                    'generated_at': datetime.now().isoformat(),
+                    'students': n,
+                    'mastery_counts': dict(zip(MASTERY_LEVELS, self._mastery[:n].sum(axis=0).tolist())),
+                    'difficulty_distribution': self._difficulty_distribution(n),
+                    **self._topic_stats(n),
+                    'study_times': self._study_times(n)
+                }
+            return dict(
+                self._summary,
+                weak_topics=self._summary['weak_topics'][:top],
+                lowest_scoring_topics=self._summary['lowest_scoring_topics'][:top]
+            )
+
+
+# Global cohort analytics instance
+cohort_analytics = CohortAnalytics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print class-wide learning analytics.")
+    parser.add_argument("--top", type=int, default=10, help="Topics listed per ranking")
+    args = parser.parse_args()
+    print(json.dumps(cohort_analytics.summary(args.top), indent=2))
@@ -1,9 +1,12 @@
 """Enhanced Domain Expert with Advanced RAG and Multi-LLM Support."""
 import os
+import threading
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Tuple, List, Optional, Dict, Any
 
 from advanced_rag import AdvancedRAGSystem
+from answer_grader import FastGrader, load_calibration, parse_llm_grade
 from llm_providers import llm_manager
 
 
@@ -16,6 +19,9 @@ rag_system = AdvancedRAGSystem(
     chunk_overlap=128
 )
 
+# Local first-stage grader reusing the RAG models (decides nothing until calibrated)
+fast_grader = FastGrader(rag_system.retriever.embedder, rag_system.retriever.reranker, *load_calibration())
+
 
 def query_domain_expert(
     prompt: str, 
@@ -88,27 +94,83 @@ def retrieve_context_with_citations(topic: str, k: int = 5) -> Tuple[str, List[s
     return context, citations
 
 
-def explain_concept(topic: str, detail_level: str = "standard") -> str:
+@dataclass
+class RetrievedContext:
+    """Context retrieved once for a subtopic and reused by every downstream call."""
+    query: str
+    context: str
+    citations: List[str]
+    documents: List[Any]
+
+
+def retrieve_shared_context(topic: str, k: int = 5) -> RetrievedContext:
+    """Retrieve context, citations and source chunks for a topic in one pass."""
+    context, citations, documents = rag_system.retrieve(
+        query=topic,
+        k=k,
+        use_reranking=True,
+        alpha=0.7  # Favor semantic search
+    )
+    return RetrievedContext(query=topic, context=context, citations=citations, documents=documents)
+
+
+class SubtopicContextCache:
+    """Session-scoped cache holding one retrieval per subtopic.
+    
+    Explanation, example, question generation, grading and summary for the same
+    subtopic all share the cached context instead of retrieving it again.
+    Safe to use from prefetch threads: concurrent requests for the same subtopic
+    wait for a single retrieval.
+    """
+    
+    def __init__(self, k: int = 5):
+        self.k = k
+        self._contexts: Dict[str, RetrievedContext] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, topic: str) -> RetrievedContext:
+        with self._lock:
+            topic_lock = self._locks.setdefault(topic, threading.Lock())
+        with topic_lock:
+            if topic not in self._contexts:
+                self._contexts[topic] = retrieve_shared_context(topic, self.k)
+            return self._contexts[topic]
+    
+    def discard(self, topic: str) -> None:
+        with self._lock:
+            self._contexts.pop(topic, None)
+            self._locks.pop(topic, None)
+
+
+def _context_and_citations(topic: str, retrieved: Optional[RetrievedContext]) -> Tuple[str, List[str]]:
+    """Use shared context when provided, otherwise retrieve it."""
+    if retrieved is not None:
+        return retrieved.context, retrieved.citations
+    return retrieve_context_with_citations(topic)
+
+
+def explain_concept(topic: str, detail_level: str = "standard", retrieved: Optional[RetrievedContext] = None) -> str:
     """
     Explain a concept with appropriate detail level.
     
     Args:
         topic: The concept to explain
         detail_level: "simple", "standard", or "advanced"
+        retrieved: Optional shared context for the topic (skips retrieval)
     """
     # Retrieve relevant context
-    context, citations = retrieve_context_with_citations(topic)
+    context, citations = _context_and_citations(topic, retrieved)
     
     if not context:
         # Check available sources
-        stats = rag_system.get_statistics()
-        if stats['total_documents'] == 0:
+        if not rag_system.has_documents():
             return (
                 f"No documents found in the docs folder. Please add relevant PDF or text files "
                 f"to get accurate, source-based explanations about '{topic}'."
             )
         else:
-            sources = list(stats['source_breakdown'].keys())
+            sources = list(rag_system.get_source_breakdown().keys())
             return (
                 f"I don't have specific information about '{topic}' in the available documents. "
                 f"Available sources: {', '.join(sources)}. Please ensure your query matches "
@@ -126,25 +188,25 @@ def explain_concept(topic: str, detail_level: str = "standard") -> str:
     return query_domain_expert(prompt, context, citations)
 
 
-def generate_example(topic: str, difficulty: str = "medium") -> str:
+def generate_example(topic: str, difficulty: str = "medium", retrieved: Optional[RetrievedContext] = None) -> str:
     """
     Generate an example for a topic with specified difficulty.
     
     Args:
         topic: The topic for the example
         difficulty: "easy", "medium", or "hard"
+        retrieved: Optional shared context for the topic (skips retrieval)
     """
-    context, citations = retrieve_context_with_citations(topic)
+    context, citations = _context_and_citations(topic, retrieved)
     
     if not context:
-        stats = rag_system.get_statistics()
-        if stats['total_documents'] == 0:
+        if not rag_system.has_documents():
             return (
                 f"No documents found. Please add relevant documents to get examples based on "
                 f"your specific materials."
             )
         else:
-            sources = list(stats['source_breakdown'].keys())
+            sources = list(rag_system.get_source_breakdown().keys())
             return (
                 f"I don't have specific examples for '{topic}' in the available documents. "
                 f"Available sources: {', '.join(sources)}."
@@ -160,7 +222,7 @@ def generate_example(topic: str, difficulty: str = "medium") -> str:
     return query_domain_expert(prompt, context, citations)
 
 
-def generate_question(topic: str, previous_questions: List[str] = None, difficulty: str = "medium", question_type: str = "objective") -> Dict:
+def generate_question(topic: str, previous_questions: List[str] = None, difficulty: str = "medium", question_type: str = "objective", retrieved: Optional[RetrievedContext] = None) -> Dict:
     """Generate a question for a given topic.
     
     Args:
@@ -168,6 +230,7 @@ def generate_question(topic: str, previous_questions: List[str] = None, difficul
         previous_questions: List of previously asked questions to avoid repetition
         difficulty: Difficulty level ("easy", "medium", "hard")
         question_type: Type of question ("objective", "analytical", "synthesis")
+        retrieved: Optional shared context for the topic (skips retrieval)
         
     Returns:
         Dict containing question text and options if objective
@@ -176,7 +239,7 @@ def generate_question(topic: str, previous_questions: List[str] = None, difficul
         previous_questions = []
     
     # Get context for the topic
-    context = _retrieve_context(topic)
+    context = retrieved.context if retrieved is not None else _retrieve_context(topic)
     
     if question_type == "objective":
         # Build prompt for multiple choice question
@@ -242,7 +305,8 @@ def generate_question(topic: str, previous_questions: List[str] = None, difficul
                 "correct_option": 0,
                 "explanation": "Please refer to the course materials.",
                 "type": "objective",
-                "difficulty": difficulty
+                "difficulty": difficulty,
+                "fallback": True
             }
     else:
         # Generate subjective/analytical question
@@ -254,19 +318,24 @@ def generate_question(topic: str, previous_questions: List[str] = None, difficul
             prompt += "\nAvoid these previous questions:\n" + "\n".join(previous_questions)
         
         question_text = query_domain_expert(prompt, context)
-        return {
+        question = {
             "text": question_text,
             "type": "subjective",
             "difficulty": difficulty
         }
+        if question_text.startswith('[Error:'):
+            # The LLM call failed; the text is the error, not a question
+            question["fallback"] = True
+        return question
 
 
-def check_answer(question: Dict, answer: str) -> Tuple[bool, str]:
+def check_answer(question: Dict, answer: str, retrieved: Optional[RetrievedContext] = None) -> Tuple[bool, str]:
     """Check if the answer is correct.
     
     Args:
         question: Question dict containing text and options if objective
         answer: User's answer
+        retrieved: Optional shared context the question was generated from
         
     Returns:
         Tuple of (is_correct, feedback)
@@ -287,40 +356,56 @@ def check_answer(question: Dict, answer: str) -> Tuple[bool, str]:
         except ValueError:
             return False, "Please enter a valid option number (0-3)"
     else:
-        # For subjective questions, use semantic similarity
-        context = _retrieve_context(question["text"])
-        
-        # Build evaluation prompt
-        prompt = (
-            f"Question: {question['text']}\n"
-            f"Student's answer: {answer}\n\n"
-            "Evaluate the answer based on:\n"
-            "1. Accuracy of information\n"
-            "2. Completeness of explanation\n"
-            "3. Understanding of concepts\n\n"
-            "Provide:\n"
-            "SCORE: (number between 0 and 1)\n"
-            "FEEDBACK: (constructive feedback explaining the score)"
-        )
+        # For subjective questions, let the fast grader decide answers past a
+        # calibrated threshold and send everything else to the LLM
+        if retrieved is None:
+            retrieved = retrieve_shared_context(question["text"])
+        context, documents = retrieved.context, retrieved.documents
         
-        response = query_domain_expert(prompt, context)
+        local = fast_grader.grade(answer, grading_references(question, documents))
+        if local.decided:
+            return local.is_correct, local.reason
         
-        try:
-            # Parse score and feedback
-            score_line = next(line for line in response.split('\n') if line.startswith('SCORE:'))
-            score = float(score_line.replace('SCORE:', '').strip())
-            
-            feedback_line = next(line for line in response.split('\n') if line.startswith('FEEDBACK:'))
-            feedback = feedback_line.replace('FEEDBACK:', '').strip()
-            
-            # Consider score >= 0.8 as correct for subjective questions
-            is_correct = score >= 0.8
-            
-            return is_correct, feedback
-        except Exception as e:
-            print(f"Error parsing evaluation response: {e}")
-            # Fallback scoring
-            return False, "Unable to evaluate answer. Please try again."
+        return grade_with_llm(question, answer, context)
+
+
+def grading_references(question: Dict, documents: List, max_passages: int = 3) -> List[str]:
+    """Reference texts the fast grader compares a subjective answer against."""
+    references = []
+    if question.get("reference_answer"):
+        references.append(question["reference_answer"])
+    references.extend(doc.text for doc in documents[:max_passages])
+    return references
+
+
+def grade_with_llm(question: Dict, answer: str, context: str = "") -> Tuple[bool, str]:
+    """Grade a subjective answer with a full LLM call.
+    
+    Returns:
+        Tuple of (is_correct, feedback)
+    """
+    prompt = (
+        f"Question: {question['text']}\n"
+        f"Student's answer: {answer}\n\n"
+        "Evaluate the answer based on:\n"
+        "1. Accuracy of information\n"
+        "2. Completeness of explanation\n"
+        "3. Understanding of concepts\n\n"
+        "Provide:\n"
+        "SCORE: (number between 0 and 1)\n"
+        "FEEDBACK: (constructive feedback explaining the score)"
+    )
+    
+    response = query_domain_expert(prompt, context)
+    score, feedback = parse_llm_grade(response)
+    
+    if score is None:
+        print(f"Error parsing evaluation response: {response[:200]}")
+        # Fallback scoring
+        return False, "Unable to evaluate answer. Please try again."
+    
+    # Consider score >= 0.8 as correct for subjective questions
+    return score >= 0.8, feedback
 
 
 def generate_hint(question: str, difficulty_level: int = 1) -> str:
@@ -343,19 +428,19 @@ def generate_hint(question: str, difficulty_level: int = 1) -> str:
     return query_domain_expert(prompt, context, citations)
 
 
-def generate_summary(topic: str, length: str = "medium") -> str:
+def generate_summary(topic: str, length: str = "medium", retrieved: Optional[RetrievedContext] = None) -> str:
     """
     Generate a summary of a topic.
     
     Args:
         topic: The topic to summarize
         length: "short", "medium", or "long"
+        retrieved: Optional shared context for the topic (skips retrieval)
     """
-    context, citations = retrieve_context_with_citations(topic)
+    context, citations = _context_and_citations(topic, retrieved)
     
     if not context:
-        stats = rag_system.get_statistics()
-        sources = list(stats['source_breakdown'].keys()) if stats['total_documents'] > 0 else []
+        sources = list(rag_system.get_source_breakdown().keys()) if rag_system.has_documents() else []
         if sources:
             return (
                 f"I don't have specific information about '{topic}' to summarize. "
@@ -386,9 +471,9 @@ def generate_quiz(topic: str, num_questions: int = 5, mix_types: bool = True) ->
     Returns:
         List of quiz questions with structure
     """
-    context, citations = retrieve_context_with_citations(topic, k=10)  # Get more context for quiz
+    retrieved = retrieve_shared_context(topic, k=10)  # Get more context for quiz
     
-    if not context:
+    if not retrieved.context:
         return [{
             "question": f"No source materials available for {topic}",
             "type": "error",
@@ -404,8 +489,8 @@ def generate_quiz(topic: str, num_questions: int = 5, mix_types: bool = True) ->
         q_difficulty = difficulties[min(i // len(question_types), 2)]  # Gradually increase difficulty
         
         # Generate unique question
-        previous = [q["question"] for q in quiz_questions]
-        question = generate_question(topic, previous, q_difficulty, q_type)
+        previous = [q["question"]["text"] for q in quiz_questions]
+        question = generate_question(topic, previous, q_difficulty, q_type, retrieved=retrieved)
         
         quiz_questions.append({
             "question": question,
@@ -419,8 +504,7 @@ def generate_quiz(topic: str, num_questions: int = 5, mix_types: bool = True) ->
 
 def get_available_sources() -> List[str]:
     """Get list of available document sources."""
-    stats = rag_system.get_statistics()
-    return list(stats['source_breakdown'].keys())
+    return list(rag_system.get_source_breakdown().keys())
 
 
 def show_available_sources() -> str:
@@ -0,0 +1,136 @@
+"""Per-user index of review items ordered by due time."""
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+MAX_CACHED_INDEXES = 256  # User indexes kept in memory (least recently used evicted)
+
+
+class DueIndex:
+    """Review items (flashcards, weak areas, ...) kept sorted by due epoch.
+
+    Keys are ``(source, group, ...)`` tuples, e.g. ``('flashcard', topic,
+    card_id)``. Each source and group has its own sorted list of
+    ``(due, seq, key)`` tuples, so the number of items due by a time is one
+    bisect per list and the next N items are a merge of list prefixes.
+    Single-item updates are ``insort``/``del`` on a Python list, so they
+    cost O(n) in the size of the group (one user's topic deck), not log n.
+    Sources also record the version of the data they were built from;
+    callers rebuild a source when that version no longer matches and
+    otherwise apply single-item updates.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._entries: Dict[Tuple[str, Hashable], List[Tuple[float, int, Hashable]]] = {}
+        self._by_key: Dict[Hashable, Tuple[float, int, Hashable]] = {}
+        self._items: Dict[Hashable, Dict] = {}
+        self._seq = 0
+        self.versions: Dict[str, object] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def _lists(self, source: Optional[str], group: Hashable = None) -> List[List[Tuple[float, int, Hashable]]]:
+        if group is not None:
+            return [self._entries.get((source, group), [])]
+        return [entries for (s, _), entries in self._entries.items() if source is None or s == source]
+
+    # ---- Updates ----
+    def upsert(self, key: Hashable, due: float, item: Dict) -> None:
+        """Insert an item or move it to a new due time."""
+        with self.lock:
+            self.remove(key)
+            self._seq += 1
+            entry = (due, self._seq, key)
+            bisect.insort(self._entries.setdefault(key[:2], []), entry)
+            self._by_key[key] = entry
+            self._items[key] = item
+
+    def remove(self, key: Hashable) -> None:
+        with self.lock:
+            entry = self._by_key.pop(key, None)
+            if entry is None:
+                return
+            entries = self._entries[key[:2]]
+            del entries[bisect.bisect_left(entries, entry)]
+            del self._items[key]
+
+    def replace_source(self, source: str, items: Iterable[Tuple[Hashable, float, Dict]], version) -> None:
+        """Rebuild every entry of one source from ``(key, due, item)`` triples."""
+        with self.lock:
+            for group_key in [group_key for group_key in self._entries if group_key[0] == source]:
+                for _, _, key in self._entries.pop(group_key):
+                    del self._by_key[key]
+                    del self._items[key]
+            for key, due, item in items:
+                self._seq += 1
+                entry = (due, self._seq, key)
+                self._entries.setdefault(key[:2], []).append(entry)
+                self._by_key[key] = entry
+                self._items[key] = item
+            for group_key, entries in self._entries.items():
+                if group_key[0] == source:
+                    entries.sort()
+            self.versions[source] = version
+
+    # ---- Queries ----
+    def due_count(self, at: Optional[float] = None, source: Optional[str] = None,
+                  group: Hashable = None) -> int:
+        """Number of items (of a source, or one group of it) due by ``at`` (default: now)."""
+        at = time.time() if at is None else at
+        with self.lock:
+            return sum(bisect.bisect_right(entries, (at, float('inf'))) for entries in self._lists(source, group))
+
+    def next_due(self, n: int, source: Optional[str] = None, group: Hashable = None) -> List[Tuple[float, Dict]]:
+        """The ``n`` items with the earliest due times, as ``(due, item)``."""
+        with self.lock:
+            merged = heapq.merge(*(entries[:n] for entries in self._lists(source, group)))
+            return [(due, self._items[key]) for due, _, key in itertools.islice(merged, n)]
+
+    def due_by(self, at: float, source: Optional[str] = None, group: Hashable = None,
+               limit: Optional[int] = None) -> List[Tuple[float, Dict]]:
+        """Items due by ``at`` in due order, as ``(due, item)``."""
+        with self.lock:
+            merged = heapq.merge(*(
+                entries[:bisect.bisect_right(entries, (at, float('inf')))]
+                for entries in self._lists(source, group)
+            ))
+            return [(due, self._items[key]) for due, _, key in itertools.islice(merged, limit)]
+
+    def due(self, key: Hashable) -> Optional[float]:
+        with self.lock:
+            entry = self._by_key.get(key)
+            return entry[0] if entry else None
+
+
+_indexes: "OrderedDict[str, DueIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_due_index(username: str) -> DueIndex:
+    """The (possibly not yet populated) due index of a user, from a bounded LRU cache.
+    
+    An evicted index is rebuilt from its sources on next use; a caller
+    still holding it only patches a copy nobody reads any more.
+    """
+    with _indexes_lock:
+        index = _indexes.get(username)
+        if index is None:
+            index = _indexes[username] = DueIndex()
+        _indexes.move_to_end(username)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+
+def ensure_source(index: DueIndex, source: str, version,
+                  build: Callable[[], Iterable[Tuple[Hashable, float, Dict]]]) -> None:
+    """Rebuild ``source`` if the index was built from a different version of it."""
+    with index.lock:
+        if index.versions.get(source, object()) != version:
+            index.replace_source(source, build(), version)
@@ -0,0 +1,242 @@
+"""Global schedule of due flashcards across all users."""
+import argparse
+import bisect
+import json
+import math
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from event_log import EVENT_LOG_DIR
+from shared_state import shared_state
+
+DUE_SOON_SECONDS = 3600  # Default look-ahead for "due soon" user lists
+FULL_SCAN_SECONDS = 600  # Interval between file scans catching writes made outside the change feed
+CHANGE_CHANNEL = 'flashcards'  # Change feed channel flashcard writers bump with the username
+
+
+LEGACY_DIR = Path('.')   # Where pre-event-log flashcards_<username>.json files live
+
+
+def _stamp_files(pattern_dir: Path, suffix: str) -> Dict[str, int]:
+    stamps = {}
+    for path in pattern_dir.glob(f'flashcards_*{suffix}'):
+        try:
+            stamps[path.name[len('flashcards_'):-len(suffix)]] = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return stamps
+
+
+def flashcard_file_stamps() -> Dict[str, int]:
+    """Latest modification time of each user's flashcard files (log, snapshot, legacy file), by username."""
+    stamps: Dict[str, int] = {}
+    for found in (_stamp_files(EVENT_LOG_DIR, '.jsonl'), _stamp_files(EVENT_LOG_DIR, '.snapshot.json'),
+                  _stamp_files(LEGACY_DIR, '.json')):
+        for username, stamp in found.items():
+            stamps[username] = max(stamps.get(username, 0), stamp)
+    return stamps
+
+
+class DueScheduler:
+    """Every user's card due times in one place, for reminders and dashboards.
+
+    Cards are kept in a sorted list of ``(due, username, topic, card_id)``,
+    so the number of cards due by a time is one bisect. A second sorted list
+    holds the earliest due time of each user's topic, so the users with
+    cards due soon are read off its front. The lists are built once by
+    scanning every flashcard file, then updated as cards change in this
+    process. Every flashcard write also bumps the user in the shared change
+    feed, so ``refresh()`` is one indexed query that returns the users
+    changed (by any process) since the last one; only those are re-read.
+    Writes that bypass the feed (legacy files edited by hand) are caught by
+    a file scan at most every ``FULL_SCAN_SECONDS``.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._cards: List[Tuple[int, str, str, str]] = []
+        self._card_due: Dict[Tuple[str, str, str], int] = {}
+        self._user_cards: Dict[str, Set[Tuple[str, str]]] = {}
+        self._topic_dues: Dict[Tuple[str, str], List[int]] = {}  # Sorted due times per user and topic
+        self._topics: List[Tuple[int, str, str]] = []
+        self._topic_due: Dict[Tuple[str, str], int] = {}
+        self._stamps: Dict[str, int] = {}
+        self._feed_seq = 0
+        self._last_scan = 0.0
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    # ---- Updates ----
+    def _set_topic(self, username: str, topic: str) -> None:
+        """Re-file a user's topic under its earliest due time."""
+        key = (username, topic)
+        dues = self._topic_dues.get(key)
+        earliest = dues[0] if dues else None
+        old = self._topic_due.get(key)
+        if old == earliest:
+            return
+        if old is not None:
+            del self._topics[bisect.bisect_left(self._topics, (old, username, topic))]
+            del self._topic_due[key]
+        if earliest is None:
+            self._topic_dues.pop(key, None)
+        else:
+            bisect.insort(self._topics, (earliest, username, topic))
+            self._topic_due[key] = earliest
+
+    def _set_card(self, username: str, topic: str, cid: str, due: Optional[int]) -> None:
+        key = (username, topic, cid)
+        dues = self._topic_dues.setdefault((username, topic), [])
+        old = self._card_due.pop(key, None)
+        if old is not None:
+            del self._cards[bisect.bisect_left(self._cards, (old, username, topic, cid))]
+            del dues[bisect.bisect_left(dues, old)]
+            self._user_cards[username].discard((topic, cid))
+        if due is not None:
+            bisect.insort(self._cards, (due, username, topic, cid))
+            bisect.insort(dues, due)
+            self._card_due[key] = due
+            self._user_cards.setdefault(username, set()).add((topic, cid))
+        self._set_topic(username, topic)
+
+    def _load_user(self, username: str) -> None:
+        """Replace a user's entries with their current flashcards."""
+        from flashcards import scan_flashcards
+
+        for topic, cid in list(self._user_cards.get(username, ())):
+            self._set_card(username, topic, cid, None)
+        deck = scan_flashcards(username)
+        for topic, schedules in deck['decks'].items():
+            for cid, schedule in schedules.items():
+                self._set_card(username, topic, cid, schedule['due'])
+
+    def build(self) -> None:
+        """Scan every user's flashcards (sorting once rather than inserting per card)."""
+        from flashcards import scan_flashcards
+
+        with self._lock:
+            # Read the feed position first: changes after it are re-read by the next refresh
+            feed_seq = shared_state.change_seq()
+            stamps = flashcard_file_stamps()
+            cards, topic_dues = [], {}
+            for username in stamps:
+                deck = scan_flashcards(username)
+                for topic, schedules in deck['decks'].items():
+                    for cid, schedule in schedules.items():
+                        cards.append((schedule['due'], username, topic, cid))
+                        topic_dues.setdefault((username, topic), []).append(schedule['due'])
+            cards.sort()
+            for dues in topic_dues.values():
+                dues.sort()
+
+            self._cards = cards
+            self._card_due = {(u, t, c): due for due, u, t, c in cards}
+            self._user_cards = {}
+            for _, username, topic, cid in cards:
+                self._user_cards.setdefault(username, set()).add((topic, cid))
+            self._topic_dues = topic_dues
+            self._topics = sorted((dues[0], u, t) for (u, t), dues in topic_dues.items())
+            self._topic_due = {(u, t): due for due, u, t in self._topics}
+            self._stamps = stamps
+            self._feed_seq = feed_seq
+            self._last_scan = time.time()
+            self._built = True
+
+    def _ensure_built(self) -> None:
+        if not self._built:
+            self.build()
+
+    def cards_changed(self, username: str, cards: List[Tuple[str, str, int]]) -> None:
+        """Record new ``(topic, card id, due)`` values written by this process.
+
+        The write is published on the change feed for the other processes.
+        The user's stamp is left alone: the files may also hold writes from
+        other processes that this one has not read, so the next ``refresh()``
+        re-reads the user. Stamps are only recorded for files actually read.
+        """
+        shared_state.bump(CHANGE_CHANNEL, username)
+        with self._lock:
+            if not self._built:
+                return  # Picked up by the first build
+            for topic, cid, due in cards:
+                self._set_card(username, topic, cid, due)
+
+    def refresh(self, full_scan: bool = False) -> int:
+        """Re-read users whose flashcards changed since the last refresh; returns how many.
+
+        Changes come from the feed; the files are scanned too when
+        ``full_scan`` is set or the last scan is ``FULL_SCAN_SECONDS`` old.
+        """
+        with self._lock:
+            if not self._built:
+                self.build()
+                return len(self._stamps)
+            changed, self._feed_seq = shared_state.changes_since(CHANGE_CHANNEL, self._feed_seq)
+            changed = set(changed)
+            if full_scan or time.time() - self._last_scan >= FULL_SCAN_SECONDS:
+                self._last_scan = time.time()
+                stamps = flashcard_file_stamps()
+                for username, stamp in stamps.items():
+                    if self._stamps.get(username) != stamp:
+                        changed.add(username)
+                        self._stamps[username] = stamp
+            for username in changed:
+                self._load_user(username)
+            return len(changed)
+
+    # ---- Queries ----
+    def due_count(self, at: Optional[float] = None) -> int:
+        """Number of cards, across all users, due by ``at`` (default: now)."""
+        at = time.time() if at is None else at
+        with self._lock:
+            self._ensure_built()
+            # Due times are whole seconds: everything before the first entry due after ``at``
+            return bisect.bisect_left(self._cards, (math.floor(at) + 1,))
+
+    def due_users(self, within: float = DUE_SOON_SECONDS, limit: Optional[int] = None) -> List[Dict]:
+        """Users with cards due in the next ``within`` seconds, soonest first."""
+        now = time.time()
+        at = now + within
+        with self._lock:
+            self._ensure_built()
+            users: Dict[str, Dict] = {}
+            for due, username, topic in self._topics:
+                if due > at:
+                    break
+                if username not in users:
+                    if limit is not None and len(users) >= limit:
+                        continue
+                    users[username] = {'username': username, 'next_due': due, 'due_now': 0, 'topics': []}
+                entry = users[username]
+                entry['topics'].append(topic)
+                entry['due_now'] += bisect.bisect_right(self._topic_dues[(username, topic)], now)
+            return list(users.values())
+
+    def summary(self, within: float = DUE_SOON_SECONDS, limit: Optional[int] = 50) -> Dict:
+        """Card totals, cards due now and within ``within`` seconds, and the users concerned."""
+        now = time.time()
+        with self._lock:
+            self._ensure_built()
+            return {
+                'cards': len(self._cards),
+                'due_now': self.due_count(now),
+                'due_within': self.due_count(now + within),
+                'users': self.due_users(within, limit)
+            }
+
+
+# Global due scheduler instance
+due_scheduler = DueScheduler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show flashcards due across all users.")
+    parser.add_argument("--within", type=float, default=DUE_SOON_SECONDS, help="Look-ahead in seconds")
+    parser.add_argument("--limit", type=int, default=50, help="Users listed")
+    args = parser.parse_args()
+    print(json.dumps(due_scheduler.summary(args.within, args.limit), indent=2))
@@ -1,89 +1,230 @@
 """Enhanced Memory System with detailed pattern tracking and analytics."""
+import copy
+import itertools
+import heapq
 import json
+import threading
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple, Optional
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict
 import statistics
 
+from card_store import card_store
+from due_index import DueIndex, ensure_source, get_due_index
 from memory import load_user, save_user
 
+MAX_CACHED_ANALYZERS = 64  # Analyzer instances kept in memory (least recently used evicted)
+WEAKNESS_REVIEW_INTERVALS = [1, 3, 7, 14, 30]  # Days between reviews of a weak area
+
+ANALYTICS_SCHEMA = 2             # 2: running statistics instead of unbounded sample lists
+RECENT_WINDOW = 20               # Latest samples kept next to each running statistic
+MAX_SESSION_LENGTH_BUCKET = 180  # Longer sessions share the last 10-minute length bucket
+
+_analyzer_ids = itertools.count(1)
+
+
+def _new_stats() -> Dict:
+    """Running statistics: count, mean, sum of squared deviations (variance = m2 / (count - 1)) and recent samples."""
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'recent': []}
+
+
+def _add_sample(stats: Dict, value: float) -> None:
+    """Welford update of running statistics; the recent window keeps the last RECENT_WINDOW values."""
+    stats['count'] += 1
+    delta = value - stats['mean']
+    stats['mean'] += delta / stats['count']
+    stats['m2'] += delta * (value - stats['mean'])
+    stats['recent'].append(value)
+    del stats['recent'][:-RECENT_WINDOW]
+
+
+def _stats_from_samples(values: List[float]) -> Dict:
+    stats = _new_stats()
+    for value in values:
+        _add_sample(stats, value)
+    return stats
+
+
+def _new_duration_patterns() -> Dict:
+    return {'duration': _new_stats(), 'performance_by_length': {}}
+
+
+def _add_session_duration(patterns: Dict, duration: float, performance: float) -> None:
+    """Record a session's length and score, grouping scores into 10-minute length buckets."""
+    _add_sample(patterns['duration'], duration)
+    bucket = str(min(int(duration // 10) * 10, MAX_SESSION_LENGTH_BUCKET))
+    _add_sample(patterns['performance_by_length'].setdefault(bucket, _new_stats()), performance)
+
+
+def _new_weakness() -> Dict:
+    return {
+        'error_types': defaultdict(int),
+        'confusion_indicators': defaultdict(int),
+        'required_repetitions': 0,
+        'last_reviewed': None
+    }
+
+
+def _normalize_analytics(data: Dict) -> Dict:
+    """Bring loaded analytics to the current schema and restore the in-memory container types.
+    
+    Files written before schema 2 stored every session score, session and
+    confusion phrase; they are folded into running statistics and counts.
+    """
+    patterns = data.setdefault('learning_patterns', {})
+    patterns['time_of_day_performance'] = {
+        str(hour): scores if isinstance(scores, dict) else _stats_from_samples(scores)
+        for hour, scores in patterns.get('time_of_day_performance', {}).items()
+    }
+    durations = patterns.get('session_duration_patterns', [])
+    if isinstance(durations, list):
+        migrated = _new_duration_patterns()
+        for session in durations:
+            _add_session_duration(migrated, session['duration'], session.get('performance', 0))
+        patterns['session_duration_patterns'] = migrated
+    patterns['mistake_patterns'] = defaultdict(list, patterns.get('mistake_patterns', {}))
+    patterns['improvement_velocity'] = defaultdict(list, patterns.get('improvement_velocity', {}))
+    patterns['concept_relationships'] = defaultdict(set, {
+        k: set(v) for k, v in patterns.get('concept_relationships', {}).items()
+    })
+    
+    data.setdefault('personalization', {
+        'preferred_learning_style': 'unknown',
+        'optimal_session_length': 20,
+        'best_time_of_day': 'unknown',
+        'difficulty_preference': 'medium'
+    })
+    
+    weaknesses = defaultdict(_new_weakness)
+    for key, weakness in data.get('detailed_weaknesses', {}).items():
+        indicators = weakness.get('confusion_indicators', {})
+        if isinstance(indicators, list):
+            indicators = Counter(indicators)
+        weaknesses[key] = dict(
+            weakness,
+            error_types=defaultdict(int, weakness.get('error_types', {})),
+            confusion_indicators=defaultdict(int, indicators)
+        )
+    data['detailed_weaknesses'] = weaknesses
+    data['schema'] = ANALYTICS_SCHEMA
+    return data
+
 
 class LearningPatternAnalyzer:
     """Analyzes learning patterns and provides insights."""
     
     def __init__(self, username: str):
         self.username = username
-        self.profile = load_user(username)
         self.analytics_file = Path(f'analytics_{username}.json')
-        self.patterns = self._load_or_create_analytics()
+        self._lock = threading.RLock()
+        self._patterns = None
+        self._analytics_stamp = None
+        self._recommendations = None
+        self._recommendations_key = None
+        self._id = next(_analyzer_ids)
+    
+    @property
+    def profile(self) -> Dict:
+        return load_user(self.username)
+    
+    @property
+    def patterns(self) -> Dict:
+        """Analytics, loaded from disk on first use."""
+        if self._patterns is None:
+            with self._lock:
+                if self._patterns is None:
+                    self._analytics_stamp = self._file_stamp()
+                    self._patterns = self._load_or_create_analytics()
+        return self._patterns
+    
+    def _file_stamp(self) -> Optional[int]:
+        try:
+            return self.analytics_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def is_stale(self) -> bool:
+        """True if the analytics file was changed by someone else since it was loaded."""
+        return self._patterns is not None and self._file_stamp() != self._analytics_stamp
     
     def _load_or_create_analytics(self) -> Dict:
-        """Load existing analytics or create new ones."""
+        """Load existing analytics (migrating older files) or create new ones."""
         if self.analytics_file.exists():
             with self.analytics_file.open('r') as f:
-                return json.load(f)
-        
-        return {
-            'learning_patterns': {
-                'time_of_day_performance': defaultdict(list),
-                'session_duration_patterns': [],
-                'mistake_patterns': defaultdict(list),
-                'improvement_velocity': defaultdict(list),
-                'concept_relationships': defaultdict(set)
-            },
-            'personalization': {
-                'preferred_learning_style': 'unknown',
-                'optimal_session_length': 20,
-                'best_time_of_day': 'unknown',
-                'difficulty_preference': 'medium'
-            },
-            'detailed_weaknesses': defaultdict(lambda: {
-                'error_types': defaultdict(int),
-                'confusion_indicators': [],
-                'required_repetitions': 0,
-                'last_reviewed': None
-            })
-        }
+                return _normalize_analytics(json.load(f))
+        
+        return _normalize_analytics({})
     
     def save_analytics(self):
         """Save analytics to file."""
-        # Convert defaultdicts to regular dicts for JSON serialization
+        # Sets are not JSON serializable; everything else is bounded and written compactly
+        learning_patterns = self.patterns['learning_patterns']
         patterns_copy = {
-            'learning_patterns': {
-                'time_of_day_performance': dict(self.patterns['learning_patterns']['time_of_day_performance']),
-                'session_duration_patterns': self.patterns['learning_patterns']['session_duration_patterns'],
-                'mistake_patterns': dict(self.patterns['learning_patterns']['mistake_patterns']),
-                'improvement_velocity': dict(self.patterns['learning_patterns']['improvement_velocity']),
-                'concept_relationships': {k: list(v) for k, v in self.patterns['learning_patterns']['concept_relationships'].items()}
-            },
+            'schema': ANALYTICS_SCHEMA,
+            'learning_patterns': dict(
+                learning_patterns,
+                concept_relationships={k: list(v) for k, v in learning_patterns['concept_relationships'].items()}
+            ),
             'personalization': self.patterns['personalization'],
-            'detailed_weaknesses': dict(self.patterns['detailed_weaknesses'])
+            'detailed_weaknesses': self.patterns['detailed_weaknesses']
         }
         
-        with self.analytics_file.open('w') as f:
-            json.dump(patterns_copy, f, indent=2)
+        with self._lock:
+            temp_file = self.analytics_file.with_suffix('.tmp')
+            with temp_file.open('w') as f:
+                json.dump(patterns_copy, f, separators=(',', ':'))
+            temp_file.replace(self.analytics_file)
+            self._publish_change()
+            index = get_due_index(self.username)
+            with index.lock:
+                indexed = index.versions.get('weakness') == self._weakness_version()
+                self._analytics_stamp = self._file_stamp()
+                if indexed:  # The index already reflects what was just written
+                    index.versions['weakness'] = self._weakness_version()
+            self._recommendations = None
+    
+    def _publish_change(self) -> None:
+        """Tell other processes (cohort analytics) that this user's analytics file changed."""
+        from cohort_analytics import ANALYTICS_CHANNEL
+        from shared_state import shared_state
+
+        try:
+            shared_state.bump(ANALYTICS_CHANNEL, self.username)
+        except Exception as e:
+            print(f"Error publishing analytics change for {self.username}: {e}")
+    
+    def record_session(self, session_data: Dict) -> None:
+        """Analyze a session and save the analytics as one update.
+        
+        Holds the analyzer's lock throughout, so concurrent sessions of the
+        user neither interleave their changes nor save a half-applied one.
+        """
+        with self._lock:
+            self.analyze_session(session_data)
+            self.save_analytics()
     
     def analyze_session(self, session_data: Dict):
         """Analyze a learning session for patterns."""
+        self._recommendations = None
         start_time = datetime.fromisoformat(session_data['started_at'])
         hour_of_day = start_time.hour
         
         # Track time of day performance
         if 'final_score' in session_data:
-            self.patterns['learning_patterns']['time_of_day_performance'][hour_of_day].append(
-                session_data['final_score']
-            )
+            hour_stats = self.patterns['learning_patterns']['time_of_day_performance']
+            _add_sample(hour_stats.setdefault(str(hour_of_day), _new_stats()), session_data['final_score'])
         
         # Track session duration
         if 'completed_at' in session_data:
             end_time = datetime.fromisoformat(session_data['completed_at'])
             duration_minutes = (end_time - start_time).total_seconds() / 60
-            self.patterns['learning_patterns']['session_duration_patterns'].append({
-                'duration': duration_minutes,
-                'performance': session_data.get('final_score', 0),
-                'topic': session_data['topic']
-            })
+            _add_session_duration(
+                self.patterns['learning_patterns']['session_duration_patterns'],
+                duration_minutes,
+                session_data.get('final_score', 0)
+            )
         
         # Analyze mistakes
         for perf in session_data.get('performance', []):
@@ -104,12 +245,58 @@ class LearningPatternAnalyzer:
         self.patterns['detailed_weaknesses'][mistake_key]['error_types'][error_type] += 1
         
         # Track confusion indicators
-        confusion_indicators = self._detect_confusion(wrong_answer)
-        self.patterns['detailed_weaknesses'][mistake_key]['confusion_indicators'].extend(confusion_indicators)
+        for indicator in self._detect_confusion(wrong_answer):
+            self.patterns['detailed_weaknesses'][mistake_key]['confusion_indicators'][indicator] += 1
         
         # Update required repetitions
         self.patterns['detailed_weaknesses'][mistake_key]['required_repetitions'] += 1
         self.patterns['detailed_weaknesses'][mistake_key]['last_reviewed'] = datetime.now().isoformat()
+        
+        index = get_due_index(self.username)
+        with index.lock:
+            if index.versions.get('weakness') == self._weakness_version():
+                entry = self._weakness_entry(mistake_key, self.patterns['detailed_weaknesses'][mistake_key])
+                if entry is not None:
+                    index.upsert(*entry)
+    
+    def _weakness_version(self) -> Tuple[int, Optional[int]]:
+        """Identifies the analytics the weakness entries of the due index were built from."""
+        return (self._id, self._analytics_stamp)
+    
+    def _weakness_entry(self, topic_subtopic: str, data: Dict):
+        """Due-index entry ``(key, due epoch, item)`` for a weak area, or None if none is needed."""
+        if data['required_repetitions'] <= 0:
+            return None
+        
+        # Longer intervals once a weak area has been reviewed more often
+        repetitions = data['required_repetitions']
+        if repetitions <= 1:
+            next_interval = WEAKNESS_REVIEW_INTERVALS[0]
+        elif repetitions <= 3:
+            next_interval = WEAKNESS_REVIEW_INTERVALS[1]
+        elif repetitions <= 5:
+            next_interval = WEAKNESS_REVIEW_INTERVALS[2]
+        else:
+            next_interval = WEAKNESS_REVIEW_INTERVALS[3]
+        
+        if data['last_reviewed']:
+            due = datetime.fromisoformat(data['last_reviewed']).timestamp() + next_interval * 86400
+        else:
+            due = time.time() + 86400
+        topic, subtopic = topic_subtopic.split('::', 1)
+        return ('weakness', topic, subtopic), due, {'topic': topic, 'subtopic': subtopic, 'data': data}
+    
+    def due_index(self) -> DueIndex:
+        """The user's due index with both flashcard and weak-area entries up to date."""
+        from flashcards import due_index
+        
+        index = due_index(self.username)
+        weaknesses = self.patterns['detailed_weaknesses']
+        ensure_source(index, 'weakness', self._weakness_version(), lambda: [
+            entry for entry in (self._weakness_entry(key, data) for key, data in weaknesses.items())
+            if entry is not None
+        ])
+        return index
     
     def _classify_error(self, question: str, answer: str) -> str:
         """Classify the type of error made."""
@@ -145,7 +332,22 @@ class LearningPatternAnalyzer:
         return indicators
     
     def get_personalized_recommendations(self) -> Dict:
-        """Get personalized learning recommendations."""
+        """Get personalized learning recommendations.
+        
+        Cached until the analytics change, the user's flashcards change or
+        the day rolls over (the review schedule counts days).
+        """
+        from flashcards import deck_log
+        
+        patterns = self.patterns  # Loads analytics (and their file stamp) on first use
+        key = (self._analytics_stamp, deck_log(self.username).version, datetime.now().date())
+        with self._lock:
+            if self._recommendations is None or self._recommendations_key != key:
+                self._recommendations = self._build_recommendations()
+                self._recommendations_key = key
+            return copy.deepcopy(self._recommendations)
+    
+    def _build_recommendations(self) -> Dict:
         recommendations = {
             'optimal_study_time': self._calculate_optimal_time(),
             'suggested_session_length': self._calculate_optimal_session_length(),
@@ -163,13 +365,8 @@ class LearningPatternAnalyzer:
         if not time_performance:
             return "No data yet - try different times to find your optimal learning window"
         
-        # Calculate average performance by hour
-        hour_averages = {}
-        for hour, scores in time_performance.items():
-            if scores:
-                # Convert hour to int if it's a string (from JSON)
-                hour_int = int(hour) if isinstance(hour, str) else hour
-                hour_averages[hour_int] = statistics.mean(scores)
+        # Running average performance by hour (at most 24 entries)
+        hour_averages = {int(hour): stats['mean'] for hour, stats in time_performance.items() if stats['count']}
         
         if hour_averages:
             best_hour = max(hour_averages, key=hour_averages.get)
@@ -190,24 +387,17 @@ class LearningPatternAnalyzer:
         """Calculate optimal session length based on performance."""
         duration_data = self.patterns['learning_patterns']['session_duration_patterns']
         
-        if len(duration_data) < 3:
+        if duration_data['duration']['count'] < 3:
             return 20  # Default
         
-        # Group by duration ranges and calculate average performance
-        duration_performance = defaultdict(list)
-        for session in duration_data:
-            duration_range = int(session['duration'] // 10) * 10  # Round to nearest 10
-            duration_performance[duration_range].append(session['performance'])
-        
-        # Find duration with best average performance
+        # Find the 10-minute length bucket with the best average performance
         best_duration = 20
         best_performance = 0
         
-        for duration, performances in duration_performance.items():
-            avg_performance = statistics.mean(performances)
-            if avg_performance > best_performance:
-                best_performance = avg_performance
-                best_duration = duration
+        for duration, stats in duration_data['performance_by_length'].items():
+            if stats['mean'] > best_performance:
+                best_performance = stats['mean']
+                best_duration = int(duration)
         
         return best_duration
     
@@ -223,7 +413,7 @@ class LearningPatternAnalyzer:
                 priority_score = (
                     data['required_repetitions'] * 2 +
                     sum(data['error_types'].values()) +
-                    len(data['confusion_indicators'])
+                    sum(data['confusion_indicators'].values())
                 )
                 
                 focus_areas.append({
@@ -265,8 +455,9 @@ class LearningPatternAnalyzer:
                 suggestions.append("Focus on understanding core concepts before moving to applications")
         
         # Analyze session patterns
-        if self.patterns['learning_patterns']['session_duration_patterns']:
-            avg_duration = statistics.mean([s['duration'] for s in self.patterns['learning_patterns']['session_duration_patterns']])
+        duration_stats = self.patterns['learning_patterns']['session_duration_patterns']['duration']
+        if duration_stats['count']:
+            avg_duration = duration_stats['mean']
             if avg_duration < 10:
                 suggestions.append("Your sessions are very short - try longer, focused study periods")
             elif avg_duration > 60:
@@ -276,77 +467,75 @@ class LearningPatternAnalyzer:
     
     def _generate_repetition_schedule(self) -> List[Dict]:
         """Generate a spaced repetition schedule for weak areas."""
-        from flashcards import get_spaced_repetition_schedule_for_user
-        
-        # Get flashcard-based schedule first (higher priority)
-        flashcard_schedule = get_spaced_repetition_schedule_for_user(self.username, days_ahead=7)
-        
-        # Convert flashcard schedule to our format and filter for due/upcoming items
-        schedule = []
-        for item in flashcard_schedule:
-            if item['days_until_review'] <= 3:  # Only include items due within 3 days
-                schedule.append({
-                    'topic': item['topic'],
-                    'subtopic': item['subtopic'],
-                    'review_date': item['review_date'],
-                    'days_until_review': item['days_until_review'],
-                    'priority': item['priority'],
-                    'source': 'flashcard',
-                    'ease_factor': item.get('ease_factor', 2.5),
-                    'repetitions': item.get('repetitions', 0)
-                })
+        index = self.due_index()
+        now = time.time()
+        
+        def _days_until(due: float) -> int:
+            return int((due - now) // 86400)
+        
+        def _priority(days_until: int) -> str:
+            return 'high' if days_until <= 0 else 'medium' if days_until <= 2 else 'low'
+        
+        # Flashcards due within 3 days (higher priority)
+        flashcard_items = []
+        covered = set()
+        due_cards = index.due_by(now + 4 * 86400, source='flashcard')
+        bodies = card_store.get_many(item['schedule']['content'] for _, item in due_cards)
+        for due, item in due_cards:
+            schedule, days_until = item['schedule'], _days_until(due)
+            subtopic = bodies[schedule['content']].get('subtopic') or item['topic']
+            covered.add((item['topic'], subtopic))
+            flashcard_items.append({
+                'topic': item['topic'],
+                'subtopic': subtopic,
+                'review_date': datetime.fromtimestamp(due).strftime('%Y-%m-%d'),
+                'days_until_review': max(0, days_until),
+                'priority': _priority(days_until),
+                'source': 'flashcard',
+                'ease_factor': schedule.get('ease_factor', 2.5),
+                'repetitions': schedule.get('repetitions', 0)
+            })
         
-        # Add weakness-based schedule for topics without flashcards
-        today = datetime.now()
-        intervals = [1, 3, 7, 14, 30]
+        # Weak areas due within 7 days that have no flashcards
+        weakness_items = []
+        for due, item in index.due_by(now + 8 * 86400, source='weakness'):
+            if (item['topic'], item['subtopic']) in covered:
+                continue
+            days_until = _days_until(due)
+            weakness_items.append({
+                'topic': item['topic'],
+                'subtopic': item['subtopic'],
+                'review_date': datetime.fromtimestamp(due).strftime('%Y-%m-%d'),
+                'days_until_review': max(0, days_until),
+                'priority': _priority(days_until),
+                'source': 'weakness_analysis',
+                'required_repetitions': item['data']['required_repetitions']
+            })
         
-        for topic_subtopic, data in self.patterns['detailed_weaknesses'].items():
-            if data['required_repetitions'] > 0:
-                topic, subtopic = topic_subtopic.split('::', 1)
-                
-                # Skip if already covered by flashcards
-                if any(s['topic'] == topic and s['subtopic'] == subtopic for s in schedule):
-                    continue
-                
-                # Calculate next review date based on last review
-                if data['last_reviewed']:
-                    last_review = datetime.fromisoformat(data['last_reviewed'])
-                    days_since_review = (today - last_review).days
-                    
-                    # Find appropriate interval based on performance
-                    repetitions = data['required_repetitions']
-                    if repetitions <= 1:
-                        next_interval = intervals[0]  # 1 day
-                    elif repetitions <= 3:
-                        next_interval = intervals[1]  # 3 days
-                    elif repetitions <= 5:
-                        next_interval = intervals[2]  # 7 days
-                    else:
-                        next_interval = intervals[3]  # 14 days
-                    
-                    next_review_date = last_review + timedelta(days=next_interval)
-                else:
-                    next_review_date = today + timedelta(days=1)
-                
-                # Only include if review is due soon
-                days_until = (next_review_date - today).days
-                if days_until <= 7:
-                    priority = 'high' if days_until <= 0 else 'medium' if days_until <= 2 else 'low'
-                    schedule.append({
-                        'topic': topic,
-                        'subtopic': subtopic,
-                        'review_date': next_review_date.strftime('%Y-%m-%d'),
-                        'days_until_review': max(0, days_until),
-                        'priority': priority,
-                        'source': 'weakness_analysis',
-                        'required_repetitions': repetitions
-                    })
-        
-        # Sort by priority and days until review
-        priority_order = {'high': 0, 'medium': 1, 'low': 2}
-        schedule.sort(key=lambda x: (priority_order.get(x['priority'], 3), x['days_until_review']))
-        
-        return schedule[:10]  # Top 10 items
+        # Both lists are in due order, and priority follows days until review
+        merged = heapq.merge(flashcard_items, weakness_items, key=lambda x: x['days_until_review'])
+        return list(itertools.islice(merged, 10))  # Top 10 items
+
+
+_analyzers: "OrderedDict[str, LearningPatternAnalyzer]" = OrderedDict()
+_analyzers_lock = threading.Lock()
+
+
+def get_analyzer(username: str) -> LearningPatternAnalyzer:
+    """Shared analyzer for a user from a bounded LRU cache.
+    
+    A cached analyzer is replaced when its analytics file changed on disk
+    (e.g. written by another process).
+    """
+    with _analyzers_lock:
+        analyzer = _analyzers.get(username)
+        if analyzer is None or analyzer.is_stale():
+            analyzer = LearningPatternAnalyzer(username)
+            _analyzers[username] = analyzer
+        _analyzers.move_to_end(username)
+        while len(_analyzers) > MAX_CACHED_ANALYZERS:
+            _analyzers.popitem(last=False)
+        return analyzer
 
 
 class EnhancedMemorySystem:
@@ -354,13 +543,12 @@ class EnhancedMemorySystem:
     
     def __init__(self, username: str):
         self.username = username
-        self.analyzer = LearningPatternAnalyzer(username)
+        self.analyzer = get_analyzer(username)
     
     def record_interactive_session(self, session_data: Dict):
         """Record an interactive session with detailed analytics."""
         # Analyze the session
-        self.analyzer.analyze_session(session_data)
-        self.analyzer.save_analytics()
+        self.analyzer.record_session(session_data)
         
         # Also update the regular memory system
         if 'performance' in session_data and session_data['performance']:
@@ -424,20 +612,18 @@ class EnhancedMemorySystem:
     
     def _calculate_study_streak(self, profile: Dict) -> int:
         """Calculate current study streak in days."""
-        history = profile.get('history', [])
-        if not history:
+        # Recent sessions plus the study days kept in compacted weekly rollups
+        study_dates = {datetime.fromisoformat(h['date']).date() for h in profile.get('history', [])}
+        for rollup in profile.get('history_rollups', []):
+            study_dates.update(datetime.fromisoformat(day).date() for day in rollup['study_days'])
+        if not study_dates:
             return 0
         
-        # Sort by date
-        sorted_history = sorted(history, key=lambda x: x['date'], reverse=True)
-        
         streak = 0
         last_date = None
         today = datetime.now().date()
         
-        for session in sorted_history:
-            session_date = datetime.fromisoformat(session['date']).date()
-            
+        for session_date in sorted(study_dates, reverse=True):
             if last_date is None:
                 # First session
                 if (today - session_date).days <= 1:
@@ -457,12 +643,14 @@ class EnhancedMemorySystem:
     
     def _analyze_trajectory(self, profile: Dict) -> str:
         """Analyze learning trajectory."""
-        history = profile.get('history', [])
-        if len(history) < 3:
+        # Weekly rollup averages stand in for compacted sessions, oldest first
+        scores = [rollup['average_score'] for rollup in profile.get('history_rollups', [])]
+        scores.extend(h.get('final_score', 0) for h in profile.get('history', []))
+        if len(scores) < 3:
             return "Not enough data to determine trajectory"
         
         # Get recent scores
-        recent_scores = [h.get('final_score', 0) for h in history[-5:]]
+        recent_scores = scores[-5:]
         
         if len(recent_scores) >= 2:
             # Simple trend analysis
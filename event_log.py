@@ -0,0 +1,257 @@
+"""Append-only JSONL event logs with periodic snapshots."""
+import copy
+import fcntl
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+EVENT_LOG_DIR = Path('event_log')
+EVENT_LOG_DIR.mkdir(exist_ok=True)
+
+SNAPSHOT_EVERY = 200  # Log lines between snapshots (the log is truncated after each one)
+FSYNC_APPENDS = True  # fsync every append; without it a power loss can drop the last acknowledged writes
+
+
+class EventLog:
+    """State rebuilt from a snapshot plus the events appended since.
+
+    Every change is one small JSON line appended to ``<name>.jsonl`` instead
+    of a rewrite of the whole state file. Each event carries a sequence
+    number; the snapshot records the last sequence it includes, so replay
+    after a crash between writing a snapshot and truncating the log never
+    applies an event twice. Events appended together are written as one
+    ``batch`` line, so a crash mid-write applies all of them or none; the
+    torn line is cut off by the next append and skipped by replay. With
+    ``fsync`` (the default) an append returns only once its line is on
+    disk, which costs a disk flush per write; without it, writes survive a
+    process crash but a power loss may drop the most recent ones.
+    ``reducer(state, event)`` must apply an event to the state in place.
+    """
+
+    def __init__(self, name: str, reducer: Callable[[Any, Dict], None],
+                 initial: Callable[[], Any], directory: Path = EVENT_LOG_DIR,
+                 snapshot_every: int = SNAPSHOT_EVERY, fsync: bool = FSYNC_APPENDS):
+        self.name = name
+        self.reducer = reducer
+        self.initial = initial
+        self.log_file = directory / f"{name}.jsonl"
+        self.snapshot_file = directory / f"{name}.snapshot.json"
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._state = None
+        self._seq = 0
+        self._offset = 0             # Bytes of the log already applied
+        self._since_snapshot = 0
+        self._snapshot_mtime = None
+
+    def _snapshot_stamp(self):
+        try:
+            return self.snapshot_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # ---- Replay ----
+    def _load(self) -> None:
+        """Rebuild state from the snapshot and the log."""
+        state, seq = None, 0
+        self._snapshot_mtime = self._snapshot_stamp()
+        if self.snapshot_file.exists():
+            try:
+                with self.snapshot_file.open('r') as f:
+                    snapshot = json.load(f)
+                state, seq = snapshot['state'], snapshot['seq']
+            except Exception as e:
+                print(f"Error loading snapshot {self.snapshot_file}: {e}")
+        self._state = state if state is not None else self.initial()
+        self._seq = seq
+        self._offset = 0
+        self._since_snapshot = 0
+        self._replay_tail()
+
+    def _replay_tail(self) -> None:
+        """Apply events appended to the log since it was last read (possibly by another process)."""
+        if not self.log_file.exists():
+            return
+        with self.log_file.open('rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Ignore a trailing partial line from an interrupted write
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable line in {self.log_file}: {line[:80]!r}")
+                continue
+            if record['seq'] <= self._seq:
+                continue
+            self._apply(record)
+            self._seq = record['seq']
+            self._since_snapshot += 1
+        self._offset += len(complete)
+
+    def _apply(self, record: Dict) -> None:
+        if record.get('type') == 'batch':
+            for event in record['events']:
+                self.reducer(self._state, event)
+        else:
+            self.reducer(self._state, record)
+
+    def _sync(self) -> None:
+        if self._state is None:
+            self._load()
+            return
+        if self._snapshot_stamp() != self._snapshot_mtime:  # Another process snapshotted
+            self._load()
+            return
+        try:
+            size = self.log_file.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size < self._offset:
+            self._load()
+        elif size > self._offset:
+            self._replay_tail()
+
+    @property
+    def state(self) -> Any:
+        """Current state (shared; modify it only through ``append``)."""
+        with self._lock:
+            self._sync()
+            return self._state
+
+    @property
+    def version(self) -> int:
+        """Sequence number of the last applied write; changes whenever the state does."""
+        with self._lock:
+            self._sync()
+            return self._seq
+
+    # ---- Writing ----
+    def append(self, *events: Dict) -> None:
+        """Apply events and persist them atomically as one log line (one sequence number)."""
+        if not events:
+            return
+        with self._lock, self.log_file.open('ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                self._sync()
+                self._drop_torn_tail(f)
+                self._seq += 1
+                if len(events) == 1:
+                    record = dict(events[0], seq=self._seq)
+                else:
+                    record = {'type': 'batch', 'events': list(events), 'seq': self._seq}
+                self._apply(record)
+                payload = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+                f.write(payload)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                self._offset += len(payload)
+                self._since_snapshot += 1
+
+                # The first write also snapshots, which pins state seeded from a legacy file
+                if self._since_snapshot >= self.snapshot_every or not self.snapshot_file.exists():
+                    self._write_snapshot(f)
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _drop_torn_tail(self, log_handle) -> None:
+        """Cut a partial last line left by an interrupted write; the caller holds the log lock.
+
+        ``_sync`` has applied every complete line, so anything past the
+        applied offset is a torn record. Appending after it would glue the
+        next record onto the same line and lose both.
+        """
+        if os.fstat(log_handle.fileno()).st_size > self._offset:
+            print(f"Discarding a partial record at the end of {self.log_file}")
+            log_handle.truncate(self._offset)
+
+    def snapshot(self) -> None:
+        """Persist the full state and start a fresh log."""
+        with self._lock, self.log_file.open('ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                self._sync()
+                self._write_snapshot(f)
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def rewrite(self, reducer: Callable[[Any, Dict], None],
+                convert: Optional[Callable[[Any], None]] = None) -> None:
+        """Rebuild the state by replaying with ``reducer`` and store it as a fresh snapshot.
+        
+        For migrations: events of an older format are replayed once by a
+        reducer that understands them (``convert`` finishes the state in
+        place), so the log's own reducer never sees them again.
+        """
+        with self._lock, self.log_file.open('ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                live_reducer, self.reducer = self.reducer, reducer
+                try:
+                    self._load()
+                finally:
+                    self.reducer = live_reducer
+                if convert is not None:
+                    convert(self._state)
+                self._write_snapshot(f)
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _write_snapshot(self, log_handle) -> None:
+        """Write the snapshot and truncate the log; the caller holds the log lock."""
+        temp_file = self.snapshot_file.with_suffix('.tmp')
+        with temp_file.open('w') as f:
+            json.dump({'seq': self._seq, 'state': self._state}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        temp_file.replace(self.snapshot_file)
+        self._snapshot_mtime = self._snapshot_stamp()
+        log_handle.truncate(0)
+        self._offset = 0
+        self._since_snapshot = 0
+
+    def copy_state(self) -> Any:
+        """Deep copy of the current state, safe to modify."""
+        with self._lock:
+            return copy.deepcopy(self.state)
+
+
+_logs: Dict[str, EventLog] = {}
+_logs_lock = threading.Lock()
+
+
+def get_event_log(name: str, reducer: Callable[[Any, Dict], None],
+                  initial: Callable[[], Any], register: bool = True) -> EventLog:
+    """Shared EventLog for a stream, so every reader in the process sees one state.
+
+    With ``register=False`` a stream that is not loaded yet gets a private
+    instance, for one-off reads that should not stay in memory.
+    """
+    with _logs_lock:
+        if name in _logs:
+            return _logs[name]
+        log = EventLog(name, reducer, initial)
+        if register:
+            _logs[name] = log
+        return log
+
+
+def legacy_json(path: Path, default: Callable[[], Any]) -> Callable[[], Any]:
+    """Initial-state factory that seeds a new log from an old whole-state JSON file."""
+    def _initial():
+        if path.exists():
+            try:
+                with path.open('r') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error importing {path}: {e}")
+        return default()
+    return _initial
@@ -0,0 +1,265 @@
+"""Bulk flashcard generation from the indexed document corpus."""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from domain_expert import query_domain_expert, rag_system
+from flashcards import FlashcardDeck
+
+JOB_DIR = Path('flashcard_jobs')
+JOB_DIR.mkdir(exist_ok=True)
+
+MAX_CHUNKS = 60              # Most relevant chunks of the corpus used per topic
+MIN_RELEVANCE = 0.25         # Cosine similarity to the topic below which a chunk is skipped
+CHUNKS_PER_CALL = 3          # Chunks sent together in one LLM call
+PAIRS_PER_CALL = 5           # Flashcards requested per LLM call
+MAX_WORKERS = 4              # Concurrent LLM calls
+DUPLICATE_THRESHOLD = 0.9    # Cosine similarity of fronts above which a card is a duplicate
+
+
+def _embed(texts: List[str]) -> np.ndarray:
+    return rag_system.retriever.embedder.encode(
+        texts,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+
+
+def topic_chunks(topic: str, max_chunks: int = MAX_CHUNKS) -> List:
+    """Corpus chunks relevant to ``topic``, in document order.
+
+    Chunks are ranked by the similarity of their stored embeddings to the
+    topic, so no search or reranking call is made per chunk.
+    """
+    documents = [doc for doc in rag_system.retriever.documents if doc.embedding is not None]
+    if not documents:
+        return []
+    embeddings = np.vstack([doc.embedding for doc in documents]).astype(np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarities = embeddings @ _embed([topic])[0]
+    ranked = np.argsort(-similarities, kind='stable')[:max_chunks]
+    chosen = [documents[i] for i in ranked if similarities[i] >= MIN_RELEVANCE]
+    return sorted(chosen, key=lambda doc: (doc.source, doc.page or 0, doc.chunk_index))
+
+
+def _parse_pairs(response: str) -> List[Dict]:
+    """Read ``FRONT:``/``BACK:`` line pairs from an LLM response."""
+    pairs, front = [], None
+    for line in response.split('\n'):
+        line = line.strip()
+        if line.startswith('FRONT:'):
+            front = line[len('FRONT:'):].strip()
+        elif line.startswith('BACK:') and front:
+            back = line[len('BACK:'):].strip()
+            if back:
+                pairs.append({'front': front, 'back': back})
+            front = None
+    return pairs
+
+
+def generate_pairs(topic: str, chunks: List, count: int = PAIRS_PER_CALL) -> List[Dict]:
+    """One LLM call turning a few chunks into up to ``count`` flashcards."""
+    context = "\n\n---\n\n".join(f"{doc.get_citation()}\n{doc.text}" for doc in chunks)
+    prompt = (
+        f"Create {count} flashcards about '{topic}' from the provided context.\n"
+        "Requirements:\n"
+        "1. Each front is a short, self-contained question\n"
+        "2. Each back is a concise answer (one or two sentences) taken from the context\n"
+        "3. Cover different facts; do not repeat a question\n"
+        "Format (repeat for each flashcard):\n"
+        "FRONT: <question>\n"
+        "BACK: <answer>"
+    )
+    response = query_domain_expert(prompt, context, temperature=0.3)
+    if response.startswith('[Error:'):
+        raise RuntimeError(response)
+    return _parse_pairs(response)[:count]
+
+
+def dedupe_pairs(pairs: List[Dict], existing_fronts: List[str] = None,
+                 threshold: float = DUPLICATE_THRESHOLD) -> List[Dict]:
+    """Drop pairs whose front is near-identical to an earlier pair or an existing card."""
+    if not pairs:
+        return []
+    existing_fronts = existing_fronts or []
+    vectors = _embed([pair['front'] for pair in pairs] + existing_fronts)
+    kept_vectors = list(vectors[len(pairs):])
+    kept = []
+    for pair, vector in zip(pairs, vectors[:len(pairs)]):
+        if kept_vectors and float(np.max(np.vstack(kept_vectors) @ vector)) >= threshold:
+            continue
+        kept.append(pair)
+        kept_vectors.append(vector)
+    return kept
+
+
+class FlashcardGenerationJob:
+    """Generates a topic's flashcards from the corpus and adds them to users' decks.
+
+    Chunks are batched into concurrent LLM calls. Every finished call is
+    recorded in ``flashcard_jobs/<topic>.json``, so an interrupted job
+    resumes with the chunks it has not covered yet. Once all calls are done,
+    the cards are deduplicated by embedding and each deck gets them in one
+    write. The progress file is removed unless a call failed, in which case
+    a rerun retries only the failed chunks.
+    """
+
+    def __init__(self, topic: str, max_chunks: int = MAX_CHUNKS, chunks_per_call: int = CHUNKS_PER_CALL,
+                 pairs_per_call: int = PAIRS_PER_CALL, max_workers: int = MAX_WORKERS):
+        self.topic = topic
+        self.max_chunks = max_chunks
+        self.chunks_per_call = chunks_per_call
+        self.pairs_per_call = pairs_per_call
+        self.max_workers = max_workers
+        slug = hashlib.sha1(topic.encode()).hexdigest()[:12]
+        self.progress_file = JOB_DIR / f"{slug}.json"
+        self.progress = self._load_progress()
+
+    # ---- Progress ----
+    def _load_progress(self) -> Dict:
+        if self.progress_file.exists():
+            try:
+                with self.progress_file.open('r') as f:
+                    progress = json.load(f)
+                if progress.get('topic') == self.topic:
+                    return progress
+            except Exception as e:
+                print(f"Error loading {self.progress_file}: {e}")
+        return {'topic': self.topic, 'done_chunks': [], 'pairs': []}
+
+    def _save_progress(self) -> None:
+        temp_file = self.progress_file.with_suffix('.tmp')
+        with temp_file.open('w') as f:
+            json.dump(self.progress, f)
+        temp_file.replace(self.progress_file)
+
+    # ---- Running ----
+    def generate(self) -> Dict:
+        """Run the LLM calls not done yet; returns throughput figures for this run."""
+        done = set(self.progress['done_chunks'])
+        chunks = [doc for doc in topic_chunks(self.topic, self.max_chunks) if doc.id not in done]
+        batches = [chunks[i:i + self.chunks_per_call] for i in range(0, len(chunks), self.chunks_per_call)]
+        started = time.time()
+        calls = failed = pairs = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="flashcards") as executor:
+            futures = {
+                executor.submit(generate_pairs, self.topic, batch, self.pairs_per_call): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    generated = future.result()
+                except Exception as e:
+                    print(f"Flashcard generation failed for {len(batch)} chunks of {self.topic}: {e}")
+                    failed += 1
+                    continue
+                for pair in generated:
+                    pair['subtopic'] = self.topic
+                calls += 1
+                pairs += len(generated)
+                self.progress['done_chunks'].extend(doc.id for doc in batch)
+                self.progress['pairs'].extend(generated)
+                self._save_progress()
+
+        seconds = time.time() - started
+        return {
+            'topic': self.topic,
+            'chunks': sum(len(batch) for batch in batches),
+            'resumed_chunks': len(done),
+            'calls': calls,
+            'failed_calls': failed,
+            'pairs_generated': pairs,
+            'seconds': round(seconds, 2),
+            'chunks_per_second': round(sum(len(batch) for batch in batches) / seconds, 2) if seconds else 0.0,
+            'pairs_per_second': round(pairs / seconds, 2) if seconds else 0.0
+        }
+
+    def write(self, usernames: List[str]) -> Dict[str, int]:
+        """Add the generated cards to each user's deck for the topic; returns cards added per user."""
+        added = {}
+        for username in usernames:
+            deck = FlashcardDeck(username, self.topic)
+            existing = [card['front'] for card in deck.get_cards()]
+            deck.add_cards(dedupe_pairs(self.progress['pairs'], existing))
+            added[username] = len(deck.get_cards()) - len(existing)
+        return added
+
+    def run(self, usernames: List[str]) -> Dict:
+        """Generate (or resume) and write; the progress file is kept if any call failed."""
+        report = self.generate()
+        report['cards_added'] = self.write(usernames)
+        if not report['failed_calls']:
+            self.progress_file.unlink(missing_ok=True)
+        return report
+
+
+_running: Dict[str, set] = {}  # Topic -> users waiting for its background job
+_running_lock = threading.Lock()
+
+
+def generate_flashcards(username: str, topic: str, **options) -> Dict:
+    """Fill a user's deck for ``topic`` from the corpus."""
+    return FlashcardGenerationJob(topic, **options).run([username])
+
+
+def generate_flashcards_async(username: str, topic: str) -> None:
+    """Fill a user's deck in a background thread.
+
+    There is at most one job per topic, since its progress file is per
+    topic. Users asking while it runs join it, and each gets the cards once
+    generation is done (users joining during the writes get them too).
+    """
+    with _running_lock:
+        if topic in _running:
+            _running[topic].add(username)
+            return
+        _running[topic] = {username}
+
+    def _run():
+        try:
+            job = FlashcardGenerationJob(topic)
+            report = job.generate()
+            written = set()
+            while True:
+                with _running_lock:
+                    waiting = sorted(_running[topic] - written)
+                    if not waiting:
+                        if not report['failed_calls']:
+                            job.progress_file.unlink(missing_ok=True)
+                        del _running[topic]
+                        return
+                for user, added in job.write(waiting).items():
+                    print(f"Generated {added} flashcards for {user} on {topic}")
+                written.update(waiting)
+        except Exception as e:
+            print(f"Background flashcard generation failed for {topic}: {e}")
+            with _running_lock:
+                _running.pop(topic, None)
+
+    threading.Thread(target=_run, daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate flashcards for a topic from the indexed corpus.")
+    parser.add_argument("topic", help="Topic to generate flashcards for")
+    parser.add_argument("--user", dest="users", action="append", required=True,
+                        help="User whose deck receives the cards (repeatable)")
+    parser.add_argument("--max-chunks", type=int, default=MAX_CHUNKS, help="Most relevant chunks to use")
+    parser.add_argument("--chunks-per-call", type=int, default=CHUNKS_PER_CALL, help="Chunks per LLM call")
+    parser.add_argument("--pairs-per-call", type=int, default=PAIRS_PER_CALL, help="Flashcards requested per LLM call")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent LLM calls")
+    args = parser.parse_args()
+
+    job = FlashcardGenerationJob(args.topic, args.max_chunks, args.chunks_per_call,
+                                 args.pairs_per_call, args.workers)
+    print(json.dumps(job.run(args.users), indent=2))
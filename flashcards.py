@@ -1,103 +1,387 @@
 """Flashcard system with spaced repetition."""
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import argparse
+import fcntl
+import hashlib
 import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 from pathlib import Path
 
+from card_store import CONTENT_FIELDS, card_store
+from due_index import DueIndex, ensure_source, get_due_index
+from event_log import EVENT_LOG_DIR, EventLog, get_event_log, legacy_json
+
+DECK_SCHEMA = 4  # 3: per-topic schedules referencing card bodies in the shared card store; 4: events carry body ids
+REVIEW_FLUSH_SECONDS = 30  # Longest time a review session keeps reviews unsaved
+REVIEW_JOURNAL_DIR = EVENT_LOG_DIR / 'review_journals'  # <username>/<session>.jsonl of unsaved reviews
+
+_upgrade_lock = threading.Lock()
+
+
+def _empty_deck() -> Dict:
+    return {
+        'schema': DECK_SCHEMA,
+        'decks': {},  # topic -> card id -> schedule (with the body's ``content`` id)
+        'stats': {
+            'cards_studied': 0,
+            'correct_answers': 0,
+            'study_sessions': 0
+        }
+    }
+
+def _normalize_front(front: str) -> str:
+    return front.lower().strip()
+
+def card_id(topic: str, front: str) -> str:
+    """Stable id of a card: a hash of its topic and normalized front (used for deduplication)."""
+    return hashlib.sha1(f"{topic}\0{_normalize_front(front)}".encode()).hexdigest()[:16]
+
+def _epoch(value) -> int:
+    """Due time in epoch seconds from an ISO string (older data), a number or None (now)."""
+    if value is None:
+        return int(time.time())
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+def _new_schedule(content: str, card: Optional[Dict] = None) -> Dict:
+    """A user's state for a card body, carrying over the fields of an older whole card or schedule."""
+    card = card or {}
+    return {
+        'content': content,
+        'due': _epoch(card.get('due', card.get('next_review'))),
+        'interval': card.get('interval', 0),  # Days until next review
+        'ease_factor': card.get('ease_factor', 2.5),  # SuperMemo-2 algorithm factor
+        'repetitions': card.get('repetitions', 0),  # Number of successful reviews
+        'last_reviewed': card.get('last_reviewed'),
+        'difficulty_level': card.get('difficulty_level', 'medium')  # Track original difficulty
+    }
+
+def _upgrade_deck(deck: Dict) -> None:
+    """Convert older state in place, moving card text to the shared card store.
+    
+    Schema 1 held per-topic lists of whole cards; schema 2 held card bodies
+    by id next to per-topic schedules; schema 3 has the current layout but
+    its log may hold edits carrying card text.
+    """
+    if deck.get('schema') == DECK_SCHEMA:
+        return
+    with _upgrade_lock:
+        if deck.get('schema') == DECK_SCHEMA:
+            return
+        if deck.get('schema') == 3:
+            deck['schema'] = DECK_SCHEMA
+            return
+        if deck.get('schema') == 2:
+            cards = [
+                (topic, cid, dict(deck['cards'][cid], **schedule))
+                for topic, schedules in deck['decks'].items()
+                for cid, schedule in schedules.items()
+            ]
+        else:
+            cards = [
+                (topic, card_id(topic, card['front']), card)
+                for topic, topic_cards in deck.get('decks', {}).items()
+                for card in topic_cards
+            ]
+        contents = card_store.put_many(card for _, _, card in cards)
+        deck['decks'] = {}
+        for (topic, cid, card), content in zip(cards, contents):
+            deck['decks'].setdefault(topic, {}).setdefault(cid, _new_schedule(content, card))
+        deck.pop('cards', None)
+        deck.setdefault('stats', _empty_deck()['stats'])
+        deck['schema'] = DECK_SCHEMA
+
+def _apply_deck_event(deck: Dict, event: Dict) -> None:
+    """Reducer for a user's flashcard event log (current schema only; pure).
+    
+    A log not migrated yet is left alone here; ``migrate_deck_log`` replays
+    it with ``_apply_legacy_deck_event`` instead.
+    """
+    if deck.get('schema') != DECK_SCHEMA:
+        return
+    if event['type'] == 'card_added':
+        deck['decks'].setdefault(event['topic'], {}).setdefault(event['id'], dict(event['schedule']))
+    elif event['type'] == 'card_updated':
+        schedule = deck['decks'].get(event['topic'], {}).get(event['id'])
+        if schedule is not None:
+            schedule.update(event['fields'])
+    elif event['type'] == 'stats':
+        for key, amount in event['increments'].items():
+            deck['stats'][key] = deck['stats'].get(key, 0) + amount
+
+def _apply_legacy_deck_event(deck: Dict, event: Dict) -> None:
+    """Reducer replaying logs of every older schema, only used by ``migrate_deck_log``.
+    
+    Unlike the live reducer it writes card text found in old events to the
+    card store.
+    """
+    _upgrade_deck(deck)
+    if event['type'] == 'card_added':
+        schedules = deck['decks'].setdefault(event['topic'], {})
+        if 'card' in event:  # Schema 1: the whole card
+            cid = card_id(event['topic'], event['card']['front'])
+            if cid not in schedules:
+                schedules[cid] = _new_schedule(card_store.put(event['card']), event['card'])
+        elif 'body' in event:  # Schema 2: body and schedule
+            if event['id'] not in schedules:
+                card = dict(event['body'], **event['schedule'])
+                schedules[event['id']] = _new_schedule(card_store.put(card), card)
+        elif event['id'] not in schedules:
+            schedules[event['id']] = dict(event['schedule'])
+    elif event['type'] == 'card_updated':
+        cid = event.get('id') or card_id(event['topic'], event['front'])
+        schedule = deck['decks'].get(event['topic'], {}).get(cid)
+        if schedule is not None:
+            fields = dict(event['fields'])
+            if 'next_review' in fields:
+                fields['due'] = _epoch(fields.pop('next_review'))
+            content = {field: fields.pop(field) for field in CONTENT_FIELDS if field in fields}
+            fields.pop('created_at', None)
+            if content:  # Edited text is a new body; the old one may be shared
+                schedule['content'] = card_store.put(dict(card_store.get(schedule['content']), **content))
+            schedule.update(fields)
+    elif event['type'] == 'stats':
+        for key, amount in event['increments'].items():
+            deck['stats'][key] = deck['stats'].get(key, 0) + amount
+
+def deck_log(username: str, register: bool = True) -> EventLog:
+    """Event log holding every flashcard deck of a user.
+    
+    Seeded once from the legacy ``flashcards_<username>.json`` file. A log
+    still in an older schema (normally handled by ``migrate_decks`` at
+    startup) is migrated before it is returned.
+    """
+    log = get_event_log(
+        f"flashcards_{username}",
+        _apply_deck_event,
+        legacy_json(Path(f'flashcards_{username}.json'), _empty_deck),
+        register=register
+    )
+    if log.state.get('schema') != DECK_SCHEMA:
+        migrate_deck_log(log)
+    return log
+
+def migrate_deck_log(log: EventLog) -> None:
+    """Upgrade a user's flashcard log to the current schema in one snapshot.
+    
+    The log is replayed with the legacy reducer, which moves card text to
+    the card store, and the result replaces the log, so the live reducer
+    never has to understand older events.
+    """
+    print(f"Migrating {log.name} to flashcard schema {DECK_SCHEMA}")
+    log.rewrite(_apply_legacy_deck_event, _upgrade_deck)
+
+def migrate_decks() -> int:
+    """Migrate every user's flashcard log that is not at the current schema; returns how many were."""
+    usernames = {path.name[len('flashcards_'):-len('.jsonl')] for path in EVENT_LOG_DIR.glob('flashcards_*.jsonl')}
+    usernames.update(path.name[len('flashcards_'):-len('.snapshot.json')]
+                     for path in EVENT_LOG_DIR.glob('flashcards_*.snapshot.json'))
+    usernames.update(path.stem[len('flashcards_'):] for path in Path('.').glob('flashcards_*.json'))
+    migrated = 0
+    for username in sorted(usernames):
+        log = get_event_log(f"flashcards_{username}", _apply_deck_event,
+                            legacy_json(Path(f'flashcards_{username}.json'), _empty_deck), register=False)
+        if log.state.get('schema') != DECK_SCHEMA:
+            migrate_deck_log(log)
+            migrated += 1
+    return migrated
+
+def load_flashcards(username: str) -> Dict:
+    """All of a user's cards, schedules and stats (shared state; do not modify)."""
+    return deck_log(username).state
+
+def scan_flashcards(username: str) -> Dict:
+    """A user's flashcard state for a one-off read, without keeping the log loaded."""
+    return deck_log(username, register=False).state
+
+def _card_view(deck: Dict, topic: str, cid: str, body: Optional[Dict] = None) -> Dict:
+    """A card as one dict (body, schedule, ``id`` and ``topic``), built for callers."""
+    schedule = deck['decks'][topic][cid]
+    if body is None:
+        body = card_store.get(schedule['content'])
+    return dict(body, **schedule, id=cid, topic=topic)
+
+def _card_views(deck: Dict, refs: List[Tuple[str, str]]) -> List[Dict]:
+    """Cards for ``(topic, card id)`` pairs, fetching their bodies from the card store at once."""
+    bodies = card_store.get_many(deck['decks'][topic][cid]['content'] for topic, cid in refs)
+    return [
+        _card_view(deck, topic, cid, bodies[deck['decks'][topic][cid]['content']])
+        for topic, cid in refs
+    ]
+
+def _card_entry(deck: Dict, topic: str, cid: str):
+    """Due-index entry ``(key, due epoch, item)`` for a card; the item references the stored schedule."""
+    schedule = deck['decks'][topic][cid]
+    return ('flashcard', topic, cid), schedule['due'], {'topic': topic, 'id': cid, 'schedule': schedule}
+
+def _append_and_index(username: str, log: EventLog, events: List[Dict],
+                      changed: Iterable[Tuple[str, str]]) -> None:
+    """Append events as one write and move the changed ``(topic, card id)``s in the due indexes.
+    
+    The global due scheduler is always told the new due times. The user's
+    index is only patched if it was current before the write and no other
+    writer's events were replayed by it; otherwise it is rebuilt on next use.
+    """
+    from due_scheduler import due_scheduler
+    
+    changed = list(changed)
+    index = get_due_index(username)
+    with index.lock:
+        before = log.version
+        log.append(*events)
+        deck = load_flashcards(username)
+        if index.versions.get('flashcard') == before and log.version == before + 1:
+            for topic, cid in changed:
+                index.upsert(*_card_entry(deck, topic, cid))
+            index.versions['flashcard'] = log.version
+    due_scheduler.cards_changed(username, [(topic, cid, deck['decks'][topic][cid]['due']) for topic, cid in changed])
+
+def _sm2_fields(card: Dict, quality: int) -> Dict:
+    """New scheduling fields for a card reviewed with ``quality`` (SuperMemo-2)."""
+    fields = {
+        'interval': card['interval'],
+        'ease_factor': card['ease_factor'],
+        'repetitions': card['repetitions']
+    }
+    if quality < 3:
+        # Reset card on failure
+        fields['interval'] = 0
+        fields['repetitions'] = 0
+    else:
+        # Update ease factor
+        fields['ease_factor'] = max(1.3, card['ease_factor'] + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
+        
+        # Calculate next interval
+        if card['repetitions'] == 0:
+            fields['interval'] = 1
+        elif card['repetitions'] == 1:
+            fields['interval'] = 6
+        else:
+            fields['interval'] = round(card['interval'] * fields['ease_factor'])
+        
+        fields['repetitions'] = card['repetitions'] + 1
+    
+    # Update review dates
+    now = time.time()
+    fields['last_reviewed'] = datetime.fromtimestamp(now).isoformat()
+    fields['due'] = int(now) + fields['interval'] * 86400
+    return fields
+
+def due_index(username: str) -> DueIndex:
+    """The user's due index with its flashcard entries (grouped by topic) up to date.
+    
+    The flashcard entries are rebuilt only when the event log moved past the
+    version they were built from without going through this module
+    (e.g. another process reviewed cards).
+    """
+    log = deck_log(username)
+    index = get_due_index(username)
+    deck = load_flashcards(username)
+    ensure_source(index, 'flashcard', log.version, lambda: [
+        _card_entry(deck, topic, cid)
+        for topic, schedules in deck['decks'].items()
+        for cid in schedules
+    ])
+    return index
+
 class FlashcardDeck:
-    """Manages a deck of flashcards with spaced repetition."""
+    """Manages a deck of flashcards with spaced repetition.
+    
+    Changes are appended to the user's flashcard event log (one line per
+    added card, review or stats update) rather than rewriting the deck file.
+    """
     
     def __init__(self, username: str, topic: str):
         self.username = username
         self.topic = topic
-        self.deck_file = Path(f'flashcards_{username}.json')
-        self.deck = self._load_or_create_deck()
-        
-    def _load_or_create_deck(self) -> Dict:
-        """Load existing deck or create new one."""
-        if self.deck_file.exists():
-            with self.deck_file.open('r') as f:
-                return json.load(f)
-        return {
-            'decks': {},
-            'stats': {
-                'cards_studied': 0,
-                'correct_answers': 0,
-                'study_sessions': 0
-            }
-        }
+        self.log = deck_log(username)
+    
+    @property
+    def deck(self) -> Dict:
+        return load_flashcards(self.username)
     
     def save_deck(self):
-        """Save deck to file."""
-        with self.deck_file.open('w') as f:
-            json.dump(self.deck, f, indent=2)
+        """Compact the deck's event log into a snapshot."""
+        self.log.snapshot()
+    
+    def update_card(self, card: Dict, **fields):
+        """Persist changes to one card (a dict returned by this deck).
+        
+        Edited text is stored as a new body first (the old one may be
+        shared), so the event only carries the body's id. Nothing is
+        written if no field changes.
+        """
+        fields = {k: v for k, v in fields.items() if card.get(k) != v}
+        if not fields:
+            return
+        card.update(fields)
+        schedule_fields = {k: v for k, v in fields.items() if k not in CONTENT_FIELDS}
+        if 'next_review' in schedule_fields:
+            schedule_fields['due'] = _epoch(schedule_fields.pop('next_review'))
+        content = {field: fields[field] for field in CONTENT_FIELDS if field in fields}
+        if content:
+            schedule_fields['content'] = card['content'] = card_store.put(
+                dict(card_store.get(card['content']), **content)
+            )
+        _append_and_index(
+            self.username, self.log,
+            [{'type': 'card_updated', 'topic': self.topic, 'id': card['id'], 'fields': schedule_fields}],
+            [(self.topic, card['id'])]
+        )
     
     def add_card(self, front: str, back: str, subtopic: str = None) -> Dict:
         """Add a new flashcard to the deck."""
-        if self.topic not in self.deck['decks']:
-            self.deck['decks'][self.topic] = []
-            
-        # Check for duplicates
-        for existing_card in self.deck['decks'][self.topic]:
-            if existing_card['front'].lower().strip() == front.lower().strip():
-                return existing_card  # Don't add duplicate
-            
-        card = {
-            'front': front,
-            'back': back,
-            'subtopic': subtopic or self.topic,
-            'created_at': datetime.now().isoformat(),
-            'last_reviewed': None,
-            'next_review': datetime.now().isoformat(),
-            'interval': 0,  # Days until next review
-            'ease_factor': 2.5,  # SuperMemo-2 algorithm factor
-            'repetitions': 0,  # Number of successful reviews
-            'difficulty_level': 'medium',  # Track original difficulty
-        }
-        
-        self.deck['decks'][self.topic].append(card)
-        self.save_deck()
-        return card
+        return self.add_cards([{'front': front, 'back': back, 'subtopic': subtopic}])[0]
     
-    def get_due_cards(self, limit: Optional[int] = None) -> List[Dict]:
-        """Get cards due for review."""
-        if self.topic not in self.deck['decks']:
-            return []
-            
-        now = datetime.now()
-        due_cards = []
+    def add_cards(self, cards: List[Dict]) -> List[Dict]:
+        """Add flashcards (dicts with ``front``, ``back`` and optional ``subtopic``) in one write.
         
-        for card in self.deck['decks'][self.topic]:
-            next_review = datetime.fromisoformat(card['next_review'])
-            if next_review <= now:
-                due_cards.append(card)
-        
-        # Sort by most overdue first
-        due_cards.sort(key=lambda x: datetime.fromisoformat(x['next_review']))
+        Card text goes to the shared card store; the deck only records each
+        card's id and scheduling state. Cards already in the deck are not added
+        again. Returns the deck's card for each input.
+        """
+        deck = self.deck
+        schedules = deck['decks'].get(self.topic, {})
+        cids = [card_id(self.topic, card['front']) for card in cards]
+        new = {}  # Don't add duplicates
+        for cid, card in zip(cids, cards):
+            if cid not in schedules and cid not in new:
+                new[cid] = {'front': card['front'], 'back': card['back'], 'subtopic': card.get('subtopic') or self.topic}
         
-        if limit:
-            return due_cards[:limit]
-        return due_cards
+        if new:
+            contents = card_store.put_many(new.values())
+            _append_and_index(
+                self.username, self.log,
+                [
+                    {'type': 'card_added', 'topic': self.topic, 'id': cid, 'schedule': _new_schedule(content)}
+                    for cid, content in zip(new, contents)
+                ],
+                [(self.topic, cid) for cid in new]
+            )
+        return _card_views(self.deck, [(self.topic, cid) for cid in cids])
+    
+    def get_cards(self) -> List[Dict]:
+        """Every card of the deck."""
+        deck = self.deck
+        return _card_views(deck, [(self.topic, cid) for cid in deck['decks'].get(self.topic, {})])
+    
+    def get_due_cards(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get cards due for review, most overdue first."""
+        due = due_index(self.username).due_by(time.time(), 'flashcard', self.topic, limit=limit or None)
+        return _card_views(self.deck, [(self.topic, item['id']) for _, item in due])
     
     def get_cards_due_within_days(self, days: int = 7) -> List[Dict]:
-        """Get cards due within specified number of days."""
-        if self.topic not in self.deck['decks']:
-            return []
-            
-        now = datetime.now()
-        cutoff = now + timedelta(days=days)
-        upcoming_cards = []
-        
-        for card in self.deck['decks'][self.topic]:
-            next_review = datetime.fromisoformat(card['next_review'])
-            if next_review <= cutoff:
-                days_until = (next_review - now).days
-                card_info = card.copy()
-                card_info['days_until_review'] = max(0, days_until)
-                upcoming_cards.append(card_info)
-        
-        # Sort by review date
-        upcoming_cards.sort(key=lambda x: x['days_until_review'])
+        """Get cards due within specified number of days, soonest first."""
+        now = time.time()
+        due = due_index(self.username).due_by(now + days * 86400, 'flashcard', self.topic)
+        upcoming_cards = _card_views(self.deck, [(self.topic, item['id']) for _, item in due])
+        for (due_at, _), card_info in zip(due, upcoming_cards):
+            card_info['days_until_review'] = max(0, int((due_at - now) // 86400))
         return upcoming_cards
     
     def update_card_schedule(self, card: Dict, quality: int):
@@ -113,57 +397,192 @@ class FlashcardDeck:
                 4 - Correct
                 5 - Correct and easy
         """
-        if quality < 3:
-            # Reset card on failure
-            card['interval'] = 0
-            card['repetitions'] = 0
-        else:
-            # Update ease factor
-            card['ease_factor'] = max(1.3, card['ease_factor'] + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
-            
-            # Calculate next interval
-            if card['repetitions'] == 0:
-                card['interval'] = 1
-            elif card['repetitions'] == 1:
-                card['interval'] = 6
-            else:
-                card['interval'] = round(card['interval'] * card['ease_factor'])
-            
-            card['repetitions'] += 1
-        
-        # Update review dates
-        card['last_reviewed'] = datetime.now().isoformat()
-        next_review = datetime.now() + timedelta(days=card['interval'])
-        card['next_review'] = next_review.isoformat()
-        
-        self.save_deck()
+        self.update_card(card, **_sm2_fields(card, quality))
     
     def get_stats(self) -> Dict:
         """Get study statistics for this deck."""
+        deck = self.deck
         return {
-            'total_cards': len(self.deck['decks'].get(self.topic, [])),
-            'cards_due': len(self.get_due_cards()),
-            **self.deck['stats']
+            'total_cards': len(deck['decks'].get(self.topic, {})),
+            'cards_due': due_index(self.username).due_count(source='flashcard', group=self.topic),
+            **deck['stats']
         }
     
     def update_stats(self, correct: bool):
         """Update deck statistics."""
-        self.deck['stats']['cards_studied'] += 1
-        if correct:
-            self.deck['stats']['correct_answers'] += 1
-        self.save_deck()
+        self.log.append({
+            'type': 'stats',
+            'increments': {'cards_studied': 1, 'correct_answers': 1 if correct else 0}
+        })
+
+def recover_reviews(username: str) -> int:
+    """Save the reviews left in journals of review sessions that ended without committing.
+    
+    A journal still locked belongs to a live session and is skipped. Returns
+    the number of recovered reviews.
+    """
+    directory = REVIEW_JOURNAL_DIR / username
+    if not directory.exists():
+        return 0
+    recovered = 0
+    for path in sorted(directory.glob('*.jsonl')):
+        try:
+            journal = path.open('rb')
+        except FileNotFoundError:  # Recovered by another process meanwhile
+            continue
+        with journal:
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not path.exists():
+                continue
+            pending: Dict[Tuple[str, str], Dict] = {}
+            increments = {'cards_studied': 0, 'correct_answers': 0, 'study_sessions': 1}
+            for line in journal.read().splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Torn last line of a crashed session
+                    continue
+                if record.get('counted'):
+                    increments['study_sessions'] = 0
+                    continue
+                pending[(record['topic'], record['id'])] = record['fields']
+                increments['cards_studied'] += 1
+                increments['correct_answers'] += 1 if record['correct'] else 0
+            if pending:
+                events = [
+                    {'type': 'card_updated', 'topic': topic, 'id': cid, 'fields': fields}
+                    for (topic, cid), fields in pending.items()
+                ]
+                events.append({'type': 'stats', 'increments': increments})
+                _append_and_index(username, deck_log(username), events, list(pending))
+                recovered += increments['cards_studied']
+            path.unlink()
+    if recovered:
+        print(f"Recovered {recovered} unsaved flashcard reviews for {username}")
+    return recovered
+
+class ReviewSession:
+    """A run of card reviews for one user, saved in batches.
+    
+    Reviews are buffered in memory and written as a single atomic event-log
+    line (all of them or none survive a crash) when the session ends, on
+    ``commit()``, or at the latest ``flush_interval`` seconds after the first
+    unsaved review. Use as a context manager::
+    
+        with ReviewSession(username) as session:
+            for card in session.due_cards(topic):
+                session.review(topic, card, quality)
+    
+    Until they are committed, reviews are also journaled to a per-session file
+    (``REVIEW_JOURNAL_DIR``); the next session of the user saves whatever a
+    crashed session left there (see ``recover_reviews``).
+    """
+    
+    def __init__(self, username: str, flush_interval: float = REVIEW_FLUSH_SECONDS):
+        self.username = username
+        self.log = deck_log(username)
+        self.flush_interval = flush_interval
+        self.reviewed = 0
+        self.correct = 0
+        self._lock = threading.RLock()
+        self._pending: Dict[Tuple[str, str], Dict] = {}  # (topic, card id) -> unsaved scheduling fields
+        self._pending_stats = {'cards_studied': 0, 'correct_answers': 0}
+        self._counted_session = False
+        self._timer: Optional[threading.Timer] = None
+        self._journal = None  # Opened (and locked) on the first review
+        recover_reviews(username)
+    
+    def __enter__(self) -> 'ReviewSession':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+    
+    def _journal_write(self, record: Dict) -> None:
+        if self._journal is None:
+            directory = REVIEW_JOURNAL_DIR / self.username
+            directory.mkdir(parents=True, exist_ok=True)
+            self._journal = (directory / f"{uuid.uuid4().hex}.jsonl").open('ab')
+            fcntl.flock(self._journal, fcntl.LOCK_EX)
+        self._journal.write(json.dumps(record).encode() + b'\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+    
+    def due_cards(self, topic: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Due cards (of one topic, or all), most overdue first, skipping cards reviewed in this session."""
+        with self._lock:
+            refs = []
+            for _, item in due_index(self.username).due_by(time.time(), 'flashcard', topic):
+                if (item['topic'], item['id']) in self._pending:
+                    continue
+                refs.append((item['topic'], item['id']))
+                if limit and len(refs) >= limit:
+                    break
+            return _card_views(load_flashcards(self.username), refs)
+    
+    def review(self, topic: str, card: Dict, quality: int) -> Dict:
+        """Record a review graded ``quality`` (0-5); returns the card's new scheduling fields."""
+        with self._lock:
+            key = (topic, card['id'])
+            # A card reviewed twice in one session is scheduled from its unsaved state
+            fields = _sm2_fields(dict(card, **self._pending.get(key, {})), quality)
+            self._pending[key] = fields
+            self._journal_write({'topic': topic, 'id': card['id'], 'fields': fields, 'correct': quality >= 3})
+            self._pending_stats['cards_studied'] += 1
+            self._pending_stats['correct_answers'] += 1 if quality >= 3 else 0
+            self.reviewed += 1
+            self.correct += 1 if quality >= 3 else 0
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.commit)
+                self._timer.daemon = True
+                self._timer.start()
+            return fields
+    
+    def commit(self) -> None:
+        """Write every buffered review (and the session's stats) in one event-log line."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending and not self._pending_stats['cards_studied']:
+                return
+            
+            events = [
+                {'type': 'card_updated', 'topic': topic, 'id': cid, 'fields': fields}
+                for (topic, cid), fields in self._pending.items()
+            ]
+            increments = dict(self._pending_stats)
+            if not self._counted_session:
+                increments['study_sessions'] = 1
+            events.append({'type': 'stats', 'increments': increments})
+            
+            _append_and_index(self.username, self.log, events, list(self._pending))
+            self._pending.clear()
+            self._pending_stats = {'cards_studied': 0, 'correct_answers': 0}
+            self._counted_session = True
+            if self._journal is not None:
+                # Saved reviews leave the journal; the marker keeps recovery from counting the session twice
+                self._journal.truncate(0)
+                self._journal_write({'counted': True})
+    
+    def close(self) -> None:
+        """Commit the buffered reviews and remove the session's journal."""
+        with self._lock:
+            self.commit()
+            if self._journal is not None:
+                Path(self._journal.name).unlink(missing_ok=True)
+                self._journal.close()
+                self._journal = None
 
 def create_flashcards_from_qa(username: str, topic: str, qa_pairs: List[Dict]) -> FlashcardDeck:
     """Create flashcards from question-answer pairs."""
     deck = FlashcardDeck(username, topic)
-    
-    for qa in qa_pairs:
-        deck.add_card(
-            front=qa['question'],
-            back=qa['answer'],
-            subtopic=qa.get('subtopic')
-        )
-    
+    deck.add_cards([
+        {'front': qa['question'], 'back': qa['answer'], 'subtopic': qa.get('subtopic')}
+        for qa in qa_pairs
+    ])
     return deck
 
 def auto_create_flashcard_from_review(username: str, topic: str, question: str, 
@@ -179,66 +598,50 @@ def auto_create_flashcard_from_review(username: str, topic: str, question: str,
             back=correct_answer,
             subtopic=topic
         )
-        if 'difficulty_level' in card:
-            card['difficulty_level'] = difficulty
-            deck.save_deck()
+        if card.get('difficulty_level', difficulty) != difficulty:
+            deck.update_card(card, difficulty_level=difficulty)
         return True
     return False
 
-def get_all_due_cards_for_user(username: str) -> List[Dict]:
-    """Get all due cards across all topics for a user."""
-    flashcards_file = Path(f'flashcards_{username}.json')
-    if not flashcards_file.exists():
-        return []
-    
-    with flashcards_file.open('r') as f:
-        data = json.load(f)
-    
-    all_due_cards = []
-    now = datetime.now()
-    
-    for topic, cards in data.get('decks', {}).items():
-        for card in cards:
-            next_review = datetime.fromisoformat(card['next_review'])
-            if next_review <= now:
-                card_info = card.copy()
-                card_info['topic'] = topic
-                card_info['days_overdue'] = (now - next_review).days
-                all_due_cards.append(card_info)
-    
-    # Sort by most overdue first
-    all_due_cards.sort(key=lambda x: x['days_overdue'], reverse=True)
+def get_all_due_cards_for_user(username: str, limit: Optional[int] = None) -> List[Dict]:
+    """Get due cards (at most ``limit``) across all topics for a user, most overdue first."""
+    now = time.time()
+    due = due_index(username).due_by(now, source='flashcard', limit=limit)
+    all_due_cards = _card_views(load_flashcards(username), [(item['topic'], item['id']) for _, item in due])
+    for (due_at, _), card_info in zip(due, all_due_cards):
+        card_info['days_overdue'] = int((now - due_at) // 86400)
     return all_due_cards
 
+def count_due_cards(username: str) -> int:
+    """Number of the user's cards due now."""
+    return due_index(username).due_count(source='flashcard')
+
 def get_spaced_repetition_schedule_for_user(username: str, days_ahead: int = 7) -> List[Dict]:
-    """Get upcoming spaced repetition schedule for a user across all topics."""
-    flashcards_file = Path(f'flashcards_{username}.json')
-    if not flashcards_file.exists():
-        return []
-    
-    with flashcards_file.open('r') as f:
-        data = json.load(f)
-    
+    """Get upcoming spaced repetition schedule for a user across all topics (soonest first)."""
+    now = time.time()
+    due_items = due_index(username).due_by(now + days_ahead * 86400, source='flashcard')
+    bodies = card_store.get_many(item['schedule']['content'] for _, item in due_items)
     schedule = []
-    now = datetime.now()
-    cutoff = now + timedelta(days=days_ahead)
-    
-    for topic, cards in data.get('decks', {}).items():
-        for card in cards:
-            next_review = datetime.fromisoformat(card['next_review'])
-            if next_review <= cutoff:
-                days_until = (next_review - now).days
-                schedule.append({
-                    'topic': topic,
-                    'subtopic': card.get('subtopic', topic),
-                    'front': card['front'],
-                    'days_until_review': max(0, days_until),
-                    'review_date': next_review.strftime('%Y-%m-%d'),
-                    'priority': 'high' if days_until <= 0 else 'medium' if days_until <= 2 else 'low',
-                    'ease_factor': card.get('ease_factor', 2.5),
-                    'repetitions': card.get('repetitions', 0)
-                })
-    
-    # Sort by review date (overdue first)
-    schedule.sort(key=lambda x: x['days_until_review'])
-    return schedule 
\ No newline at end of file
+    for due, item in due_items:
+        body, topic = bodies[item['schedule']['content']], item['topic']
+        days_until = int((due - now) // 86400)
+        schedule.append({
+            'topic': topic,
+            'subtopic': body.get('subtopic', topic),
+            'front': body['front'],
+            'days_until_review': max(0, days_until),
+            'review_date': datetime.fromtimestamp(due).strftime('%Y-%m-%d'),
+            'priority': 'high' if days_until <= 0 else 'medium' if days_until <= 2 else 'low',
+            'ease_factor': item['schedule'].get('ease_factor', 2.5),
+            'repetitions': item['schedule'].get('repetitions', 0)
+        })
+    return schedule
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain users' flashcard logs.")
+    parser.add_argument("--migrate", action="store_true", help="Upgrade every flashcard log to the current schema")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"Migrated {migrate_decks()} flashcard log(s)")
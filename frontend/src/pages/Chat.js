@@ -160,6 +160,8 @@ const CommandHelp = ({ isVisible, onClose }) => (
 const Chat = () => {
   const { user } = useUser();
   const [messages, setMessages] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const [inputMessage, setInputMessage] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [suggestions, setSuggestions] = useState([]);
@@ -174,9 +176,11 @@ const Chat = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
 
+  // Only new messages at the bottom scroll; older pages are prepended in place
+  const lastMessage = messages[messages.length - 1];
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [lastMessage]);
 
   // Load chat history and suggestions on mount
   useEffect(() => {
@@ -190,11 +194,30 @@ const Chat = () => {
     try {
       const historyData = await chatAPI.getChatHistory(user.username, 50);
       setMessages(historyData.history || []);
+      setHistoryCursor(historyData.next_cursor ?? null);
     } catch (error) {
       console.error("Failed to load chat history:", error);
     }
   };
 
+  const loadOlderHistory = async () => {
+    if (historyCursor === null || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    try {
+      const historyData = await chatAPI.getChatHistory(
+        user.username,
+        50,
+        historyCursor
+      );
+      setMessages((prev) => [...(historyData.history || []), ...prev]);
+      setHistoryCursor(historyData.next_cursor ?? null);
+    } catch (error) {
+      console.error("Failed to load older chat history:", error);
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
   const loadSuggestions = async () => {
     try {
       const suggestionsData = await chatAPI.getChatSuggestions(user.username);
@@ -338,6 +361,7 @@ const Chat = () => {
     try {
       await chatAPI.clearChatHistory(user.username);
       setMessages([]);
+      setHistoryCursor(null);
       setCurrentQuizQuestion(null);
       setCurrentQuizTopic(null);
       toast.success("Chat history cleared");
@@ -445,6 +469,17 @@ const Chat = () => {
           </div>
         ) : (
           <div className="space-y-1">
+            {historyCursor !== null && (
+              <div className="flex justify-center mb-4">
+                <button
+                  onClick={loadOlderHistory}
+                  disabled={isLoadingOlder}
+                  className="text-sm text-primary-600 hover:text-primary-700 disabled:opacity-50"
+                >
+                  {isLoadingOlder ? "Loading..." : "Load earlier messages"}
+                </button>
+              </div>
+            )}
             {messages.map((message, index) => (
               <MessageBubble
                 key={index}
@@ -181,18 +181,28 @@ export const healthAPI = {
 
 // Chat API
 export const chatAPI = {
-  sendMessage: async (username, message, context = null) => {
+  sendMessage: async (username, message, context = null, lazySuggestions = false) => {
     const response = await api.post("/api/chat/message", {
       username,
       message,
       context,
+      lazy_suggestions: lazySuggestions,
     });
     return response.data;
   },
 
-  getChatHistory: async (username, limit = 20) => {
+  getMessageSuggestions: async (messageId) => {
+    const response = await api.get(`/api/chat/message/${messageId}/suggestions`);
+    return response.data;
+  },
+
+  getChatHistory: async (username, limit = 20, before = null) => {
+    const params = { limit };
+    if (before !== null) {
+      params.before = before;
+    }
     const response = await api.get(`/api/chat/${username}/history`, {
-      params: { limit },
+      params,
     });
     return response.data;
   },
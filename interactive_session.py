@@ -6,9 +6,14 @@ from typing import Dict, List, Optional, Tuple
 from enum import Enum
 
 from memory import load_user, save_user, record_learning_session
-from domain_expert import explain_concept, generate_example, generate_question, check_answer, query_domain_expert, _retrieve_context
+from domain_expert import explain_concept, generate_example, check_answer, query_domain_expert, _retrieve_context, SubtopicContextCache
 from planner import PlannerAgent
 from enhanced_memory import EnhancedMemorySystem
+from prefetch import PrefetchScheduler
+from question_bank import serve_question
+from event_log import EventLog, get_event_log, legacy_json
+
+MAX_STORED_SESSIONS = 20  # Sessions kept in a user's session log (finished ones are dropped first)
 
 
 class InteractionMode(Enum):
@@ -35,16 +40,69 @@ class Command(Enum):
     QUIT = "!quit"
 
 
+def _empty_sessions() -> Dict:
+    return {'active_sessions': []}
+
+
+def _find_session(sessions: Dict, session_id: str) -> Optional[Dict]:
+    """The latest stored session with ``session_id``, or None."""
+    return next((s for s in reversed(sessions['active_sessions']) if s['session_id'] == session_id), None)
+
+
+def _apply_session_event(sessions: Dict, event: Dict) -> None:
+    """Reducer for a user's session event log."""
+    if event['type'] == 'session_started':
+        stored = sessions['active_sessions']
+        stored.append(dict(event['session']))
+        # Bound the per-user state: ended and completed sessions are never resumed
+        while len(stored) > MAX_STORED_SESSIONS:
+            oldest = next((s for s in stored if s['status'] in ('ended', 'completed')), stored[0])
+            stored.remove(oldest)
+        return
+    
+    session = _find_session(sessions, event['session_id'])
+    if session is None:
+        return
+    if event['type'] == 'set':
+        session.update(event['fields'])
+    elif event['type'] == 'append':
+        session.setdefault(event['key'], []).append(event['item'])
+    elif event['type'] == 'increment':
+        session[event['key']] = session.get(event['key'], 0) + event['by']
+
+
+def session_log(username: str) -> EventLog:
+    """Event log of a user's sessions, seeded once from ``sessions_<username>.json``."""
+    return get_event_log(
+        f"sessions_{username}",
+        _apply_session_event,
+        legacy_json(Path(f'sessions_{username}.json'), _empty_sessions)
+    )
+
+
 class InteractiveSession:
     """Manages interactive tutoring sessions with dynamic user interaction."""
     
-    def __init__(self, username: str, topic: str):
+    def __init__(self, username: str, topic: str, session_id: Optional[str] = None,
+                 prompt_resume: bool = True):
+        """Start a session, or continue the stored one with ``session_id``.
+        
+        With ``prompt_resume`` a new session first asks on the console
+        whether to resume a paused session of the same topic.
+        """
         self.username = username
         self.topic = topic
         self.mode = InteractionMode.LEARNING
-        self.session_id = datetime.now().isoformat()
-        self.session_state = self._load_or_create_session()
+        self.session_id = session_id or datetime.now().isoformat()
+        self.session_log = session_log(username)
+        if session_id is not None:
+            self._resume_session(session_id)
+        else:
+            self._load_or_create_session(prompt_resume)
         self.planner = PlannerAgent(username)
+        self.plan: Optional[Dict] = None  # Set by callers that already built the plan
+        self.prefetcher = PrefetchScheduler()
+        self.contexts = SubtopicContextCache()  # One retrieval per subtopic, shared by every step
         self.commands_help = {
             Command.HELP: "Show available commands",
             Command.EXPLAIN_MORE: "Get more detailed explanation of current topic",
@@ -59,23 +117,39 @@ class InteractiveSession:
             Command.QUIT: "End session"
         }
     
-    def _load_or_create_session(self) -> Dict:
-        """Load existing session or create new one."""
-        sessions_file = Path(f'sessions_{self.username}.json')
+    @property
+    def session_state(self) -> Dict:
+        """This session's stored state (read-only; change it through ``_set``/``_append``/``_increment``).
         
-        if sessions_file.exists():
-            with sessions_file.open('r') as f:
-                sessions = json.load(f)
-                # Check for incomplete session
-                for session in sessions.get('active_sessions', []):
-                    if session['topic'] == self.topic and session['status'] == 'paused':
-                        print(f"Found paused session from {session['paused_at']}")
-                        resume = input("Would you like to resume? (y/n): ").lower().strip()
-                        if resume == 'y':
-                            return session
+        Looked up on every access: another process appending to or
+        snapshotting the user's session log replaces the state dict, so a
+        reference kept from earlier would stop seeing updates.
+        """
+        session = _find_session(self.session_log.state, self.session_id)
+        if session is None:
+            raise KeyError(f"No stored session {self.session_id} for {self.username}")
+        return session
+    
+    def _resume_session(self, session_id: str) -> None:
+        """Reactivate a stored session of this user."""
+        if self.session_state['status'] != 'active':
+            self._set(status='active', resumed_at=datetime.now().isoformat())
+    
+    def _load_or_create_session(self, prompt_resume: bool = True) -> None:
+        """Resume a paused session of the topic (if the user agrees) or start a new one."""
+        sessions = self.session_log.state
+        
+        # Check for incomplete session
+        for session in sessions.get('active_sessions', []) if prompt_resume else []:
+            if session['topic'] == self.topic and session['status'] == 'paused':
+                print(f"Found paused session from {session['paused_at']}")
+                resume = input("Would you like to resume? (y/n): ").lower().strip()
+                if resume == 'y':
+                    self.session_id = session['session_id']
+                    return
         
         # Create new session
-        return {
+        session = {
             'session_id': self.session_id,
             'topic': self.topic,
             'status': 'active',
@@ -89,32 +163,31 @@ class InteractiveSession:
             'user_questions': [],
             'difficulty_adjustments': []
         }
+        self.session_log.append({'type': 'session_started', 'session': session})
+    
+    # ---- Session state changes (each one is an appended event) ----
+    def _record(self, *events: Dict):
+        """Apply and log session changes in one write."""
+        self.session_log.append(*[dict(event, session_id=self.session_id) for event in events])
+    
+    def _set(self, **fields):
+        self._record({'type': 'set', 'fields': fields})
+    
+    def _append(self, key: str, item):
+        self._record({'type': 'append', 'key': key, 'item': item})
+    
+    def _increment(self, key: str, by: int = 1):
+        self._record({'type': 'increment', 'key': key, 'by': by})
     
     def save_session_state(self, status: str = 'paused'):
         """Save current session state."""
-        sessions_file = Path(f'sessions_{self.username}.json')
-        
-        sessions = {'active_sessions': []}
-        if sessions_file.exists():
-            with sessions_file.open('r') as f:
-                sessions = json.load(f)
-        
         # Update session status
-        self.session_state['status'] = status
+        fields = {'status': status}
         if status == 'paused':
-            self.session_state['paused_at'] = datetime.now().isoformat()
+            fields['paused_at'] = datetime.now().isoformat()
         elif status == 'completed':
-            self.session_state['completed_at'] = datetime.now().isoformat()
-        
-        # Remove old session if exists and add updated one
-        sessions['active_sessions'] = [
-            s for s in sessions.get('active_sessions', []) 
-            if s['session_id'] != self.session_id
-        ]
-        sessions['active_sessions'].append(self.session_state)
-        
-        with sessions_file.open('w') as f:
-            json.dump(sessions, f, indent=2)
+            fields['completed_at'] = datetime.now().isoformat()
+        self._set(**fields)
     
     def parse_command(self, user_input: str) -> Tuple[Optional[Command], str]:
         """Parse user input for commands."""
@@ -134,12 +207,12 @@ class InteractiveSession:
         
         elif command == Command.EXPLAIN_MORE:
             current_topic = self._get_current_topic()
-            explanation = explain_concept(current_topic)
+            explanation = self._explain(current_topic)
             print(f"\n📚 Detailed Explanation:\n{explanation}")
         
         elif command == Command.EXAMPLE:
             current_topic = self._get_current_topic()
-            example = generate_example(current_topic)
+            example = self._example(current_topic)
             print(f"\n💡 Example:\n{example}")
         
         elif command == Command.HINT:
@@ -149,9 +222,12 @@ class InteractiveSession:
         
         elif command == Command.SKIP:
             print("⏭️ Skipping current topic...")
+            current_topic = self._get_current_topic()
+            self.prefetcher.cancel_where(lambda key: key[1] == current_topic)
             return self._move_to_next_subtopic()
         
         elif command == Command.PAUSE:
+            self.prefetcher.shutdown()
             self.save_session_state('paused')
             print("⏸️ Session paused. Your progress has been saved.")
             return False
@@ -170,6 +246,7 @@ class InteractiveSession:
             self._show_progress()
         
         elif command == Command.QUIT:
+            self.prefetcher.shutdown()
             self.save_session_state('ended')
             print("👋 Ending session. Your progress has been saved.")
             return False
@@ -189,6 +266,24 @@ class InteractiveSession:
             return self.current_subtopic.get('name', self.topic)
         return self.topic
     
+    def _explain(self, subtopic: str) -> str:
+        return explain_concept(subtopic, retrieved=self.contexts.get(subtopic))
+    
+    def _example(self, subtopic: str) -> str:
+        return generate_example(subtopic, retrieved=self.contexts.get(subtopic))
+    
+    def _question(self, subtopic: str, previous_questions: List[str], difficulty: str) -> Dict:
+        # Always use objective questions during learning
+        return serve_question(
+            self.topic,
+            previous_questions,
+            difficulty=difficulty,
+            question_type='objective',
+            username=self.username,
+            subtopic=subtopic,
+            retrieved=self.contexts.get(subtopic)
+        )
+    
     def _handle_user_question(self, question: str):
         """Handle user's custom question."""
         print(f"\n🤔 Your question: {question}")
@@ -203,7 +298,7 @@ class InteractiveSession:
         print(f"📖 Answer: {response}")
         
         # Record the question
-        self.session_state['user_questions'].append({
+        self._append('user_questions', {
             'question': question,
             'asked_at': datetime.now().isoformat(),
             'context': self._get_current_topic()
@@ -213,7 +308,7 @@ class InteractiveSession:
         """Adjust session difficulty."""
         valid_levels = ['easy', 'medium', 'hard']
         if level.lower() in valid_levels:
-            self.session_state['difficulty_adjustments'].append({
+            self._append('difficulty_adjustments', {
                 'level': level,
                 'adjusted_at': datetime.now().isoformat()
             })
@@ -236,7 +331,7 @@ class InteractiveSession:
     
     def _move_to_next_subtopic(self) -> bool:
         """Move to next subtopic in the plan."""
-        self.session_state['current_subtopic_index'] += 1
+        self._increment('current_subtopic_index')
         return True
     
     def run_interactive_learning(self):
@@ -244,8 +339,9 @@ class InteractiveSession:
         print(f"\n🎓 Starting Interactive Learning Session: {self.topic}")
         print("Type !help at any time to see available commands.\n")
         
-        # Build learning plan
-        plan = self.planner.build_learning_plan(self.topic)
+        # Build learning plan (unless the caller already did)
+        plan = self.plan or self.planner.build_learning_plan(self.topic)
+        self.plan = plan
         subtopics = plan.get('subtopics', [])
         
         # Resume from saved position if applicable
@@ -253,12 +349,13 @@ class InteractiveSession:
         
         # Initialize session state if needed
         if 'difficulty' not in self.session_state:
-            self.session_state['difficulty'] = 'medium'
+            self._set(difficulty='medium')
         if 'question_types' not in self.session_state:
-            self.session_state['question_types'] = ['objective', 'subjective']
+            self._set(question_types=['objective', 'subjective'])
         
         for i in range(start_index, len(subtopics)):
-            self.session_state['current_subtopic_index'] = i
+            if self.session_state.get('current_subtopic_index') != i:
+                self._set(current_subtopic_index=i)
             self.current_subtopic = subtopics[i]
             subtopic_name = self.current_subtopic['name']
             
@@ -269,7 +366,20 @@ class InteractiveSession:
             # Explanation phase
             self.mode = InteractionMode.EXPLAINING
             print("\n📖 Let me explain this concept...")
-            explanation = explain_concept(subtopic_name)
+            explanation = self.prefetcher.consume(('explain', subtopic_name), self._explain, subtopic_name)
+            
+            # Prepare the rest of this subtopic and the next explanation while the student reads
+            previous_questions = [q['text'] for q in self.session_state['questions_asked']] if self.session_state['questions_asked'] else []
+            difficulty = self.session_state['difficulty']
+            self.prefetcher.schedule(('example', subtopic_name), self._example, subtopic_name)
+            self.prefetcher.schedule(
+                ('question', subtopic_name, difficulty),
+                self._question, subtopic_name, previous_questions, difficulty
+            )
+            if i + 1 < len(subtopics):
+                next_name = subtopics[i + 1]['name']
+                self.prefetcher.schedule(('explain', next_name), self._explain, next_name)
+            
             print(explanation)
             
             # Check for user input/commands
@@ -282,7 +392,7 @@ class InteractiveSession:
             
             # Example phase
             print("\n💡 Here's an example:")
-            example = generate_example(subtopic_name)
+            example = self.prefetcher.consume(('example', subtopic_name), self._example, subtopic_name)
             print(example)
             
             # Interactive Q&A phase
@@ -301,14 +411,14 @@ class InteractiveSession:
                         ready = True
             
             # Generate and ask objective question for learning
-            previous_questions = [q['text'] for q in self.session_state['questions_asked']] if self.session_state['questions_asked'] else []
-            question = generate_question(
-                subtopic_name,
-                previous_questions,
-                difficulty=self.session_state['difficulty'],
-                question_type='objective'  # Always use objective questions during learning
+            difficulty = self.session_state['difficulty']
+            question = self.prefetcher.consume(
+                ('question', subtopic_name, difficulty),
+                self._question, subtopic_name, previous_questions, difficulty
             )
-            self.session_state['questions_asked'].append(question)
+            # Drop speculative work for this subtopic that no longer matches (e.g. difficulty changed)
+            self.prefetcher.cancel_where(lambda key: key[0] != 'explain' and key[1] == subtopic_name)
+            self._append('questions_asked', question)
             
             print(f"\n❓ Question: {question['text']}")
             print("\nOptions:")
@@ -326,14 +436,9 @@ class InteractiveSession:
                         return
                 else:
                     # Process the answer
-                    correct, feedback = check_answer(question, answer)
+                    correct, feedback = check_answer(question, answer, retrieved=self.contexts.get(subtopic_name))
                     print(f"\n{feedback}")
                     
-                    # Update session state
-                    self.session_state['total_questions'] += 1
-                    if correct:
-                        self.session_state['total_score'] += 1
-                    
                     # Record detailed performance data
                     performance_entry = {
                         'subtopic': subtopic_name,
@@ -349,15 +454,17 @@ class InteractiveSession:
                         'explanation': question.get("explanation", "")
                     }
                     
-                    self.session_state['performance'].append(performance_entry)
+                    # Update session state (score and performance in one write)
+                    self._record(
+                        {'type': 'increment', 'key': 'total_questions', 'by': 1},
+                        {'type': 'increment', 'key': 'total_score', 'by': 1 if correct else 0},
+                        {'type': 'append', 'key': 'performance', 'item': performance_entry}
+                    )
                     answered = True
             
-            # Add to completed subtopics
+            # Add to completed subtopics (this also saves progress)
             if subtopic_name not in self.session_state['subtopics_completed']:
-                self.session_state['subtopics_completed'].append(subtopic_name)
-            
-            # Save progress
-            save_user(self.username, self.user_profile)
+                self._append('subtopics_completed', subtopic_name)
             
             # Show progress
             self._show_progress()
@@ -382,18 +489,21 @@ class InteractiveSession:
                 # Optional subjective question at the end
                 print("\nWould you like to answer a reflective question about what you've learned? (This won't affect your grade)")
                 if input("Type 'y' for yes, any other key to skip: ").lower().strip() == 'y':
-                    reflection_q = generate_question(
+                    reflection_q = serve_question(
                         self.topic,
                         previous_questions,
                         difficulty='medium',
-                        question_type='subjective'
+                        question_type='subjective',
+                        username=self.username,
+                        retrieved=self.contexts.get(self.topic)
                     )
                     print(f"\n💭 Reflection Question: {reflection_q['text']}")
                     reflection_ans = input("Your thoughts: ")
-                    _, feedback = check_answer(reflection_q, reflection_ans)
+                    _, feedback = check_answer(reflection_q, reflection_ans, retrieved=self.contexts.get(self.topic))
                     print(f"\nThank you for sharing! {feedback}")
         
         # Session completed
+        self.prefetcher.shutdown()
         self._complete_session()
     
     def _complete_session(self):
@@ -410,7 +520,7 @@ class InteractiveSession:
             print(f"  Mastery Level: {mastery_level}")
             
             # Update session state with final score
-            self.session_state['final_score'] = final_score
+            self._set(final_score=final_score)
             
             # Use enhanced memory system
             enhanced_memory = EnhancedMemorySystem(self.username)
@@ -1,11 +1,17 @@
 """Multi-LLM Provider Support System."""
 import os
 import json
+import time
 from typing import Dict, List, Optional, Any
 from abc import ABC, abstractmethod
 from pathlib import Path
 import requests
 
+from shared_state import shared_state
+
+ACTIVE_PROVIDER_KEY = 'llm.active_provider'  # Shared-state key of the provider chosen through the API
+PROVIDER_SYNC_SECONDS = 5  # How often generate() checks for a provider chosen in another process
+
 
 class LLMProvider(ABC):
     """Abstract base class for LLM providers."""
@@ -283,6 +289,7 @@ class LLMManager:
         self.config_file = Path(config_file)
         self.providers: Dict[str, LLMProvider] = {}
         self.active_provider: Optional[str] = None
+        self._synced_at = float('-inf')
         self._load_config()
         self._initialize_providers()
     
@@ -361,8 +368,24 @@ class LLMManager:
         if self.active_provider:
             print(f"\n🎯 Active provider: {self.active_provider}")
     
+    def _sync_active_provider(self):
+        """Adopt a provider chosen in another process (e.g. another API worker).
+        
+        The shared choice is read at most every ``PROVIDER_SYNC_SECONDS``, so
+        other processes switch within that time.
+        """
+        now = time.monotonic()
+        if now - self._synced_at < PROVIDER_SYNC_SECONDS:
+            return
+        self._synced_at = now
+        shared = shared_state.get(ACTIVE_PROVIDER_KEY)
+        if shared and shared != self.active_provider and shared in self.providers:
+            self.active_provider = shared
+    
     def generate(self, prompt: str, provider: Optional[str] = None, **kwargs) -> str:
         """Generate response using specified or active provider."""
+        if provider is None:
+            self._sync_active_provider()
         provider_name = provider or self.active_provider
         
         if not provider_name:
@@ -381,11 +404,14 @@ class LLMManager:
         self.active_provider = provider
         self.config["default_provider"] = provider
         self._save_config()
+        shared_state.set(ACTIVE_PROVIDER_KEY, provider)
+        self._synced_at = time.monotonic()
         print(f"Active provider set to: {provider}")
     
     def list_providers(self) -> Dict[str, Dict[str, Any]]:
         """List all available providers and their status."""
         all_providers = {}
+        self._sync_active_provider()
         
         for name, provider in self.providers.items():
             all_providers[name] = provider.get_info()
@@ -2,13 +2,14 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from memory import load_user, save_user, get_weak_areas, get_recommended_review_topics, get_performance_summary, record_learning_session
+from memory import load_user, save_user, get_weak_areas, get_recommended_review_topics, get_performance_summary, record_learning_session, mark_active, remove_weak_areas
 from planner import PlannerAgent
 from utils import choose_option
-from domain_expert import generate_question, check_answer, show_available_sources, get_llm_info, set_llm_provider
+from domain_expert import check_answer, show_available_sources, get_llm_info, set_llm_provider
 from interactive_session import InteractiveSession
 from enhanced_memory import EnhancedMemorySystem
 from llm_providers import llm_manager
+from question_bank import serve_question
 from typing import List, Dict
 
 
@@ -105,70 +106,72 @@ def review_mode(agent: PlannerAgent):
 
 def _spaced_repetition_review(agent: PlannerAgent, due_items: List[Dict]):
     """Review items due for spaced repetition"""
-    from flashcards import FlashcardDeck
+    from flashcard_generator import generate_flashcards_async
+    from flashcards import FlashcardDeck, ReviewSession
     
     print(f"\n=== Spaced Repetition Review ===")
     print(f"Reviewing {len(due_items)} due items...")
     
     total_reviewed = 0
     total_correct = 0
-    
-    for item in due_items:
-        topic = item['topic']
-        print(f"\n--- {topic} - {item['subtopic']} ---")
-        print(f"Last reviewed: {item.get('days_until_review', 0)} days ago")
+    with ReviewSession(agent.username) as review_session:
+        for item in due_items:
+            topic = item['topic']
+            print(f"\n--- {topic} - {item['subtopic']} ---")
+            print(f"Last reviewed: {item.get('days_until_review', 0)} days ago")
         
-        # Check if we have flashcards for this topic
-        deck = FlashcardDeck(agent.username, topic)
-        due_cards = deck.get_due_cards(limit=2)  # Limit to 2 cards per topic
-        
-        if due_cards:
-            # Use flashcard system
-            for card in due_cards:
-                print(f"\nFlashcard: {card['front']}")
-                input("Press Enter to see answer...")
-                print(f"Answer: {card['back']}")
+            # Check if we have flashcards for this topic
+            deck = FlashcardDeck(agent.username, topic)
+            due_cards = review_session.due_cards(topic, limit=2)  # Limit to 2 cards per topic
+        
+            if due_cards:
+                # Use flashcard system
+                for card in due_cards:
+                    print(f"\nFlashcard: {card['front']}")
+                    input("Press Enter to see answer...")
+                    print(f"Answer: {card['back']}")
                 
-                while True:
-                    try:
-                        quality = int(input(
-                            "\nRate your recall (0-5):\n"
-                            "0 - Couldn't remember at all\n"
-                            "1 - Wrong, but had some memory\n" 
-                            "2 - Wrong, but felt familiar\n"
-                            "3 - Correct after some effort\n"
-                            "4 - Correct with slight hesitation\n"
-                            "5 - Perfect recall\n"
-                            "Choice: "
-                        ))
-                        if 0 <= quality <= 5:
-                            break
-                        print("Please enter a number between 0 and 5")
-                    except ValueError:
-                        print("Please enter a valid number")
+                    while True:
+                        try:
+                            quality = int(input(
+                                "\nRate your recall (0-5):\n"
+                                "0 - Couldn't remember at all\n"
+                                "1 - Wrong, but had some memory\n" 
+                                "2 - Wrong, but felt familiar\n"
+                                "3 - Correct after some effort\n"
+                                "4 - Correct with slight hesitation\n"
+                                "5 - Perfect recall\n"
+                                "Choice: "
+                            ))
+                            if 0 <= quality <= 5:
+                                break
+                            print("Please enter a number between 0 and 5")
+                        except ValueError:
+                            print("Please enter a valid number")
                 
-                # Update card with spaced repetition algorithm
-                deck.update_card_schedule(card, quality)
-                deck.update_stats(quality >= 3)
+                    # Update card with spaced repetition algorithm (saved in batches)
+                    review_session.review(topic, card, quality)
                 
-                if quality >= 3:
-                    total_correct += 1
-                total_reviewed += 1
-        else:
-            # Generate a question for this topic
-            question = generate_question(topic, [], difficulty="medium")
-            answer = input(f"\nQuestion: {question}\nYour answer: ")
+                    if quality >= 3:
+                        total_correct += 1
+                    total_reviewed += 1
+            else:
+                # Generate a question for this topic
+                question = serve_question(topic, [], difficulty="medium", username=agent.username)
+                answer = input(f"\nQuestion: {question}\nYour answer: ")
             
-            correct, feedback = check_answer(question, answer)
-            print(feedback)
+                correct, feedback = check_answer(question, answer)
+                print(feedback)
             
-            if correct:
-                total_correct += 1
-            total_reviewed += 1
+                if correct:
+                    total_correct += 1
+                total_reviewed += 1
             
-            # Create a flashcard from this Q&A for future spaced repetition
-            if not deck.get_stats()['total_cards']:
-                deck.add_card(question, feedback.split('\n')[0], item['subtopic'])
+                # Create a flashcard from this Q&A for future spaced repetition,
+                # and fill the empty deck from the course material in the background
+                if not deck.get_stats()['total_cards']:
+                    deck.add_card(question, feedback.split('\n')[0], item['subtopic'])
+                    generate_flashcards_async(agent.username, topic)
     
     # Show results
     accuracy = total_correct / total_reviewed if total_reviewed > 0 else 0
@@ -213,11 +216,12 @@ def _adaptive_review_session(agent: PlannerAgent, focus_areas: List[Dict]):
         print(f"Difficulty: {difficulty_level.upper()}")
         
         # Generate adaptive question
-        question = generate_question(
+        question = serve_question(
             topic, 
             asked_questions, 
             difficulty=difficulty_level,
-            question_type="objective"
+            question_type="objective",
+            username=agent.username
         )
         asked_questions.append(question)
         
@@ -307,13 +311,7 @@ def _adaptive_review_session(agent: PlannerAgent, focus_areas: List[Dict]):
         mastery_level = 'mastered'
         print(f"🎉 Excellent! You've shown strong understanding.")
         # Update mastery for topics that were answered correctly at medium/hard difficulty
-        profile = agent.profile
-        for topic in improved_topics:
-            if topic in profile.get('weak_areas', []):
-                weak_areas = set(profile.get('weak_areas', []))
-                weak_areas.discard(topic)
-                profile['weak_areas'] = list(weak_areas)
-        agent.save_profile(profile)
+        remove_weak_areas(agent.username, improved_topics)
     elif final_score >= 0.6:
         mastery_level = 'intermediate'
         print(f"👍 Good progress! Keep practicing these topics.")
@@ -362,7 +360,7 @@ def _review_topic_intensively(agent: PlannerAgent, topic: str, adaptive: bool =
         print(f"\n--- Question {questions_asked + 1}/{max_questions} ---")
         
         # Generate question with current difficulty
-        question = generate_question(topic, asked_questions, difficulty=difficulty)
+        question = serve_question(topic, asked_questions, difficulty=difficulty, username=agent.username)
         asked_questions.append(question)
         
         # Handle different question formats
@@ -450,11 +448,7 @@ def _review_topic_intensively(agent: PlannerAgent, topic: str, adaptive: bool =
         mastery_level = 'mastered'
         print(f"🎉 Excellent! You've mastered {topic}")
         # Remove from weak areas only if consistently good at medium+ difficulty
-        profile = agent.profile
-        weak_areas = set(profile.get('weak_areas', []))
-        weak_areas.discard(topic)
-        profile['weak_areas'] = list(weak_areas)
-        agent.save_profile(profile)
+        remove_weak_areas(agent.username, [topic])
         
         # Create flashcards for future spaced repetition
         from flashcards import FlashcardDeck
@@ -496,7 +490,7 @@ def _quick_review_all(agent: PlannerAgent, weak_topics: list):
     for topic in weak_topics[:5]:  # Limit to top 5 weak areas
         print(f"\n--- {topic} ---")
         # Generate question for this topic, avoiding previously asked questions
-        question = generate_question(topic, asked_questions)
+        question = serve_question(topic, asked_questions, username=agent.username)
         asked_questions.append(question)  # Add to the list to avoid repetition
         answer = input(question + "\nYour answer: ")
         
@@ -522,7 +516,7 @@ def _quick_review_all(agent: PlannerAgent, weak_topics: list):
 
 def _flashcard_review(agent: PlannerAgent, topics: List[str]):
     """Review topics using flashcards with spaced repetition."""
-    from flashcards import FlashcardDeck, create_flashcards_from_qa
+    from flashcards import FlashcardDeck, ReviewSession, create_flashcards_from_qa
     
     print("\n=== Flashcard Review ===")
     
@@ -547,71 +541,72 @@ def _flashcard_review(agent: PlannerAgent, topics: List[str]):
             return
             
         total_reviewed = 0
-        for topic in selected_topics:
-            deck = FlashcardDeck(agent.username, topic)
+        with ReviewSession(agent.username) as review_session:
+            for topic in selected_topics:
+                deck = FlashcardDeck(agent.username, topic)
             
-            # Check if we need to generate cards
-            if deck.get_stats()['total_cards'] == 0:
-                print(f"\nGenerating flashcards for {topic}...")
-                # Generate QA pairs for the topic
-                qa_pairs = []
-                for _ in range(5):  # Generate 5 cards per topic
-                    question = generate_question(topic, [])
-                    correct_answer, _ = check_answer(question, "GENERATE_ANSWER")
-                    qa_pairs.append({
-                        'question': question,
-                        'answer': correct_answer,
-                        'subtopic': topic
-                    })
-                deck = create_flashcards_from_qa(agent.username, topic, qa_pairs)
+                # Check if we need to generate cards
+                if deck.get_stats()['total_cards'] == 0:
+                    print(f"\nGenerating flashcards for {topic}...")
+                    # Generate QA pairs for the topic
+                    qa_pairs = []
+                    for _ in range(5):  # Generate 5 cards per topic
+                        question = serve_question(topic, [], username=agent.username)
+                        correct_answer, _ = check_answer(question, "GENERATE_ANSWER")
+                        qa_pairs.append({
+                            'question': question,
+                            'answer': correct_answer,
+                            'subtopic': topic
+                        })
+                    deck = create_flashcards_from_qa(agent.username, topic, qa_pairs)
             
-            # Get due cards
-            due_cards = deck.get_due_cards()
-            if not due_cards:
-                print(f"\nNo cards due for review in {topic}")
-                continue
+                # Get due cards
+                due_cards = review_session.due_cards(topic)
+                if not due_cards:
+                    print(f"\nNo cards due for review in {topic}")
+                    continue
             
-            print(f"\nReviewing {topic}...")
-            for card in due_cards:
-                print(f"\nCard front: {card['front']}")
-                input("Press Enter to see answer...")
-                print(f"Answer: {card['back']}")
+                print(f"\nReviewing {topic}...")
+                for card in due_cards:
+                    print(f"\nCard front: {card['front']}")
+                    input("Press Enter to see answer...")
+                    print(f"Answer: {card['back']}")
                 
-                while True:
-                    try:
-                        quality = int(input(
-                            "\nRate your answer (0-5):\n"
-                            "0 - Complete blackout\n"
-                            "1 - Incorrect, but remembered\n"
-                            "2 - Incorrect, but seemed easy\n"
-                            "3 - Correct, but difficult\n"
-                            "4 - Correct\n"
-                            "5 - Correct and easy\n"
-                            "Choice: "
-                        ))
-                        if 0 <= quality <= 5:
-                            break
-                        print("Please enter a number between 0 and 5")
-                    except ValueError:
-                        print("Please enter a valid number")
+                    while True:
+                        try:
+                            quality = int(input(
+                                "\nRate your answer (0-5):\n"
+                                "0 - Complete blackout\n"
+                                "1 - Incorrect, but remembered\n"
+                                "2 - Incorrect, but seemed easy\n"
+                                "3 - Correct, but difficult\n"
+                                "4 - Correct\n"
+                                "5 - Correct and easy\n"
+                                "Choice: "
+                            ))
+                            if 0 <= quality <= 5:
+                                break
+                            print("Please enter a number between 0 and 5")
+                        except ValueError:
+                            print("Please enter a valid number")
                 
-                # Update card scheduling
-                deck.update_card_schedule(card, quality)
-                deck.update_stats(quality >= 3)
-                total_reviewed += 1
+                    # Update card scheduling (saved in batches)
+                    review_session.review(topic, card, quality)
+                    total_reviewed += 1
                 
-                if total_reviewed % 5 == 0:
-                    continue_review = input("\nContinue reviewing? (y/n): ").lower().strip()
-                    if continue_review != 'y':
-                        break
+                    if total_reviewed % 5 == 0:
+                        continue_review = input("\nContinue reviewing? (y/n): ").lower().strip()
+                        if continue_review != 'y':
+                            break
             
-            # Show progress
-            stats = deck.get_stats()
-            print(f"\nProgress for {topic}:")
-            print(f"Cards studied: {stats['cards_studied']}")
-            print(f"Correct answers: {stats['correct_answers']}")
-            accuracy = stats['correct_answers'] / stats['cards_studied'] if stats['cards_studied'] > 0 else 0
-            print(f"Accuracy: {accuracy:.1%}")
+                # Show progress
+                review_session.commit()
+                stats = deck.get_stats()
+                print(f"\nProgress for {topic}:")
+                print(f"Cards studied: {stats['cards_studied']}")
+                print(f"Correct answers: {stats['correct_answers']}")
+                accuracy = stats['correct_answers'] / stats['cards_studied'] if stats['cards_studied'] > 0 else 0
+                print(f"Accuracy: {accuracy:.1%}")
             
     except ValueError:
         print("Invalid input.")
@@ -646,7 +641,7 @@ def test_mode(agent: PlannerAgent):
     
     for i in range(num_q):
         # Generate a unique question by passing previously asked questions
-        q = generate_question(topic, asked_questions)
+        q = serve_question(topic, asked_questions, username=agent.username)
         asked_questions.append(q)  # Add to the list to avoid repetition
         
         ans = input(f"\nQuestion {i+1}: {q}\nYour answer: ")
@@ -904,9 +899,13 @@ def main():
     elif choice == "llm":
         llm_mode()
     
-    save_user(username, load_user(username))
+    mark_active(username)
 
 
 if __name__ == "__main__":
+    from profile_store import profile_store
+    from flashcards import migrate_decks
+    profile_store.migrate_json_profiles()
+    migrate_decks()
     main()
 
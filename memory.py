@@ -1,102 +1,119 @@
+import copy
 import json
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict
+from typing import Iterable, List, Dict, Optional
 from sentence_transformers import SentenceTransformer, util
-import fcntl
-import os
 
-# Create user data directory if it doesn't exist
-USER_DATA_DIR = Path('user_data')
-USER_DATA_DIR.mkdir(exist_ok=True)
+from profile_store import USER_DATA_DIR, StaleProfileError, empty_profile, profile_store
+
+MAX_CACHED_PROFILES = 256  # Parsed profiles kept in memory (least recently used evicted)
 
 def get_user_file(username: str) -> Path:
-    """Get path to user's data file."""
+    """Get path to user's legacy JSON data file (imported into the profile store)."""
     return USER_DATA_DIR / f"{username}.json"
 
+# Parsed profiles by username, tagged with the store version they were read at
+_profile_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_profile_cache_lock = threading.Lock()
+
+def invalidate_user_cache(username: Optional[str] = None) -> None:
+    """Drop one user's cached profile, or every cached profile."""
+    with _profile_cache_lock:
+        if username is None:
+            _profile_cache.clear()
+        else:
+            _profile_cache.pop(username, None)
+
 def load_user(username: str) -> dict:
-    """Load user data with file locking for concurrency safety."""
-    user_file = get_user_file(username)
-    
-    # Create empty profile if file doesn't exist
-    if not user_file.exists():
-        return {
-            'weak_areas': [],
-            'topic_mastery': {},
-            'history': [],
-            'learning_plan': {},
-            'performance_data': {},
-            'last_active': datetime.now().isoformat()
-        }
+    """Load a user's profile from the SQLite profile store.
     
+    Profiles are cached and revalidated against the store's per-user version
+    counter, so repeated loads only cost one indexed lookup. Callers get a
+    private copy they are free to modify.
+    """
     try:
-        with open(user_file, 'r') as f:
-            # Get exclusive lock
-            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-            try:
-                content = f.read().strip()
-                if content:
-                    return json.loads(content)
-                else:
-                    return {
-                        'weak_areas': [],
-                        'topic_mastery': {},
-                        'history': [],
-                        'learning_plan': {},
-                        'performance_data': {},
-                        'last_active': datetime.now().isoformat()
-                    }
-            finally:
-                # Release lock
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        version = profile_store.version(username)
+        with _profile_cache_lock:
+            cached = _profile_cache.get(username)
+            if cached:
+                _profile_cache.move_to_end(username)
+        if cached and cached[0] == version:
+            return copy.deepcopy(cached[1])
+        
+        profile = profile_store.load_profile(username)
+        if profile is None and profile_store.import_json_profile(username):
+            profile = profile_store.load_profile(username)
+        if profile is None:
+            return empty_profile()
+        
+        with _profile_cache_lock:
+            _profile_cache[username] = (profile['version'], profile)
+            _profile_cache.move_to_end(username)
+            while len(_profile_cache) > MAX_CACHED_PROFILES:
+                _profile_cache.popitem(last=False)
+        return copy.deepcopy(profile)
     except Exception as e:
         print(f"Error loading user data: {e}")
-        return {
-            'weak_areas': [],
-            'topic_mastery': {},
-            'history': [],
-            'learning_plan': {},
-            'performance_data': {},
-            'last_active': datetime.now().isoformat()
-        }
+        return empty_profile()
 
 def save_user(username: str, profile: dict) -> None:
-    """Save user data with atomic write and file locking."""
-    user_file = get_user_file(username)
-    temp_file = user_file.with_suffix('.tmp')
+    """Save a whole profile in one transaction (only changed rows are written).
     
+    ``profile`` must come from ``load_user``: if the user was written since,
+    ``StaleProfileError`` is raised rather than overwriting that write.
+    Changes to single fields should use the field-level helpers below
+    (``update_progress``, ``remove_weak_areas``, ``mark_active``), which
+    cannot lose concurrent updates.
+    """
     # Update last active timestamp
     profile['last_active'] = datetime.now().isoformat()
+    # A whole-profile write may change any topic, so refresh the aggregates from it
+    profile['aggregates'] = rebuild_aggregates(profile.get('topic_mastery', {}), profile.get('performance_data', {}))
     
     try:
-        # Write to temporary file first
-        with open(temp_file, 'w') as f:
-            # Get exclusive lock
-            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-            try:
-                json.dump(profile, f, indent=2)
-                f.flush()
-                os.fsync(f.fileno())  # Ensure data is written to disk
-            finally:
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-        
-        # Atomic rename
-        temp_file.replace(user_file)
+        profile_store.save_profile(username, profile)
+    except StaleProfileError:
+        raise
     except Exception as e:
         print(f"Error saving user data: {e}")
         # Try to save backup
-        backup_file = user_file.with_suffix('.backup')
+        backup_file = get_user_file(username).with_suffix('.backup')
         try:
             with open(backup_file, 'w') as f:
                 json.dump(profile, f, indent=2)
             print(f"User data saved to backup file: {backup_file}")
         except Exception as backup_error:
             print(f"Failed to save backup: {backup_error}")
+    finally:
+        invalidate_user_cache(username)
+
+def mark_active(username: str) -> None:
+    """Record that the user was active now."""
+    with profile_store.transaction() as conn:
+        profile_store.ensure_user(conn, username)
+        profile_store.touch(conn, username)
+    invalidate_user_cache(username)
+
+def remove_weak_areas(username: str, topics: Iterable[str]) -> None:
+    """Take topics off the user's weak areas, leaving the rest of the profile alone."""
+    topics = set(topics)
+    with profile_store.transaction() as conn:
+        profile_store.ensure_user(conn, username)
+        weak_areas = profile_store.get_weak_areas(conn, username)
+        if topics.intersection(weak_areas):
+            profile_store.set_weak_areas(conn, username, [area for area in weak_areas if area not in topics])
+        profile_store.touch(conn, username)
+    invalidate_user_cache(username)
 
 def record_learning_session(username: str, topic: str, subtopics_performance: List[Dict], final_score: float, mastery_level: str) -> None:
-    """Record a complete learning session with detailed performance data"""
-    profile = load_user(username)
+    """Record a complete learning session with detailed performance data.
     
+    Runs as a single profile-store transaction: the session row is inserted
+    and only this topic's performance, mastery and weak areas are updated.
+    """
     # Record session in history with enhanced data
     session_data = {
         'date': datetime.now().isoformat(),
@@ -150,32 +167,61 @@ def record_learning_session(username: str, topic: str, subtopics_performance: Li
             session_data['session_stats']['subjective_questions']
         )
     
-    profile['history'].append(session_data)
-    
-    # Update topic mastery
-    profile['topic_mastery'][topic] = mastery_level
-    
-    # Update detailed performance data
-    if topic not in profile['performance_data']:
-        profile['performance_data'][topic] = {
-            'attempts': 0,
-            'average_score': 0,
-            'subtopic_scores': {},
-            'question_type_performance': {
-                'objective': {'total': 0, 'correct': 0, 'trend': []},
-                'subjective': {'total': 0, 'correct': 0, 'trend': []}
-            },
-            'difficulty_performance': {
-                'easy': {'total': 0, 'correct': 0},
-                'medium': {'total': 0, 'correct': 0},
-                'hard': {'total': 0, 'correct': 0}
-            },
-            'common_mistakes': [],
-            'last_attempt': None,
-            'improvement_rate': 0
-        }
+    with profile_store.transaction() as conn:
+        profile_store.ensure_user(conn, username)
+        profile_store.insert_session(conn, username, session_data)
+        
+        aggregates = _stored_aggregates(conn, username)
+        
+        # Update topic mastery
+        previous_mastery = profile_store.set_mastery(conn, username, topic, mastery_level)
+        _apply_mastery_change(aggregates, previous_mastery, mastery_level)
+        
+        # Update detailed performance data
+        previous_perf = profile_store.get_topic_performance(conn, username, topic)
+        perf_data = copy.deepcopy(previous_perf) if previous_perf else _new_topic_performance()
+        _update_topic_performance(perf_data, session_data, final_score, subtopics_performance)
+        profile_store.put_topic_performance(conn, username, topic, perf_data)
+        _apply_performance_change(aggregates, topic, previous_perf, perf_data)
+        profile_store.put_aggregates(conn, username, aggregates)
+        
+        # Analyze and update weak areas
+        weak_profile = {'weak_areas': profile_store.get_weak_areas(conn, username)}
+        _update_weak_areas(weak_profile, topic, final_score, subtopics_performance)
+        profile_store.set_weak_areas(conn, username, weak_profile['weak_areas'])
+        
+        profile_store.touch(conn, username)
     
-    perf_data = profile['performance_data'][topic]
+    # Keep the hot history bounded; older sessions become weekly rollups
+    profile_store.compact_history(username)
+    invalidate_user_cache(username)
+
+def load_archived_history(username: str) -> List[Dict]:
+    """Raw records of sessions that were compacted out of the profile."""
+    return profile_store.load_archived_history(username)
+
+def _new_topic_performance() -> Dict:
+    """Empty per-topic performance record."""
+    return {
+        'attempts': 0,
+        'average_score': 0,
+        'subtopic_scores': {},
+        'question_type_performance': {
+            'objective': {'total': 0, 'correct': 0, 'trend': []},
+            'subjective': {'total': 0, 'correct': 0, 'trend': []}
+        },
+        'difficulty_performance': {
+            'easy': {'total': 0, 'correct': 0},
+            'medium': {'total': 0, 'correct': 0},
+            'hard': {'total': 0, 'correct': 0}
+        },
+        'common_mistakes': [],
+        'last_attempt': None,
+        'improvement_rate': 0
+    }
+
+def _update_topic_performance(perf_data: Dict, session_data: Dict, final_score: float, subtopics_performance: List[Dict]) -> None:
+    """Fold one session into a topic's performance record."""
     perf_data['attempts'] += 1
     perf_data['last_attempt'] = datetime.now().isoformat()
     
@@ -212,11 +258,6 @@ def record_learning_session(username: str, topic: str, subtopics_performance: Li
         if subtopic not in perf_data['subtopic_scores']:
             perf_data['subtopic_scores'][subtopic] = []
         perf_data['subtopic_scores'][subtopic].append(1 if subtopic_perf['correct'] else 0)
-    
-    # Analyze and update weak areas
-    _update_weak_areas(profile, topic, final_score, subtopics_performance)
-    
-    save_user(username, profile)
 
 def _update_weak_areas(profile: dict, topic: str, final_score: float, subtopics_performance: List[Dict]) -> None:
     """Update weak areas based on performance."""
@@ -238,95 +279,152 @@ def _update_weak_areas(profile: dict, topic: str, final_score: float, subtopics_
     
     profile['weak_areas'] = list(weak_areas)
 
-def get_weak_areas(username: str) -> List[str]:
+def get_weak_areas(username: str, profile: Optional[dict] = None) -> List[str]:
     """Get list of topics/subtopics the user struggles with"""
-    profile = load_user(username)
+    profile = profile if profile is not None else load_user(username)
     return profile.get('weak_areas', [])
 
-def get_performance_summary(username: str) -> Dict:
-    """Get a summary of user's learning performance"""
-    profile = load_user(username)
-    perf_data = profile.get('performance_data', {})
-    
-    summary = {
-        'total_topics_studied': len(perf_data),
-        'weak_areas_count': len(profile.get('weak_areas', [])),
+# ---- Running aggregates ----
+# get_performance_summary reads these counters instead of re-walking every
+# topic. They are updated incrementally by record_learning_session and
+# update_progress, and rebuilt from topic_mastery/performance_data on
+# whole-profile saves or by verify_aggregates.
+AGGREGATES_SCHEMA = 1
+
+def _empty_aggregates() -> Dict:
+    return {
+        'schema': AGGREGATES_SCHEMA,
+        'topics_studied': 0,
         'average_scores': {},
-        'topics_mastered': 0,
-        'topics_intermediate': 0,
-        'topics_beginner': 0,
-        'recent_improvement': 0,
-        'question_type_stats': {
-            'objective': {
-                'total_answered': 0,
-                'total_correct': 0,
-                'average_score': 0
-            },
-            'subjective': {
-                'total_answered': 0,
-                'total_correct': 0,
-                'average_score': 0
-            }
-        },
-        'difficulty_stats': {
-            'easy': {'total': 0, 'correct': 0, 'success_rate': 0},
-            'medium': {'total': 0, 'correct': 0, 'success_rate': 0},
-            'hard': {'total': 0, 'correct': 0, 'success_rate': 0}
-        }
+        'mastery_counts': {'mastered': 0, 'intermediate': 0, 'beginner': 0},
+        'improvement_total': 0.0,
+        'improvement_topics': 0,
+        'question_types': {q_type: {'total': 0, 'correct': 0} for q_type in ['objective', 'subjective']},
+        'difficulties': {difficulty: {'total': 0, 'correct': 0} for difficulty in ['easy', 'medium', 'hard']}
     }
-    
-    # Calculate recent improvement rate and collect stats
-    total_improvement = 0
-    topics_with_improvement = 0
-    
-    for topic, data in perf_data.items():
-        summary['average_scores'][topic] = data['average_score']
+
+def _mastery_bucket(mastery: str) -> str:
+    return mastery if mastery in ('mastered', 'intermediate') else 'beginner'
+
+def _apply_mastery_change(aggregates: Dict, previous: Optional[str], mastery: str) -> None:
+    """Move one topic between mastery buckets."""
+    if previous is not None:
+        aggregates['mastery_counts'][_mastery_bucket(previous)] -= 1
+    aggregates['mastery_counts'][_mastery_bucket(mastery)] += 1
+
+def _apply_performance_change(aggregates: Dict, topic: str, previous: Optional[Dict], current: Dict) -> None:
+    """Replace one topic's contribution (``previous``, or nothing) with ``current``."""
+    for sign, data in ((-1, previous), (1, current)):
+        if data is None:
+            continue
+        aggregates['topics_studied'] += sign
         if data.get('improvement_rate'):
-            total_improvement += data['improvement_rate']
-            topics_with_improvement += 1
-        
-        # Aggregate question type stats
+            aggregates['improvement_total'] += sign * data['improvement_rate']
+            aggregates['improvement_topics'] += sign
         for q_type in ['objective', 'subjective']:
             type_data = data.get('question_type_performance', {}).get(q_type, {})
-            summary['question_type_stats'][q_type]['total_answered'] += type_data.get('total', 0)
-            summary['question_type_stats'][q_type]['total_correct'] += type_data.get('correct', 0)
-        
-        # Aggregate difficulty stats
+            aggregates['question_types'][q_type]['total'] += sign * type_data.get('total', 0)
+            aggregates['question_types'][q_type]['correct'] += sign * type_data.get('correct', 0)
         for difficulty in ['easy', 'medium', 'hard']:
             diff_data = data.get('difficulty_performance', {}).get(difficulty, {})
-            summary['difficulty_stats'][difficulty]['total'] += diff_data.get('total', 0)
-            summary['difficulty_stats'][difficulty]['correct'] += diff_data.get('correct', 0)
+            aggregates['difficulties'][difficulty]['total'] += sign * diff_data.get('total', 0)
+            aggregates['difficulties'][difficulty]['correct'] += sign * diff_data.get('correct', 0)
+    aggregates['average_scores'][topic] = current['average_score']
+
+def rebuild_aggregates(topic_mastery: Dict, performance_data: Dict) -> Dict:
+    """Recompute the running aggregates from scratch."""
+    aggregates = _empty_aggregates()
+    for mastery in topic_mastery.values():
+        _apply_mastery_change(aggregates, None, mastery)
+    for topic, data in performance_data.items():
+        _apply_performance_change(aggregates, topic, None, data)
+    return aggregates
+
+def _stored_aggregates(conn, username: str) -> Dict:
+    """Aggregates for a user inside a transaction, built on first use for older profiles."""
+    aggregates = profile_store.get_aggregates(conn, username)
+    if aggregates.get('schema') != AGGREGATES_SCHEMA:
+        aggregates = rebuild_aggregates(
+            profile_store.get_mastery(conn, username),
+            profile_store.load_performance(conn, username)
+        )
+    return aggregates
+
+def _comparable(aggregates: Dict) -> str:
+    # Running float sums may drift in the last digits; compare them rounded
+    rounded = dict(aggregates, improvement_total=round(aggregates.get('improvement_total', 0), 9))
+    return json.dumps(rounded, sort_keys=True)
+
+def verify_aggregates(username: str, repair: bool = True) -> bool:
+    """Check a user's stored aggregates against a full rebuild.
+    
+    Returns True if they matched; with ``repair`` a mismatch is overwritten
+    with the rebuilt values.
+    """
+    with profile_store.transaction() as conn:
+        stored = profile_store.get_aggregates(conn, username)
+        rebuilt = rebuild_aggregates(
+            profile_store.get_mastery(conn, username),
+            profile_store.load_performance(conn, username)
+        )
+        matches = _comparable(stored) == _comparable(rebuilt)
+        if not matches and repair:
+            profile_store.put_aggregates(conn, username, rebuilt)
+            profile_store.touch(conn, username)
+    if not matches and repair:
+        invalidate_user_cache(username)
+    return matches
+
+def verify_all_aggregates(repair: bool = True) -> Dict[str, bool]:
+    """Run verify_aggregates for every stored user."""
+    return {username: verify_aggregates(username, repair) for username in profile_store.usernames()}
+
+def get_performance_summary(username: str, profile: Optional[dict] = None) -> Dict:
+    """Get a summary of user's learning performance"""
+    profile = profile if profile is not None else load_user(username)
+    aggregates = profile.get('aggregates') or {}
+    if aggregates.get('schema') != AGGREGATES_SCHEMA:
+        aggregates = rebuild_aggregates(profile.get('topic_mastery', {}), profile.get('performance_data', {}))
+    
+    summary = {
+        'total_topics_studied': aggregates['topics_studied'],
+        'weak_areas_count': len(profile.get('weak_areas', [])),
+        'average_scores': dict(aggregates['average_scores']),
+        'topics_mastered': aggregates['mastery_counts']['mastered'],
+        'topics_intermediate': aggregates['mastery_counts']['intermediate'],
+        'topics_beginner': aggregates['mastery_counts']['beginner'],
+        'recent_improvement': 0,
+        'question_type_stats': {},
+        'difficulty_stats': {}
+    }
     
     # Calculate averages and rates
-    if topics_with_improvement > 0:
-        summary['recent_improvement'] = total_improvement / topics_with_improvement
+    if aggregates['improvement_topics'] > 0:
+        summary['recent_improvement'] = aggregates['improvement_total'] / aggregates['improvement_topics']
     
     for q_type in ['objective', 'subjective']:
-        total = summary['question_type_stats'][q_type]['total_answered']
-        correct = summary['question_type_stats'][q_type]['total_correct']
-        if total > 0:
-            summary['question_type_stats'][q_type]['average_score'] = correct / total
+        total = aggregates['question_types'][q_type]['total']
+        correct = aggregates['question_types'][q_type]['correct']
+        summary['question_type_stats'][q_type] = {
+            'total_answered': total,
+            'total_correct': correct,
+            'average_score': correct / total if total > 0 else 0
+        }
     
     for difficulty in ['easy', 'medium', 'hard']:
-        total = summary['difficulty_stats'][difficulty]['total']
-        correct = summary['difficulty_stats'][difficulty]['correct']
-        if total > 0:
-            summary['difficulty_stats'][difficulty]['success_rate'] = correct / total
-    
-    # Count mastery levels
-    for topic, mastery in profile.get('topic_mastery', {}).items():
-        if mastery == 'mastered':
-            summary['topics_mastered'] += 1
-        elif mastery == 'intermediate':
-            summary['topics_intermediate'] += 1
-        else:
-            summary['topics_beginner'] += 1
+        total = aggregates['difficulties'][difficulty]['total']
+        correct = aggregates['difficulties'][difficulty]['correct']
+        summary['difficulty_stats'][difficulty] = {
+            'total': total,
+            'correct': correct,
+            'success_rate': correct / total if total > 0 else 0
+        }
     
     return summary
 
-def get_recommended_review_topics(username: str, limit: int = 3) -> List[str]:
+def get_recommended_review_topics(username: str, limit: int = 3, profile: Optional[dict] = None) -> List[str]:
     """Get topics that need review based on performance"""
-    profile = load_user(username)
+    profile = profile if profile is not None else load_user(username)
     weak_areas = profile.get('weak_areas', [])
     perf_data = profile.get('performance_data', {})
     
@@ -348,11 +446,17 @@ def get_recommended_review_topics(username: str, limit: int = 3) -> List[str]:
 
 def update_progress(username: str, topic: str, mastery: str) -> None:
     """Legacy function - kept for compatibility"""
-    profile = load_user(username)
-    profile['topic_mastery'][topic] = mastery
-    if topic in profile.get('weak_areas', []) and mastery == 'mastered':
-        profile['weak_areas'].remove(topic)
-    save_user(username, profile)
+    with profile_store.transaction() as conn:
+        profile_store.ensure_user(conn, username)
+        aggregates = _stored_aggregates(conn, username)
+        _apply_mastery_change(aggregates, profile_store.set_mastery(conn, username, topic, mastery), mastery)
+        profile_store.put_aggregates(conn, username, aggregates)
+        weak_areas = profile_store.get_weak_areas(conn, username)
+        if topic in weak_areas and mastery == 'mastered':
+            weak_areas.remove(topic)
+            profile_store.set_weak_areas(conn, username, weak_areas)
+        profile_store.touch(conn, username)
+    invalidate_user_cache(username)
 
 class DocumentProcessor:
     def __init__(self):
@@ -0,0 +1,148 @@
+"""Persistent cache of generated learning plans."""
+import copy
+import json
+import re
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+PLAN_CACHE_FILE = Path('plan_cache.json')
+
+
+def parse_plan_response(response: str) -> Dict:
+    """Parse and validate a learning plan returned by the LLM.
+
+    Accepts plain JSON, JSON wrapped in a ```json code fence, or JSON with
+    leading/trailing prose. Raises ValueError if no usable plan is found.
+    """
+    text = response.strip()
+    fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    if not text.startswith('{'):
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end <= start:
+            raise ValueError("No JSON object in plan response")
+        text = text[start:end + 1]
+
+    try:
+        plan = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid plan JSON: {e}")
+
+    if not isinstance(plan, dict):
+        raise ValueError("Plan is not a JSON object")
+    subtopics = plan.get('subtopics')
+    if not isinstance(subtopics, list) or not subtopics:
+        raise ValueError("Plan has no subtopics")
+    for subtopic in subtopics:
+        if not isinstance(subtopic, dict) or not str(subtopic.get('name', '')).strip():
+            raise ValueError("Plan subtopic is missing a name")
+        for field in ('key_concepts', 'learning_objectives'):
+            if not isinstance(subtopic.get(field, []), list):
+                subtopic[field] = [str(subtopic[field])]
+    return plan
+
+
+class PlanCache:
+    """Caches plans per topic, tagged with the inputs they were built from.
+
+    A plan is fresh while the topics.json digest and the corpus version it was
+    built against are unchanged. Stale plans are still served immediately and
+    rebuilt in the background; concurrent requests for the same topic share a
+    single build.
+    """
+
+    def __init__(self, cache_file: Path = PLAN_CACHE_FILE):
+        self.cache_file = cache_file
+        self._lock = threading.RLock()
+        self._inflight: Dict[str, Future] = {}
+        self.plans: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        if self.cache_file.exists():
+            try:
+                with self.cache_file.open('r') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading plan cache: {e}")
+        return {}
+
+    def _save(self) -> None:
+        temp_file = self.cache_file.with_suffix('.tmp')
+        with self._lock:
+            with temp_file.open('w') as f:
+                json.dump(self.plans, f, indent=2)
+            temp_file.replace(self.cache_file)
+
+    def _build(self, topic: str, builder: Callable[[], Dict], fingerprint: Dict) -> Dict:
+        """Run ``builder`` once per topic at a time; other callers wait on the same result."""
+        with self._lock:
+            future = self._inflight.get(topic)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[topic] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            plan = builder()
+            with self._lock:
+                self.plans[topic] = dict(fingerprint, plan=plan, created_at=datetime.now().isoformat())
+                self._save()
+            future.set_result(plan)
+            return plan
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(topic, None)
+
+    def _rebuild_async(self, topic: str, builder: Callable[[], Dict], fingerprint: Dict) -> None:
+        with self._lock:
+            if topic in self._inflight:
+                return
+
+        def _run():
+            try:
+                self._build(topic, builder, fingerprint)
+            except Exception as e:
+                print(f"Background plan rebuild failed for {topic}: {e}")
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def get(self, topic: str, builder: Callable[[], Dict], topics_digest: str,
+            corpus_version: str) -> Dict:
+        """Return the cached plan for ``topic``, building it with ``builder`` on a miss.
+
+        ``builder`` should raise if it cannot produce a valid plan; failures are
+        never cached.
+        """
+        fingerprint = {'topics_digest': topics_digest, 'corpus_version': corpus_version}
+        with self._lock:
+            entry = self.plans.get(topic)
+
+        if entry is None:
+            return copy.deepcopy(self._build(topic, builder, fingerprint))
+
+        if any(entry.get(k) != v for k, v in fingerprint.items()):
+            self._rebuild_async(topic, builder, fingerprint)
+        return copy.deepcopy(entry['plan'])
+
+    def invalidate(self, topic: Optional[str] = None) -> None:
+        """Drop one topic's plan, or every plan."""
+        with self._lock:
+            if topic is None:
+                self.plans.clear()
+            else:
+                self.plans.pop(topic, None)
+            self._save()
+
+
+# Global plan cache instance
+plan_cache = PlanCache()
@@ -1,26 +1,28 @@
+import copy
 import json
 from pathlib import Path
 from typing import List, Dict
 
-from memory import load_user, save_user, record_learning_session, get_recommended_review_topics
+from memory import load_user, save_user, record_learning_session, get_recommended_review_topics, update_progress
 from domain_expert import (
     explain_concept,
     generate_example,
-    generate_question,
     check_answer,
     generate_summary,
     query_domain_expert,
-    _retrieve_context,
+    SubtopicContextCache,
+    rag_system,
 )
-
-TOPICS_FILE = Path('topics.json')
+from plan_cache import plan_cache, parse_plan_response
+from prefetch import PrefetchScheduler
+from question_bank import serve_question
+from topic_graph import topic_graph
 
 
 def load_topics() -> dict:
-    if TOPICS_FILE.exists():
-        with TOPICS_FILE.open('r') as f:
-            return json.load(f)
-    return {}
+    """Parsed topics.json (a copy of the topic graph's cached parse, safe to modify)."""
+    topic_graph.refresh()
+    return copy.deepcopy(topic_graph.raw)
 
 
 class PlannerAgent:
@@ -42,7 +44,7 @@ class PlannerAgent:
         profile = self.profile
         
         # Get recommended review topics
-        recommended_topics = get_recommended_review_topics(self.username, limit=3)
+        recommended_topics = get_recommended_review_topics(self.username, limit=3, profile=profile)
         
         if recommended_topics:
             print(f"\nRecommended review topics: {', '.join(recommended_topics)}")
@@ -52,21 +54,54 @@ class PlannerAgent:
         return 'learn'
 
     def build_learning_plan(self, topic: str) -> Dict:
-        """Build a structural learning plan without generating content."""
-        topics = load_topics()
-
-        # Get basic info from topics.json if available
-        prereqs: List[str] = []
-        difficulty = "beginner"
-        est_time = 20
+        """Build a structural learning plan without generating content.
         
-        for _parent, children in topics.items():
-            if topic in children:
-                info = children[topic]
-                prereqs = info.get("prerequisites", [])
-                difficulty = info.get("difficulty", "beginner")
-                est_time = info.get("estimated_time", 20)
-                break
+        Plans are served from the persistent plan cache; the LLM is only
+        called on a miss or (in the background) when topics.json or the
+        corpus has changed since the plan was built.
+        """
+        topic_graph.refresh()
+        try:
+            return plan_cache.get(
+                topic,
+                lambda: self._generate_plan(topic),
+                topics_digest=topic_graph.digest,
+                corpus_version=f"{rag_system.retriever.corpus_version}:{len(rag_system.retriever.documents)}"
+            )
+        except Exception as e:
+            print(f"Warning: Could not generate AI plan structure, using fallback. Error: {e}")
+            return self._fallback_plan(topic)
+
+    def _topic_info(self, topic: str) -> Dict:
+        """Prerequisites, difficulty and estimated time for a topic from topics.json."""
+        info = topic_graph.get(topic) or {}
+        return {
+            "prerequisites": info.get("prerequisites", []),
+            "difficulty": info.get("difficulty", "beginner"),
+            "estimated_time": info.get("estimated_time", 20)
+        }
+
+    def _fallback_plan(self, topic: str) -> Dict:
+        """Minimal single-subtopic plan used when generation fails."""
+        return {
+            "topic": topic,
+            **self._topic_info(topic),
+            "subtopics": [
+                {
+                    "name": f"Introduction to {topic}",
+                    "description": f"Basic concepts and overview",
+                    "key_concepts": ["fundamentals", "terminology"],
+                    "learning_objectives": ["understand basics", "know key terms"]
+                }
+            ]
+        }
+
+    def _generate_plan(self, topic: str) -> Dict:
+        """Ask the LLM for a plan structure; raises ValueError on an unusable response."""
+        info = self._topic_info(topic)
+        prereqs = info["prerequisites"]
+        difficulty = info["difficulty"]
+        est_time = info["estimated_time"]
 
         # Create a planning prompt for structure only
         prompt = f"""Create a structured learning plan for "{topic}". 
@@ -95,33 +130,13 @@ class PlannerAgent:
         
         Focus on creating a logical progression of subtopics. Do not generate actual content."""
 
-        # Default fallback plan structure
-        plan = {
-            "topic": topic,
-            "prerequisites": prereqs,
-            "difficulty": difficulty,
-            "estimated_time": est_time,
-            "subtopics": [
-                {
-                    "name": f"Introduction to {topic}",
-                    "description": f"Basic concepts and overview",
-                    "key_concepts": ["fundamentals", "terminology"],
-                    "learning_objectives": ["understand basics", "know key terms"]
-                }
-            ]
-        }
-
-        try:
-            # Use domain expert to generate plan structure
-            response = query_domain_expert(prompt, temperature=0.3)  # Lower temperature for structured output
-            ai_plan = json.loads(response)
-            plan.update(ai_plan)
-        except Exception as e:
-            print(f"Warning: Could not generate AI plan structure, using fallback. Error: {e}")
-
+        # Use domain expert to generate plan structure
+        response = query_domain_expert(prompt, temperature=0.3)  # Lower temperature for structured output
+        plan = {"topic": topic, **info}
+        plan.update(parse_plan_response(response))
         return plan
 
-    def run_learning_loop(self, topic: str) -> None:
+    def run_learning_loop(self, topic: str, include_prerequisites: bool = True) -> None:
         profile = self.profile
         plan = self.build_learning_plan(topic)
         
@@ -131,24 +146,31 @@ class PlannerAgent:
         
         # Handle prerequisites intelligently
         prerequisites = plan.get('prerequisites', [])
-        if prerequisites:
+        if prerequisites and include_prerequisites:
             print(f"\nThis topic typically requires: {', '.join(prerequisites)}")
+            frontier = topic_graph.prerequisite_frontier(topic, profile['topic_mastery'])
+            if frontier:
+                print(f"You can start right away with: {', '.join(frontier)}")
             skip_prereqs = input("Do you already have this background? (y/n): ").lower().strip()
             
             if skip_prereqs != 'y':
                 print("\nLet's cover the prerequisites first:")
-                for prereq in prerequisites:
-                    if profile['topic_mastery'].get(prereq) != 'mastered':
-                        print(f"\nLearning prerequisite: {prereq}")
-                        self.run_learning_loop(prereq)
-                        profile = self.profile
+                # The full unmastered closure in learning order, so each
+                # prerequisite is taught once and cycles cannot recurse
+                remaining = topic_graph.remaining_prerequisites(
+                    topic, profile['topic_mastery'], extra=prerequisites
+                )
+                for prereq in remaining:
+                    print(f"\nLearning prerequisite: {prereq}")
+                    self.run_learning_loop(prereq, include_prerequisites=False)
+                    profile = self.profile
             else:
                 print("Great! Marking prerequisites as known and proceeding with the main topic.")
                 # Mark prerequisites as known to avoid future redundancy
                 for prereq in prerequisites:
                     if prereq not in profile['topic_mastery']:
-                        profile['topic_mastery'][prereq] = 'mastered'
-                self.save_profile(profile)
+                        update_progress(self.username, prereq, 'mastered')
+                profile = self.profile
         
         # Work through each subtopic systematically
         subtopics = plan.get('subtopics', [])
@@ -156,33 +178,60 @@ class PlannerAgent:
         total_questions = 0
         subtopics_performance = []  # Track performance for each subtopic
         
+        prefetcher = PrefetchScheduler()
+        contexts = SubtopicContextCache()  # One retrieval per subtopic, shared by every step
+        
+        def explain(name: str) -> str:
+            return explain_concept(name, retrieved=contexts.get(name))
+        
+        def example_for(name: str) -> str:
+            return generate_example(name, retrieved=contexts.get(name))
+        
+        def question_for(name: str) -> Dict:
+            return serve_question(
+                topic,
+                previous_questions=[],
+                difficulty="medium",
+                question_type="analytical",
+                username=self.username,
+                subtopic=name,
+                retrieved=contexts.get(name)
+            )
+        
+        def summary_for(name: str) -> str:
+            return generate_summary(name, length="short", retrieved=contexts.get(name))
+        
         for i, subtopic in enumerate(subtopics, 1):
             print(f"\n=== Subtopic {i}/{len(subtopics)}: {subtopic['name']} ===")
             print(f"Learning objectives: {', '.join(subtopic.get('learning_objectives', []))}")
             
             # Use domain expert for all content generation
             print("\n--- Explanation ---")
-            explanation = explain_concept(subtopic['name'])
+            explanation = prefetcher.consume(('explain', subtopic['name']), explain, subtopic['name'])
+            
+            # Generate the remaining steps (and the next explanation) while the student reads
+            prefetcher.schedule(('example', subtopic['name']), example_for, subtopic['name'])
+            prefetcher.schedule(('question', subtopic['name']), question_for, subtopic['name'])
+            prefetcher.schedule(('summary', subtopic['name']), summary_for, subtopic['name'])
+            if i < len(subtopics):
+                next_name = subtopics[i]['name']
+                prefetcher.schedule(('explain', next_name), explain, next_name)
+            
             print(explanation)
             
             # Provide example using domain expert
             print("\n--- Example ---")
-            example = generate_example(subtopic['name'])
+            example = prefetcher.consume(('example', subtopic['name']), example_for, subtopic['name'])
             print(example)
             
             # Generate question using domain expert
             print("\n--- Check Understanding ---")
             key_concepts = subtopic.get('key_concepts', [])
             # Pass context about what to test
-            question = generate_question(
-                subtopic['name'], 
-                previous_questions=[],
-                difficulty="medium",
-                question_type="analytical"
-            )
+            question = prefetcher.consume(('question', subtopic['name']), question_for, subtopic['name'])
             
             user_answer = input(question + "\nYour answer: ")
-            correct, feedback = check_answer(question, user_answer)
+            correct, feedback = check_answer(question, user_answer, retrieved=contexts.get(subtopic['name']))
             print(feedback)
             
             # Record subtopic performance
@@ -201,25 +250,29 @@ class PlannerAgent:
             total_questions += 1
             
             # Brief summary from domain expert
-            summary = generate_summary(subtopic['name'], length="short")
+            summary = prefetcher.consume(('summary', subtopic['name']), summary_for, subtopic['name'])
             print(f"\n--- Summary ---\n{summary}")
             
             # Pause between subtopics
             if i < len(subtopics):
                 input("\nPress Enter to continue to the next subtopic...")
         
+        prefetcher.shutdown()
+        
         # Final comprehensive assessment
         print(f"\n=== Final Assessment for {topic} ===")
         # Generate a synthesis question using domain expert
-        final_question = generate_question(
+        final_question = serve_question(
             topic,
             previous_questions=[p['question'] for p in subtopics_performance],
             difficulty="hard",
-            question_type="synthesis"
+            question_type="synthesis",
+            username=self.username,
+            retrieved=contexts.get(topic)
         )
         
         user_answer = input(final_question + "\nYour comprehensive answer: ")
-        correct, feedback = check_answer(final_question, user_answer)
+        correct, feedback = check_answer(final_question, user_answer, retrieved=contexts.get(topic))
         print(feedback)
         
         # Record final assessment performance
@@ -0,0 +1,62 @@
+"""Background prefetching of tutoring content for learning sessions."""
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Hashable
+
+
+class PrefetchScheduler:
+    """Speculatively generates upcoming session content in the background.
+
+    Jobs are keyed (e.g. ``('example', subtopic)``) so the session loop can
+    consume a result when it reaches the step that needs it, and cancel jobs
+    that are no longer relevant when the student skips ahead or quits.
+    """
+
+    def __init__(self, max_workers: int = 3):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._jobs: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def schedule(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> None:
+        """Start generating ``fn(*args, **kwargs)`` unless already scheduled."""
+        with self._lock:
+            if self._closed or key in self._jobs:
+                return
+            self._jobs[key] = self._executor.submit(fn, *args, **kwargs)
+
+    def consume(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Return the prefetched result for ``key``, generating it inline if needed."""
+        with self._lock:
+            future = self._jobs.pop(key, None)
+
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Prefetch of {key} failed, regenerating: {e}")
+
+        return fn(*args, **kwargs)
+
+    def cancel_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Cancel and drop every job whose key matches ``predicate``.
+
+        Jobs that are already running cannot be interrupted; their results
+        are simply discarded.
+        """
+        with self._lock:
+            keys = [key for key in self._jobs if predicate(key)]
+            for key in keys:
+                self._jobs.pop(key).cancel()
+        return len(keys)
+
+    def cancel_all(self) -> int:
+        """Cancel every pending job."""
+        return self.cancel_where(lambda _key: True)
+
+    def shutdown(self) -> None:
+        """Cancel pending work and stop accepting new jobs."""
+        with self._lock:
+            self._closed = True
+        self.cancel_all()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,541 @@
+"""SQLite (WAL) storage backend for user profiles."""
+import argparse
+import fcntl
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+USER_DATA_DIR = Path('user_data')
+USER_DATA_DIR.mkdir(exist_ok=True)
+PROFILE_DB = USER_DATA_DIR / 'profiles.db'
+ARCHIVE_DIR = USER_DATA_DIR / 'archive'
+
+# Compaction policy: raw sessions older than this, or beyond the most recent
+# HISTORY_MAX_SESSIONS, are rolled up per topic and week and archived
+HISTORY_RETENTION_DAYS = 90
+HISTORY_MAX_SESSIONS = 50
+
+# Profile keys stored in their own columns/tables; anything else goes in users.extra
+CORE_KEYS = ('weak_areas', 'topic_mastery', 'history', 'history_rollups', 'learning_plan', 'performance_data',
+             'aggregates', 'last_active', 'version')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    topic_mastery TEXT NOT NULL DEFAULT '{}',
+    learning_plan TEXT NOT NULL DEFAULT '{}',
+    extra TEXT NOT NULL DEFAULT '{}',
+    aggregates TEXT NOT NULL DEFAULT '{}',
+    last_active TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    change_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    final_score REAL,
+    mastery_level TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(username, id);
+CREATE TABLE IF NOT EXISTS topic_performance (
+    username TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    average_score REAL NOT NULL DEFAULT 0,
+    improvement_rate REAL NOT NULL DEFAULT 0,
+    last_attempt TEXT,
+    details TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (username, topic)
+);
+CREATE TABLE IF NOT EXISTS history_rollups (
+    username TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    week TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    score_total REAL NOT NULL DEFAULT 0,
+    best_score REAL NOT NULL DEFAULT 0,
+    study_days TEXT NOT NULL DEFAULT '[]',
+    last_date TEXT,
+    PRIMARY KEY (username, topic, week)
+);
+CREATE TABLE IF NOT EXISTS weak_areas (
+    username TEXT NOT NULL,
+    area TEXT NOT NULL,
+    PRIMARY KEY (username, area)
+);
+"""
+
+
+def empty_profile() -> Dict:
+    """A new user's profile."""
+    return {
+        'weak_areas': [],
+        'topic_mastery': {},
+        'history': [],
+        'learning_plan': {},
+        'performance_data': {},
+        'last_active': datetime.now().isoformat(),
+        'version': 0
+    }
+
+
+class StaleProfileError(Exception):
+    """A whole-profile write based on a copy older than the stored profile."""
+
+
+class ProfileStore:
+    """Normalized profile storage in a single SQLite database.
+
+    Sessions, per-topic performance and weak areas live in their own tables so
+    that recording a session touches a handful of rows instead of rewriting
+    the whole profile. All writes go through ``transaction()``, which takes
+    the database write lock up front (BEGIN IMMEDIATE) so read-modify-write
+    sequences from concurrent sessions cannot interleave. Every write bumps
+    the user's ``version`` so callers can validate cached copies.
+    """
+
+    def __init__(self, db_path: Path = PROFILE_DB, json_dir: Path = USER_DATA_DIR):
+        self.db_path = db_path
+        self.json_dir = json_dir
+        self._local = threading.local()
+        self._migration_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self) -> None:
+        """Add columns introduced after a database was first created."""
+        conn = self._connect()
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(users)')}
+        if 'aggregates' not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN aggregates TEXT NOT NULL DEFAULT '{}'")
+        if 'change_seq' not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_change_seq ON users(change_seq)')
+
+    # ---- Connections ----
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction holding the database lock for its whole duration."""
+        conn = self._connect()
+        if conn.in_transaction:  # Nested use joins the outer transaction
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    # ---- Users ----
+    def exists(self, username: str) -> bool:
+        row = self._connect().execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone()
+        return row is not None
+
+    def usernames(self) -> List[str]:
+        return [row['username'] for row in self._connect().execute('SELECT username FROM users ORDER BY username')]
+
+    def version(self, username: str) -> int:
+        """Write counter for a user (0 if the user is unknown)."""
+        row = self._connect().execute('SELECT version FROM users WHERE username = ?', (username,)).fetchone()
+        return row['version'] if row else 0
+
+    def ensure_user(self, conn: sqlite3.Connection, username: str) -> None:
+        conn.execute(
+            'INSERT OR IGNORE INTO users (username, last_active) VALUES (?, ?)',
+            (username, datetime.now().isoformat())
+        )
+
+    def touch(self, conn: sqlite3.Connection, username: str) -> None:
+        """Mark the user active, bump their version and move them to the end of the change feed."""
+        conn.execute(
+            'UPDATE users SET last_active = ?, version = version + 1, '
+            'change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM users) WHERE username = ?',
+            (datetime.now().isoformat(), username)
+        )
+
+    def _user_json(self, conn: sqlite3.Connection, username: str, column: str) -> Dict:
+        row = conn.execute(f'SELECT {column} FROM users WHERE username = ?', (username,)).fetchone()
+        return json.loads(row[column]) if row else {}
+
+    def get_mastery(self, conn: sqlite3.Connection, username: str) -> Dict[str, str]:
+        return self._user_json(conn, username, 'topic_mastery')
+
+    def set_mastery(self, conn: sqlite3.Connection, username: str, topic: str, mastery: str) -> Optional[str]:
+        """Set one topic's mastery level; returns the previous level (None if unset)."""
+        mastery_map = self._user_json(conn, username, 'topic_mastery')
+        previous = mastery_map.get(topic)
+        mastery_map[topic] = mastery
+        conn.execute('UPDATE users SET topic_mastery = ? WHERE username = ?',
+                     (json.dumps(mastery_map), username))
+        return previous
+
+    def get_aggregates(self, conn: sqlite3.Connection, username: str) -> Dict:
+        return self._user_json(conn, username, 'aggregates')
+
+    def put_aggregates(self, conn: sqlite3.Connection, username: str, aggregates: Dict) -> None:
+        conn.execute('UPDATE users SET aggregates = ? WHERE username = ?',
+                     (json.dumps(aggregates), username))
+
+    # ---- Sessions ----
+    def insert_session(self, conn: sqlite3.Connection, username: str, session: Dict) -> int:
+        cursor = conn.execute(
+            'INSERT INTO sessions (username, date, topic, final_score, mastery_level, data) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (username, session.get('date', datetime.now().isoformat()), session.get('topic', ''),
+             session.get('final_score'), session.get('mastery_level'), json.dumps(session))
+        )
+        return cursor.lastrowid
+
+    def load_sessions(self, username: str, since_id: int = 0) -> List[Dict]:
+        rows = self._connect().execute(
+            'SELECT data FROM sessions WHERE username = ? AND id > ? ORDER BY id',
+            (username, since_id)
+        ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def _latest_session_date(self, conn: sqlite3.Connection, username: str) -> str:
+        """Date of the newest stored session, whether hot or rolled up."""
+        row = conn.execute(
+            'SELECT MAX(d) FROM ('
+            ' SELECT MAX(date) AS d FROM sessions WHERE username = ?'
+            ' UNION ALL SELECT MAX(last_date) FROM history_rollups WHERE username = ?)',
+            (username, username)
+        ).fetchone()
+        return row[0] or ''
+
+    # ---- History compaction ----
+    def archive_file(self, username: str) -> Path:
+        return ARCHIVE_DIR / f"{username}.jsonl"
+
+    def compact_history(self, username: str, retention_days: int = HISTORY_RETENTION_DAYS,
+                        max_sessions: int = HISTORY_MAX_SESSIONS) -> int:
+        """Roll old raw sessions up into per-topic weekly aggregates.
+
+        The raw session records are removed from the hot table and appended
+        to the user's cold archive (``user_data/archive/<username>.jsonl``)
+        once that commits, so the archive is never written while the
+        database is locked and a rolled-back compaction leaves no duplicates
+        (a crash in between loses only the raw copies; the rollups stay).
+        Whether anything is due is checked first without the write lock.
+        Returns the number of sessions compacted.
+        """
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        count, oldest = self._connect().execute(
+            'SELECT COUNT(*), MIN(date) FROM sessions WHERE username = ?', (username,)
+        ).fetchone()
+        if count <= max_sessions and (oldest is None or oldest >= cutoff):
+            return 0
+
+        with self.transaction() as conn:
+            rows = conn.execute(
+                'SELECT id, date, data FROM sessions WHERE username = ? ORDER BY id', (username,)
+            ).fetchall()
+            overflow = max(0, len(rows) - max_sessions)
+            old = [row for i, row in enumerate(rows) if i < overflow or row['date'] < cutoff]
+            if not old:
+                return 0
+
+            for row in old:
+                session = json.loads(row['data'])
+                self._add_to_rollup(conn, username, session)
+            conn.executemany('DELETE FROM sessions WHERE id = ?', [(row['id'],) for row in old])
+            self.touch(conn, username)
+
+        ARCHIVE_DIR.mkdir(exist_ok=True)
+        with self.archive_file(username).open('a') as f:
+            for row in old:
+                f.write(row['data'] + '\n')
+        return len(old)
+
+    def _add_to_rollup(self, conn: sqlite3.Connection, username: str, session: Dict) -> None:
+        date = datetime.fromisoformat(session['date'])
+        week = (date.date() - timedelta(days=date.weekday())).isoformat()
+        topic = session.get('topic', '')
+        score = session.get('final_score') or 0
+
+        row = conn.execute(
+            'SELECT * FROM history_rollups WHERE username = ? AND topic = ? AND week = ?',
+            (username, topic, week)
+        ).fetchone()
+        days = set(json.loads(row['study_days'])) if row else set()
+        days.add(date.date().isoformat())
+        conn.execute(
+            'INSERT OR REPLACE INTO history_rollups '
+            '(username, topic, week, sessions, score_total, best_score, study_days, last_date) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (username, topic, week,
+             (row['sessions'] if row else 0) + 1,
+             (row['score_total'] if row else 0) + score,
+             max(row['best_score'] if row else 0, score),
+             json.dumps(sorted(days)),
+             max(row['last_date'] or '', session['date']) if row else session['date'])
+        )
+
+    def load_rollups(self, username: str) -> List[Dict]:
+        """Weekly per-topic rollups of compacted sessions, oldest first."""
+        rows = self._connect().execute(
+            'SELECT * FROM history_rollups WHERE username = ? ORDER BY week, last_date', (username,)
+        ).fetchall()
+        return [{
+            'topic': row['topic'],
+            'week': row['week'],
+            'sessions': row['sessions'],
+            'average_score': row['score_total'] / row['sessions'] if row['sessions'] else 0,
+            'best_score': row['best_score'],
+            'study_days': json.loads(row['study_days']),
+            'last_date': row['last_date']
+        } for row in rows]
+
+    def load_archived_history(self, username: str) -> List[Dict]:
+        """Full raw records of compacted sessions, read from the cold archive on demand."""
+        archive = self.archive_file(username)
+        if not archive.exists():
+            return []
+        with archive.open('r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    # ---- Topic performance ----
+    def get_topic_performance(self, conn: sqlite3.Connection, username: str, topic: str) -> Optional[Dict]:
+        row = conn.execute(
+            'SELECT * FROM topic_performance WHERE username = ? AND topic = ?', (username, topic)
+        ).fetchone()
+        return self._performance_from_row(row) if row else None
+
+    def put_topic_performance(self, conn: sqlite3.Connection, username: str, topic: str, data: Dict) -> None:
+        details = {k: v for k, v in data.items()
+                   if k not in ('attempts', 'average_score', 'improvement_rate', 'last_attempt')}
+        conn.execute(
+            'INSERT OR REPLACE INTO topic_performance '
+            '(username, topic, attempts, average_score, improvement_rate, last_attempt, details) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (username, topic, data.get('attempts', 0), data.get('average_score', 0),
+             data.get('improvement_rate', 0), data.get('last_attempt'), json.dumps(details))
+        )
+
+    def load_performance(self, conn: sqlite3.Connection, username: str) -> Dict[str, Dict]:
+        """Every topic's performance record for a user."""
+        return {
+            row['topic']: self._performance_from_row(row)
+            for row in conn.execute('SELECT * FROM topic_performance WHERE username = ?', (username,))
+        }
+
+    def read_performance(self, username: str) -> Dict[str, Dict]:
+        """``load_performance`` outside a transaction (read-only callers)."""
+        return self.load_performance(self._connect(), username)
+
+    @staticmethod
+    def _performance_from_row(row: sqlite3.Row) -> Dict:
+        data = json.loads(row['details'])
+        data.update({
+            'attempts': row['attempts'],
+            'average_score': row['average_score'],
+            'improvement_rate': row['improvement_rate'],
+            'last_attempt': row['last_attempt']
+        })
+        return data
+
+    # ---- Weak areas ----
+    def get_weak_areas(self, conn: sqlite3.Connection, username: str) -> List[str]:
+        rows = conn.execute('SELECT area FROM weak_areas WHERE username = ? ORDER BY rowid', (username,))
+        return [row['area'] for row in rows]
+
+    def set_weak_areas(self, conn: sqlite3.Connection, username: str, areas: Iterable[str]) -> None:
+        """Replace the user's weak areas, keeping rows for areas that did not change."""
+        areas = list(dict.fromkeys(areas))
+        current = set(self.get_weak_areas(conn, username))
+        removed = current.difference(areas)
+        conn.executemany('DELETE FROM weak_areas WHERE username = ? AND area = ?',
+                         [(username, area) for area in removed])
+        conn.executemany('INSERT OR IGNORE INTO weak_areas (username, area) VALUES (?, ?)',
+                         [(username, area) for area in areas if area not in current])
+
+    # ---- Bulk reads (cohort analytics) ----
+    def user_versions(self) -> Dict[str, int]:
+        """Every user's write counter."""
+        return {row['username']: row['version'] for row in self._connect().execute('SELECT username, version FROM users')}
+
+    def change_seq(self) -> int:
+        """Position of the latest write in the change feed (0 if none)."""
+        return self._connect().execute('SELECT COALESCE(MAX(change_seq), 0) FROM users').fetchone()[0]
+
+    def changed_since(self, seq: int) -> Tuple[List[str], int]:
+        """Users written after feed position ``seq``, and the position to pass next time.
+
+        ``touch`` gives every write a new position in the same transaction,
+        so this one indexed query replaces comparing every user's version.
+        """
+        rows = self._connect().execute(
+            'SELECT username, change_seq FROM users WHERE change_seq > ? ORDER BY change_seq', (seq,)
+        ).fetchall()
+        return [row['username'] for row in rows], (rows[-1]['change_seq'] if rows else seq)
+
+    def _rows_for_users(self, sql: str, usernames: Optional[List[str]]) -> List[sqlite3.Row]:
+        """Run ``sql`` for all users or some; its ``{users}`` placeholder receives the WHERE condition."""
+        conn = self._connect()
+        if usernames is None:
+            return conn.execute(sql.format(users='1 = 1')).fetchall()
+        rows = []
+        for start in range(0, len(usernames), 500):  # Stay under SQLite's parameter limit
+            chunk = usernames[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows.extend(conn.execute(sql.format(users=f'username IN ({placeholders})'), chunk))
+        return rows
+
+    def bulk_users(self, usernames: Optional[List[str]] = None) -> List[sqlite3.Row]:
+        """``username, topic_mastery, aggregates, version`` rows."""
+        return self._rows_for_users(
+            'SELECT username, topic_mastery, aggregates, version FROM users WHERE {users}', usernames)
+
+    def bulk_topic_performance(self, usernames: Optional[List[str]] = None) -> List[sqlite3.Row]:
+        """``username, topic, attempts, average_score`` rows."""
+        return self._rows_for_users(
+            'SELECT username, topic, attempts, average_score FROM topic_performance WHERE {users}', usernames)
+
+    def bulk_weak_areas(self, usernames: Optional[List[str]] = None) -> List[sqlite3.Row]:
+        """``username, area`` rows."""
+        return self._rows_for_users('SELECT username, area FROM weak_areas WHERE {users}', usernames)
+
+    # ---- Whole profiles ----
+    def load_profile(self, username: str) -> Optional[Dict]:
+        """Assemble the legacy profile dict, or None if the user is unknown."""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            return None
+
+        profile = json.loads(row['extra'])
+        profile.update({
+            'weak_areas': self.get_weak_areas(conn, username),
+            'topic_mastery': json.loads(row['topic_mastery']),
+            'history': self.load_sessions(username),
+            'history_rollups': self.load_rollups(username),
+            'learning_plan': json.loads(row['learning_plan']),
+            'performance_data': self.load_performance(conn, username),
+            'aggregates': json.loads(row['aggregates']),
+            'last_active': row['last_active'],
+            'version': row['version']
+        })
+        return profile
+
+    def save_profile(self, username: str, profile: Dict) -> None:
+        """Write a whole profile dict back, touching only what changed.
+
+        The profile's ``version`` (set by ``load_profile``) must still be the
+        stored one; otherwise another writer changed the user since it was
+        read and ``StaleProfileError`` is raised instead of overwriting that
+        change. History is append-only: only entries newer than the latest
+        stored (or already compacted) session are inserted. Topics missing
+        from ``performance_data`` are left alone.
+        """
+        extra = {k: v for k, v in profile.items() if k not in CORE_KEYS}
+        with self.transaction() as conn:
+            if 'version' in profile:
+                row = conn.execute('SELECT version FROM users WHERE username = ?', (username,)).fetchone()
+                stored = row['version'] if row else 0
+                if stored != profile['version']:
+                    raise StaleProfileError(
+                        f"Profile of {username} changed since it was read (version {profile['version']}, now {stored})"
+                    )
+            self.ensure_user(conn, username)
+            conn.execute(
+                'UPDATE users SET topic_mastery = ?, learning_plan = ?, extra = ?, aggregates = ? '
+                'WHERE username = ?',
+                (json.dumps(profile.get('topic_mastery', {})), json.dumps(profile.get('learning_plan', {})),
+                 json.dumps(extra), json.dumps(profile.get('aggregates', {})), username)
+            )
+
+            latest = self._latest_session_date(conn, username)
+            for session in profile.get('history', []):
+                if session.get('date', '') > latest:
+                    self.insert_session(conn, username, session)
+
+            for topic, data in profile.get('performance_data', {}).items():
+                self.put_topic_performance(conn, username, topic, data)
+
+            self.set_weak_areas(conn, username, profile.get('weak_areas', []))
+            self.touch(conn, username)
+            profile['version'] = conn.execute('SELECT version FROM users WHERE username = ?',
+                                              (username,)).fetchone()['version']
+
+    # ---- Migration ----
+    def import_json_profile(self, username: str) -> bool:
+        """Import ``user_data/<username>.json`` if the user is not in the database yet."""
+        json_file = self.json_dir / f"{username}.json"
+        if self.exists(username) or not json_file.exists():
+            return False
+        try:
+            with json_file.open('r') as f:
+                content = f.read().strip()
+            profile = empty_profile()
+            if content:
+                profile.update(json.loads(content))
+            self.save_profile(username, profile)
+            self.compact_history(username)
+            return True
+        except Exception as e:
+            print(f"Error migrating profile {json_file}: {e}")
+            return False
+
+    def migrate_json_profiles(self, force: bool = False) -> int:
+        """One-shot import of every legacy JSON profile. Returns the number imported.
+
+        Run as a startup step (``main.py``, ``api_server.py``) or with
+        ``--migrate``, not on import; ``load_user`` still imports a single
+        missing profile on demand. A file lock next to the database makes
+        concurrent processes wait for one import instead of repeating it.
+        """
+        with self._migration_lock, (self.db_path.parent / 'profiles.migrate.lock').open('w') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            conn = self._connect()
+            if not force and conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return 0
+
+            imported = sum(self.import_json_profile(path.stem) for path in sorted(self.json_dir.glob('*.json')))
+            with self.transaction() as conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                             (datetime.now().isoformat(),))
+        if imported:
+            print(f"Migrated {imported} JSON profile(s) into {self.db_path}")
+        return imported
+
+
+# Global profile store instance
+profile_store = ProfileStore()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the SQLite profile store.")
+    parser.add_argument("--migrate", action="store_true", help="Re-run the JSON profile import")
+    parser.add_argument("--verify-aggregates", action="store_true",
+                        help="Check (and repair) every user's performance aggregates")
+    args = parser.parse_args()
+
+    if args.migrate:
+        print(f"Imported {profile_store.migrate_json_profiles(force=True)} profile(s)")
+    if args.verify_aggregates:
+        from memory import verify_all_aggregates
+        for username, ok in verify_all_aggregates().items():
+            print(f"{username}: {'ok' if ok else 'rebuilt'}")
@@ -0,0 +1,339 @@
+"""Persistent bank of pre-generated questions for instant serving."""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from domain_expert import RetrievedContext, generate_question, rag_system, retrieve_shared_context
+
+BANK_DIR = Path('question_bank')
+
+LOW_STOCK = 3            # Refill when fewer unseen questions remain for a user
+REFILL_BATCH = 5         # Questions generated per refill
+DUPLICATE_THRESHOLD = 0.9  # Cosine similarity above which a question is a duplicate
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_key ON questions(key, created_at);
+CREATE TABLE IF NOT EXISTS seen (
+    username TEXT NOT NULL,
+    question_id TEXT NOT NULL,
+    PRIMARY KEY (username, question_id)
+);
+"""
+
+
+def _question_text(question) -> str:
+    """Normalize a question dict or string to its text."""
+    if isinstance(question, dict):
+        return question.get('text', '')
+    return str(question)
+
+
+class QuestionBank:
+    """Stores generated questions keyed by topic, subtopic, difficulty and type.
+
+    Questions are generated ahead of time (offline or when stock runs low) so
+    that serving a question is an indexed lookup rather than a RAG + LLM
+    round trip. Each user has a separate "already seen" set so questions are
+    not repeated. Questions, their embeddings and the seen sets live in one
+    SQLite database shared by every worker process: adding a question or
+    serving one writes a row, and every draw reads the current seen set, so
+    workers never overwrite each other's.
+    """
+
+    def __init__(self, bank_dir: Path = BANK_DIR):
+        self.bank_dir = bank_dir
+        self.bank_dir.mkdir(exist_ok=True)
+        self.db_path = bank_dir / 'bank.db'
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._refilling = set()
+        self._connect().executescript(SCHEMA)
+        self._import_json()
+
+    # ---- Persistence ----
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction holding the database lock for its whole duration."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _import_json(self) -> None:
+        """One-shot import of the older ``bank.json`` and ``seen_<username>.json`` files."""
+        bank_file = self.bank_dir / 'bank.json'
+        seen_files = sorted(self.bank_dir.glob('seen_*.json'))
+        if not bank_file.exists() and not seen_files:
+            return
+        try:
+            with self._transaction() as conn:  # Concurrent workers wait here, then see the flag
+                if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                    return
+                if bank_file.exists():
+                    with bank_file.open('r') as f:
+                        questions = json.load(f).get('questions', {})
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO questions (id, key, question, created_at) VALUES (?, ?, ?, ?)',
+                        [(e['id'], key, json.dumps(e['question']), e.get('created_at', datetime.now().isoformat()))
+                         for key, entries in questions.items() for e in entries]
+                    )
+                for seen_file in seen_files:
+                    with seen_file.open('r') as f:
+                        username = seen_file.stem[len('seen_'):]
+                        conn.executemany('INSERT OR IGNORE INTO seen (username, question_id) VALUES (?, ?)',
+                                         [(username, qid) for qid in json.load(f)])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (datetime.now().isoformat(),))
+        except Exception as e:
+            print(f"Error importing question bank files: {e}")
+
+    # ---- Keys and embeddings ----
+    @staticmethod
+    def make_key(topic: str, subtopic: str, difficulty: str, question_type: str) -> str:
+        return f"{topic}::{subtopic}::{difficulty}::{question_type}"
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        return rag_system.retriever.embedder.encode(
+            texts,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+
+    def texts(self, key: str) -> List[str]:
+        """Text of every question stored under ``key``, oldest first."""
+        rows = self._connect().execute('SELECT question FROM questions WHERE key = ? ORDER BY created_at', (key,))
+        return [json.loads(row['question'])['text'] for row in rows]
+
+    def _key_embeddings(self, conn: sqlite3.Connection, key: str) -> np.ndarray:
+        """Embeddings of every question under ``key``, computing (and storing) any missing ones."""
+        rows = conn.execute('SELECT id, question, embedding FROM questions WHERE key = ?', (key,)).fetchall()
+        if not rows:
+            return np.zeros((0, 0))
+        missing = [row for row in rows if row['embedding'] is None]
+        computed = {}
+        if missing:  # Rows imported from the JSON bank
+            vectors = self._embed([json.loads(row['question'])['text'] for row in missing])
+            for row, vector in zip(missing, vectors):
+                computed[row['id']] = np.asarray(vector, dtype=np.float32)
+                conn.execute('UPDATE questions SET embedding = ? WHERE id = ?',
+                             (computed[row['id']].tobytes(), row['id']))
+        return np.vstack([
+            computed[row['id']] if row['id'] in computed else np.frombuffer(row['embedding'], dtype=np.float32)
+            for row in rows
+        ])
+
+    # ---- Filling ----
+    def add_questions(self, key: str, questions: List[Dict]) -> int:
+        """Add questions under ``key``, dropping near-duplicates. Returns number added."""
+        candidates = [
+            q for q in questions
+            if q.get('text') and not q.get('fallback') and not q['text'].startswith('[Error:')
+        ]
+        if not candidates:
+            return 0
+
+        vectors = np.asarray(self._embed([q['text'] for q in candidates]), dtype=np.float32)
+        added = 0
+        with self._transaction() as conn:
+            existing = self._key_embeddings(conn, key)
+            for question, vector in zip(candidates, vectors):
+                if existing.size and float(np.max(existing @ vector)) >= DUPLICATE_THRESHOLD:
+                    continue
+                conn.execute(
+                    'INSERT INTO questions (id, key, question, embedding, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (uuid.uuid4().hex, key, json.dumps(question), vector.tobytes(), datetime.now().isoformat())
+                )
+                existing = vector.reshape(1, -1) if not existing.size else np.vstack([existing, vector])
+                added += 1
+        return added
+
+    def fill(self, topic: str, subtopic: Optional[str] = None, difficulty: str = "medium",
+             question_type: str = "objective", count: int = REFILL_BATCH) -> int:
+        """Generate ``count`` questions from the indexed corpus and bank the unique ones."""
+        subtopic = subtopic or topic
+        key = self.make_key(topic, subtopic, difficulty, question_type)
+        previous = self.texts(key)
+        retrieved = retrieve_shared_context(subtopic)
+
+        generated = []
+        for _ in range(count):
+            question = generate_question(subtopic, previous, difficulty, question_type, retrieved=retrieved)
+            if question.get('fallback'):
+                continue
+            generated.append(question)
+            previous.append(question['text'])
+
+        return self.add_questions(key, generated)
+
+    def refill_async(self, topic: str, subtopic: str, difficulty: str, question_type: str) -> None:
+        """Top up a key in a background thread (at most one refill per key)."""
+        key = self.make_key(topic, subtopic, difficulty, question_type)
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        def _run():
+            try:
+                self.fill(topic, subtopic, difficulty, question_type)
+            except Exception as e:
+                print(f"Background refill failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refilling.discard(key)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    # ---- Serving ----
+    def draw(self, username: Optional[str], topic: str, subtopic: Optional[str] = None,
+             difficulty: str = "medium", question_type: str = "objective",
+             previous_questions: List = None) -> Optional[Dict]:
+        """Serve a random unseen banked question, or None if the bank has no stock.
+
+        Without a username nothing is recorded as seen, so only the random
+        pick and ``previous_questions`` keep repeats apart. With one, the
+        seen set is read and extended in one transaction, so concurrent
+        draws (from any worker) never hand out the same question twice.
+        """
+        subtopic = subtopic or topic
+        key = self.make_key(topic, subtopic, difficulty, question_type)
+        avoid = {_question_text(q) for q in (previous_questions or [])}
+
+        with self._transaction() as conn:
+            rows = conn.execute(
+                'SELECT id, question FROM questions WHERE key = ? AND id NOT IN '
+                '(SELECT question_id FROM seen WHERE username = ?)',
+                (key, username or '')
+            ).fetchall()
+            unseen = []
+            for row in rows:
+                question = json.loads(row['question'])
+                if question['text'] not in avoid:
+                    unseen.append((row['id'], question))
+            chosen = random.choice(unseen) if unseen else None
+            if chosen and username:
+                conn.execute('INSERT OR IGNORE INTO seen (username, question_id) VALUES (?, ?)',
+                             (username, chosen[0]))
+
+        if len(unseen) - 1 < LOW_STOCK:
+            self.refill_async(topic, subtopic, difficulty, question_type)
+
+        if chosen is None:
+            return None
+        return dict(chosen[1], bank_id=chosen[0])
+
+    def stock(self, username: Optional[str], topic: str, subtopic: Optional[str] = None,
+              difficulty: str = "medium", question_type: str = "objective") -> int:
+        """Number of banked questions the user has not seen yet."""
+        key = self.make_key(topic, subtopic or topic, difficulty, question_type)
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM questions WHERE key = ? AND id NOT IN '
+            '(SELECT question_id FROM seen WHERE username = ?)',
+            (key, username or '')
+        ).fetchone()[0]
+
+
+# Global question bank instance
+question_bank = QuestionBank()
+
+
+def serve_question(topic: str, previous_questions: List = None, difficulty: str = "medium",
+                   question_type: str = "objective", username: Optional[str] = None,
+                   subtopic: Optional[str] = None, retrieved: Optional[RetrievedContext] = None) -> Dict:
+    """Drop-in replacement for ``generate_question`` that serves from the bank.
+
+    Falls back to live generation (reusing ``retrieved`` context if given) when
+    the bank is empty for the requested key; a background refill is triggered
+    either way when stock runs low.
+    """
+    previous_texts = [_question_text(q) for q in (previous_questions or [])]
+    question = question_bank.draw(username, topic, subtopic, difficulty, question_type, previous_texts)
+    if question is not None:
+        return question
+    return generate_question(subtopic or topic, previous_texts, difficulty, question_type, retrieved=retrieved)
+
+
+def fill_from_topics(per_key: int = REFILL_BATCH,
+                     difficulties: List[str] = None,
+                     question_types: List[str] = None,
+                     subtopics: bool = True) -> Dict[str, int]:
+    """Offline batch job: bank questions for every topic in topics.json.
+
+    Sessions draw per subtopic of the topic's learning plan, so with
+    ``subtopics`` the keys of each plan subtopic are filled too (plans come
+    from the plan cache, generated on a miss).
+    """
+    from planner import PlannerAgent, load_topics
+
+    difficulties = difficulties or ["easy", "medium", "hard"]
+    question_types = question_types or ["objective"]
+    planner = PlannerAgent("")
+    results = {}
+
+    for _parent, children in load_topics().items():
+        for topic in children:
+            names = [topic]
+            if subtopics:
+                names += [s['name'] for s in planner.build_learning_plan(topic).get('subtopics', [])
+                          if s['name'] != topic]
+            for subtopic in names:
+                for difficulty in difficulties:
+                    for question_type in question_types:
+                        key = QuestionBank.make_key(topic, subtopic, difficulty, question_type)
+                        results[key] = question_bank.fill(topic, subtopic, difficulty, question_type, per_key)
+                        print(f"{key}: +{results[key]} questions")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate questions into the question bank.")
+    parser.add_argument("--topic", help="Topic to fill (default: every topic in topics.json)")
+    parser.add_argument("--subtopic", help="Subtopic to fill (default: same as topic)")
+    parser.add_argument("--count", type=int, default=REFILL_BATCH, help="Questions to generate per key")
+    parser.add_argument("--difficulty", action="append", help="Difficulty level(s) to fill")
+    parser.add_argument("--type", dest="question_types", action="append", help="Question type(s) to fill")
+    parser.add_argument("--topics-only", action="store_true",
+                        help="Fill only topic-level keys, not the subtopics of each learning plan")
+    args = parser.parse_args()
+
+    if args.topic:
+        for difficulty in args.difficulty or ["easy", "medium", "hard"]:
+            for question_type in args.question_types or ["objective"]:
+                added = question_bank.fill(args.topic, args.subtopic, difficulty, question_type, args.count)
+                print(f"{args.topic} [{difficulty}/{question_type}]: +{added} questions")
+    else:
+        fill_from_topics(args.count, args.difficulty, args.question_types, subtopics=not args.topics_only)
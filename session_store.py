@@ -0,0 +1,208 @@
+"""Bounded store of the API's interactive sessions."""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from event_log import EventLog, get_event_log
+from interactive_session import InteractiveSession, session_log
+
+IDLE_TTL_SECONDS = 1800          # Sessions unused this long are evicted from memory
+MAX_SESSIONS = 200               # Sessions kept in memory (least recently used evicted)
+FLUSH_SECONDS = 300              # Longest time a live session's last activity goes unsaved
+RESUMABLE_SECONDS = 7 * 86400    # Evicted sessions stay resumable this long after last use
+PRUNE_SECONDS = 600              # Interval between prunes of expired session records
+
+
+def _empty_registry() -> Dict:
+    return {'sessions': {}}  # API session id -> username, topic, stored session id, plan, last_active
+
+
+def _apply_registry_event(registry: Dict, event: Dict) -> None:
+    """Reducer for the log of API sessions."""
+    if event['type'] == 'opened':
+        registry['sessions'][event['session_id']] = dict(event['record'])
+    elif event['type'] == 'touched':
+        for session_id, last_active in event['last_active'].items():
+            if session_id in registry['sessions']:
+                registry['sessions'][session_id]['last_active'] = last_active
+    elif event['type'] == 'closed':
+        for session_id in event['session_ids']:
+            registry['sessions'].pop(session_id, None)
+
+
+def session_registry() -> EventLog:
+    """Event log mapping API session ids to the users' stored sessions."""
+    return get_event_log('api_sessions', _apply_registry_event, _empty_registry)
+
+
+class SessionStore:
+    """API sessions held in memory with idle expiry and an LRU size bound.
+
+    A session's progress is written to its user's session log as it
+    happens, so evicting one only marks it paused, records when it was last
+    used and shuts down its prefetch threads. Looking up an evicted session
+    rebuilds it (and its learning plan) from the stored state. Expiry is
+    checked on every access, so an idle server holds no more than it did at
+    its last request.
+    """
+
+    def __init__(self, ttl: float = IDLE_TTL_SECONDS, max_sessions: int = MAX_SESSIONS,
+                 flush_interval: float = FLUSH_SECONDS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self.registry = session_registry()
+        self._lock = threading.RLock()
+        self._sessions: "OrderedDict[str, InteractiveSession]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._flushed: Dict[str, float] = {}
+        self._last_prune = 0.0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # ---- Access ----
+    def add(self, session_id: str, session: InteractiveSession) -> None:
+        """Register a new session; set its ``plan`` first so a resumed session gets it back."""
+        now = time.time()
+        with self._lock:
+            self.registry.append({
+                'type': 'opened',
+                'session_id': session_id,
+                'record': {
+                    'username': session.username,
+                    'topic': session.topic,
+                    'stored_session_id': session.session_id,
+                    'plan': session.plan,
+                    'last_active': now
+                }
+            })
+            self._sessions[session_id] = session
+            self._last_used[session_id] = self._flushed[session_id] = now
+            self.sweep(now)
+
+    def get(self, session_id: str) -> Optional[InteractiveSession]:
+        """A live session, resumed from stored state if it was evicted; None if unknown."""
+        now = time.time()
+        resumed = None
+        with self._lock:
+            self.sweep(now)
+            session = self._sessions.get(session_id)
+            record = self.registry.state['sessions'].get(session_id) if session is None else None
+            if session is None and record is None:
+                return None
+        if session is None:
+            # Rebuilding reads the user's logs; other sessions are served meanwhile
+            resumed = self._resume(session_id, record)
+            if resumed is None:
+                return None
+
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                if session_id not in self.registry.state['sessions']:  # Ended meanwhile
+                    resumed.prefetcher.shutdown()
+                    return None
+                session = resumed
+                self._sessions[session_id] = session
+                self._flushed[session_id] = now
+            elif resumed is not None:  # Another thread resumed it first
+                resumed.prefetcher.shutdown()
+            self._sessions.move_to_end(session_id)
+            self._last_used[session_id] = now
+            if now - self._flushed[session_id] >= self.flush_interval:
+                self.registry.append({'type': 'touched', 'last_active': {session_id: now}})
+                self._flushed[session_id] = now
+            self._evict_over_capacity()
+            return session
+
+    def remove(self, session_id: str) -> None:
+        """End a session: mark it ended, drop it from memory and make it no longer resumable."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+            self._flushed.pop(session_id, None)
+            record = self.registry.state['sessions'].get(session_id)
+            try:
+                if session is not None:
+                    session.prefetcher.shutdown()
+                    session.save_session_state('ended')
+                elif record is not None:  # Evicted: end the stored session without rebuilding it
+                    session_log(record['username']).append({
+                        'type': 'set',
+                        'session_id': record['stored_session_id'],
+                        'fields': {'status': 'ended'}
+                    })
+            except Exception as e:
+                print(f"Error ending session {session_id}: {e}")
+            if record is not None:
+                self.registry.append({'type': 'closed', 'session_ids': [session_id]})
+
+    def _resume(self, session_id: str, record: Dict) -> Optional[InteractiveSession]:
+        """Rebuild an evicted session from its registry record (called without the lock held)."""
+        try:
+            session = InteractiveSession(record['username'], record['topic'], session_id=record['stored_session_id'])
+        except KeyError as e:
+            print(f"Cannot resume session {session_id}: {e}")
+            return None
+        session.plan = record.get('plan')
+        return session
+
+    # ---- Eviction ----
+    def _evict(self, session_id: str) -> None:
+        """Save a session's state and drop it from memory (the caller holds the lock)."""
+        session = self._sessions.pop(session_id)
+        last_used = self._last_used.pop(session_id)
+        self._flushed.pop(session_id, None)
+        try:
+            session.prefetcher.shutdown()
+            session.save_session_state('paused')
+            self.registry.append({'type': 'touched', 'last_active': {session_id: last_used}})
+        except Exception as e:
+            print(f"Error saving evicted session {session_id}: {e}")
+
+    def _evict_over_capacity(self) -> None:
+        while len(self._sessions) > self.max_sessions:
+            self._evict(next(iter(self._sessions)))
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Evict idle and excess sessions and prune expired records; returns sessions evicted."""
+        now = time.time() if now is None else now
+        evicted = 0
+        with self._lock:
+            # Least recently used first, so idle sessions are at the front
+            while self._sessions:
+                session_id = next(iter(self._sessions))
+                if now - self._last_used[session_id] < self.ttl:
+                    break
+                self._evict(session_id)
+                evicted += 1
+            evicted += max(0, len(self._sessions) - self.max_sessions)
+            self._evict_over_capacity()
+
+            if now - self._last_prune >= PRUNE_SECONDS:
+                self._last_prune = now
+                expired = [
+                    session_id for session_id, record in self.registry.state['sessions'].items()
+                    if session_id not in self._sessions and now - record['last_active'] >= RESUMABLE_SECONDS
+                ]
+                if expired:
+                    self.registry.append({'type': 'closed', 'session_ids': expired})
+        return evicted
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'live_sessions': len(self._sessions),
+                'resumable_sessions': len(self.registry.state['sessions']),
+                'max_sessions': self.max_sessions,
+                'idle_ttl_seconds': self.ttl,
+                'checked_at': datetime.now().isoformat()
+            }
+
+
+# Global session store instance
+session_store = SessionStore()
@@ -0,0 +1,123 @@
+"""Small SQLite store for state shared by every API worker process."""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+USER_DATA_DIR = Path('user_data')
+USER_DATA_DIR.mkdir(exist_ok=True)
+SHARED_DB = USER_DATA_DIR / 'shared_state.db'
+
+SUGGESTION_TTL_SECONDS = 600  # Computed chat suggestions are kept this long for any worker to serve
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_suggestions (
+    message_id TEXT PRIMARY KEY,
+    suggestions TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    channel TEXT NOT NULL,
+    key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (channel, key)
+);
+CREATE INDEX IF NOT EXISTS idx_changes_seq ON changes(seq);
+CREATE INDEX IF NOT EXISTS idx_changes_channel_seq ON changes(channel, seq);
+"""
+
+
+class SharedState:
+    """Settings and short-lived results that every worker must see the same way.
+
+    Each worker process keeps its own caches; anything one request changes
+    and a later request (possibly served by another worker) reads goes
+    here instead of a module-level variable.
+    """
+
+    def __init__(self, db_path: Path = SHARED_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---- Settings ----
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._connect().execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def set(self, key: str, value: Any) -> None:
+        self._connect().execute(
+            'INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+            (key, json.dumps(value), time.time())
+        )
+
+    # ---- Change feed ----
+    def bump(self, channel: str, key: str) -> int:
+        """Record that ``key`` changed; returns the change's sequence number.
+
+        Writers call this after their write is stored, so a reader that
+        sees the change number re-reads data at least that new.
+        """
+        self._connect().execute(
+            'INSERT INTO changes (channel, key, seq) VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM changes)) '
+            'ON CONFLICT(channel, key) DO UPDATE SET seq = excluded.seq',
+            (channel, key)
+        )
+        return self.change_seq()
+
+    def change_seq(self) -> int:
+        """Sequence number of the latest change on any channel (0 if none)."""
+        return self._connect().execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    def changes_since(self, channel: str, seq: int) -> Tuple[List[str], int]:
+        """Keys of ``channel`` changed after ``seq``, and the sequence number to pass next time."""
+        rows = self._connect().execute(
+            'SELECT key, seq FROM changes WHERE channel = ? AND seq > ? ORDER BY seq', (channel, seq)
+        ).fetchall()
+        return [row['key'] for row in rows], (rows[-1]['seq'] if rows else seq)
+
+    # ---- Chat suggestions ----
+    def expect_suggestions(self, message_id: str) -> None:
+        """Record that suggestions for a message are being computed."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('DELETE FROM chat_suggestions WHERE created_at < ?', (now - SUGGESTION_TTL_SECONDS,))
+        conn.execute('INSERT OR REPLACE INTO chat_suggestions (message_id, suggestions, created_at) VALUES (?, NULL, ?)',
+                     (message_id, now))
+
+    def put_suggestions(self, message_id: str, suggestions: List[str]) -> None:
+        self._connect().execute('UPDATE chat_suggestions SET suggestions = ? WHERE message_id = ?',
+                                (json.dumps(suggestions), message_id))
+
+    def get_suggestions(self, message_id: str):
+        """``(known, suggestions)``: suggestions are None while still being computed."""
+        row = self._connect().execute('SELECT suggestions FROM chat_suggestions WHERE message_id = ?',
+                                      (message_id,)).fetchone()
+        if row is None:
+            return False, None
+        return True, None if row['suggestions'] is None else json.loads(row['suggestions'])
+
+    def drop_suggestions(self, message_id: str) -> None:
+        self._connect().execute('DELETE FROM chat_suggestions WHERE message_id = ?', (message_id,))
+
+
+# Global shared state instance
+shared_state = SharedState()
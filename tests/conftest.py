@@ -0,0 +1,11 @@
+"""Test setup: the repository modules are importable and run in a scratch directory."""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Modules create their data directories (event_log/, user_data/, ...) in the
+# working directory when imported, so keep those out of the checkout
+os.chdir(tempfile.mkdtemp(prefix='llm_gis_tests_'))
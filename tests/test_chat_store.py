@@ -0,0 +1,72 @@
+"""Tests for ChatStore windows and cursor paging."""
+from chat_store import ChatStore
+
+
+def _store(tmp_path, **kwargs):
+    return ChatStore(tmp_path / 'chat.db', **dict({'recent': 5}, **kwargs))
+
+
+def _fill(store, username, count):
+    for i in range(count):
+        store.append(username, {'type': 'user', 'message': f'm{i}', 'timestamp': 't'})
+
+
+def _texts(page):
+    return [message['message'] for message in page['history']]
+
+
+def test_pages_walk_back_through_the_whole_history(tmp_path):
+    store = _store(tmp_path)
+    _fill(store, 'u', 12)
+
+    pages, cursor = [], None
+    while True:
+        page = store.history('u', limit=4, before=cursor)
+        pages.append(_texts(page))
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [['m8', 'm9', 'm10', 'm11'], ['m4', 'm5', 'm6', 'm7'], ['m0', 'm1', 'm2', 'm3']]
+
+
+def test_short_history_has_no_cursor(tmp_path):
+    store = _store(tmp_path)
+    _fill(store, 'u', 3)
+    page = store.history('u', limit=4)
+    assert _texts(page) == ['m0', 'm1', 'm2']
+    assert page['next_cursor'] is None
+
+
+def test_limit_zero_returns_everything(tmp_path):
+    store = _store(tmp_path)
+    _fill(store, 'u', 8)
+    page = store.history('u', limit=0)
+    assert len(page['history']) == 8
+    assert page['next_cursor'] is None
+
+
+def test_clear_hides_earlier_messages(tmp_path):
+    store = _store(tmp_path)
+    _fill(store, 'u', 6)
+    store.clear('u')
+    assert store.history('u')['history'] == []
+    store.append('u', {'type': 'user', 'message': 'after', 'timestamp': 't'})
+    assert _texts(store.history('u')) == ['after']
+    assert store.compact() == 6
+
+
+def test_other_writers_show_up_after_the_poll_interval(tmp_path):
+    reader = _store(tmp_path, poll_seconds=0)
+    writer = _store(tmp_path)
+    _fill(reader, 'u', 2)
+    writer.append('u', {'type': 'assistant', 'message': 'from another worker', 'timestamp': 't'})
+    assert _texts(reader.history('u'))[-1] == 'from another worker'
+
+
+def test_idle_and_excess_users_leave_memory(tmp_path):
+    store = _store(tmp_path, max_users=2)
+    for username in ('a', 'b', 'c'):
+        _fill(store, username, 1)
+        store.history(username)
+    assert store.cached_users() == 2
+    assert _texts(store.history('a')) == ['m0']  # Reloaded from the database
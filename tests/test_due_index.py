@@ -0,0 +1,82 @@
+"""Tests for DueIndex and the per-user index cache."""
+import due_index
+from due_index import DueIndex, ensure_source, get_due_index
+
+
+def _card(topic, cid):
+    return ('flashcard', topic, cid), {'topic': topic, 'id': cid}
+
+
+def _filled():
+    index = DueIndex()
+    for topic, cid, due in [('gis', 'a', 30), ('gis', 'b', 10), ('maps', 'c', 20), ('maps', 'd', 50)]:
+        key, item = _card(topic, cid)
+        index.upsert(key, due, item)
+    index.upsert(('weakness', 'gis', 'projections'), 15, {'area': 'projections'})
+    return index
+
+
+def test_due_queries_merge_groups_in_due_order():
+    index = _filled()
+    assert index.due_count(at=25) == 3
+    assert index.due_count(at=25, source='flashcard') == 2
+    assert index.due_count(at=30, source='flashcard', group='gis') == 2
+    assert [item['id'] for _, item in index.due_by(40, 'flashcard')] == ['b', 'c', 'a']
+    assert [due for due, _ in index.next_due(3)] == [10, 15, 20]
+    assert [item['id'] for _, item in index.due_by(100, 'flashcard', limit=2)] == ['b', 'c']
+
+
+def test_upsert_moves_and_remove_drops_an_item():
+    index = _filled()
+    key, item = _card('gis', 'b')
+    index.upsert(key, 40, item)
+    assert index.due(key) == 40
+    assert [i['id'] for _, i in index.due_by(100, 'flashcard', 'gis')] == ['a', 'b']
+
+    index.remove(key)
+    index.remove(key)  # Removing twice is harmless
+    assert index.due(key) is None
+    assert len(index) == 4
+
+
+def test_equal_due_times_keep_insertion_order():
+    index = DueIndex()
+    for cid in 'xyz':
+        key, item = _card('gis', cid)
+        index.upsert(key, 5, item)
+    assert [item['id'] for _, item in index.next_due(3)] == ['x', 'y', 'z']
+
+
+def test_replace_source_leaves_other_sources_alone():
+    index = _filled()
+    key, item = _card('gis', 'e')
+    index.replace_source('flashcard', [(key, 1, item)], version=2)
+    assert [i.get('id', i.get('area')) for _, i in index.next_due(10)] == ['e', 'projections']
+    assert index.versions['flashcard'] == 2
+
+
+def test_ensure_source_rebuilds_only_on_a_new_version():
+    index = DueIndex()
+    builds = []
+
+    def build():
+        builds.append(1)
+        key, item = _card('gis', 'a')
+        return [(key, 10, item)]
+
+    ensure_source(index, 'flashcard', 1, build)
+    ensure_source(index, 'flashcard', 1, build)
+    assert len(builds) == 1
+    ensure_source(index, 'flashcard', 2, build)
+    assert len(builds) == 2
+    assert len(index) == 1
+
+
+def test_user_indexes_are_bounded_lru(monkeypatch):
+    monkeypatch.setattr(due_index, 'MAX_CACHED_INDEXES', 2)
+    monkeypatch.setattr(due_index, '_indexes', due_index.OrderedDict())
+    first = get_due_index('u1')
+    get_due_index('u2')
+    assert get_due_index('u1') is first  # Refreshes u1, so u2 is the oldest
+    get_due_index('u3')
+    assert list(due_index._indexes) == ['u1', 'u3']
@@ -0,0 +1,70 @@
+"""Tests for PlanCache single-flight builds and staleness."""
+import threading
+import time
+
+import pytest
+
+from plan_cache import PlanCache
+
+
+def _get(cache, builder, digest='d1'):
+    return cache.get('gis', builder, topics_digest=digest, corpus_version='1')
+
+
+def test_concurrent_misses_share_one_build(tmp_path):
+    cache = PlanCache(tmp_path / 'plans.json')
+    started, release = threading.Event(), threading.Event()
+    builds = []
+
+    def builder():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return {'subtopics': ['rasters']}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(_get(cache, builder))) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)  # Let the others reach the in-flight build
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert builds == [1]
+    assert results == [{'subtopics': ['rasters']}] * 5
+    results[0]['subtopics'].append('changed')  # Callers get private copies
+    assert _get(cache, builder) == {'subtopics': ['rasters']}
+
+
+def test_failed_builds_are_not_cached(tmp_path):
+    cache = PlanCache(tmp_path / 'plans.json')
+
+    def failing():
+        raise ValueError('unusable response')
+
+    with pytest.raises(ValueError):
+        _get(cache, failing)
+    assert _get(cache, lambda: {'subtopics': []}) == {'subtopics': []}
+
+
+def test_stale_plans_are_served_while_rebuilt(tmp_path):
+    cache = PlanCache(tmp_path / 'plans.json')
+    _get(cache, lambda: {'version': 1})
+    rebuilt = threading.Event()
+
+    def rebuild():
+        rebuilt.set()
+        return {'version': 2}
+
+    assert _get(cache, rebuild, digest='d2') == {'version': 1}
+    assert rebuilt.wait(5)
+    for _ in range(100):  # The rebuild finishes in the background
+        saved = PlanCache(tmp_path / 'plans.json').plans['gis']
+        if saved['topics_digest'] == 'd2':
+            break
+        time.sleep(0.01)
+    assert saved == dict(saved, topics_digest='d2', plan={'version': 2})
+    assert _get(cache, rebuild, digest='d2') == {'version': 2}
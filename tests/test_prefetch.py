@@ -0,0 +1,73 @@
+"""Tests for PrefetchScheduler."""
+import threading
+
+from prefetch import PrefetchScheduler
+
+
+def _blocked_scheduler():
+    """A single-worker scheduler whose worker waits until the returned event is set."""
+    scheduler = PrefetchScheduler(max_workers=1)
+    release = threading.Event()
+    scheduler.schedule('blocker', release.wait, 5)
+    return scheduler, release
+
+
+def test_consume_returns_prefetched_result():
+    scheduler = PrefetchScheduler()
+    calls = []
+    scheduler.schedule('a', lambda: calls.append('background') or 'prefetched')
+    assert scheduler.consume('a', lambda: 'inline') == 'prefetched'
+    assert calls == ['background']
+    scheduler.shutdown()
+
+
+def test_schedule_ignores_duplicate_keys():
+    scheduler, release = _blocked_scheduler()
+    calls = []
+    scheduler.schedule('a', calls.append, 1)
+    scheduler.schedule('a', calls.append, 2)
+    release.set()
+    scheduler.consume('a', calls.append, 3)
+    assert calls == [1]
+    scheduler.shutdown()
+
+
+def test_cancel_where_drops_matching_pending_jobs():
+    scheduler, release = _blocked_scheduler()
+    calls = []
+    scheduler.schedule(('example', 'x'), calls.append, 'example x')
+    scheduler.schedule(('example', 'y'), calls.append, 'example y')
+    scheduler.schedule(('question', 'x'), calls.append, 'question x')
+
+    assert scheduler.cancel_where(lambda key: key[1] == 'x') == 2
+    release.set()
+
+    # The cancelled job is generated inline instead; the other one ran in the background
+    assert scheduler.consume(('example', 'x'), lambda: 'inline') == 'inline'
+    scheduler.consume(('example', 'y'), lambda: None)
+    assert calls == ['example y']
+    scheduler.shutdown()
+
+
+def test_failed_prefetch_is_regenerated_inline():
+    scheduler = PrefetchScheduler()
+
+    def fail():
+        raise RuntimeError('no LLM')
+
+    scheduler.schedule('a', fail)
+    assert scheduler.consume('a', lambda: 'inline') == 'inline'
+    scheduler.shutdown()
+
+
+def test_shutdown_cancels_pending_and_rejects_new_jobs():
+    scheduler, release = _blocked_scheduler()
+    calls = []
+    scheduler.schedule('pending', calls.append, 'pending')
+    scheduler.shutdown()
+    scheduler.schedule('late', calls.append, 'late')
+    release.set()
+
+    assert scheduler.consume('pending', lambda: 'inline') == 'inline'
+    assert scheduler.consume('late', lambda: 'inline') == 'inline'
+    assert calls == []
@@ -0,0 +1,93 @@
+"""Tests for SessionStore expiry, LRU eviction and resumption."""
+import sys
+import types
+
+import pytest
+
+from event_log import EventLog
+from prefetch import PrefetchScheduler
+
+
+class FakeSession:
+    """Stands in for InteractiveSession, which needs the RAG stack."""
+
+    def __init__(self, username, topic, session_id=None, prompt_resume=True):
+        self.username = username
+        self.topic = topic
+        self.session_id = session_id or f"{username}-{topic}"
+        self.plan = None
+        self.prefetcher = PrefetchScheduler(max_workers=1)
+        self.statuses = []
+
+    def save_session_state(self, status='paused'):
+        self.statuses.append(status)
+
+
+@pytest.fixture
+def store_module(tmp_path, monkeypatch):
+    ended = []
+    fake = types.ModuleType('interactive_session')
+    fake.InteractiveSession = FakeSession
+    fake.session_log = lambda username: types.SimpleNamespace(append=ended.append)
+    monkeypatch.setitem(sys.modules, 'interactive_session', fake)
+    monkeypatch.delitem(sys.modules, 'session_store', raising=False)
+    import session_store
+
+    monkeypatch.setattr(session_store, 'session_registry', lambda: EventLog(
+        'api_sessions', session_store._apply_registry_event, session_store._empty_registry, directory=tmp_path
+    ))
+    session_store.ended_events = ended
+    return session_store
+
+
+def _open(store, name, plan=None):
+    session = FakeSession('u', name)
+    session.plan = plan
+    store.add(name, session)
+    return session
+
+
+def test_idle_sessions_are_paused_and_resumed_with_their_plan(store_module):
+    store = store_module.SessionStore(ttl=60, max_sessions=10)
+    session = _open(store, 'gis', plan={'subtopics': ['rasters']})
+
+    assert store.sweep(now=store._last_used['gis'] + 61) == 1
+    assert len(store) == 0
+    assert session.statuses == ['paused']
+
+    resumed = store.get('gis')
+    assert resumed is not session
+    assert resumed.session_id == session.session_id
+    assert resumed.plan == {'subtopics': ['rasters']}
+    assert len(store) == 1
+
+
+def test_least_recently_used_session_is_evicted_over_capacity(store_module):
+    store = store_module.SessionStore(ttl=3600, max_sessions=2)
+    first = _open(store, 'a')
+    _open(store, 'b')
+    store.get('a')  # Now 'b' is the least recently used
+    third = _open(store, 'c')
+
+    assert set(store._sessions) == {'a', 'c'}
+    assert store.get('a') is first and store.get('c') is third
+    assert store.get('b') is not None  # Still resumable
+
+
+def test_removed_sessions_end_and_cannot_be_resumed(store_module):
+    store = store_module.SessionStore(ttl=3600, max_sessions=1)
+    live = _open(store, 'a')
+    store.remove('a')
+    assert live.statuses == ['ended']
+    assert store.get('a') is None
+
+    _open(store, 'b')
+    _open(store, 'c')  # Evicts 'b'
+    store.remove('b')
+    assert store_module.ended_events[-1]['fields'] == {'status': 'ended'}
+    assert store.get('b') is None
+
+
+def test_unknown_sessions_are_not_found(store_module):
+    store = store_module.SessionStore()
+    assert store.get('missing') is None
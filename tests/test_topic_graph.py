@@ -0,0 +1,60 @@
+"""Tests for TopicGraph compilation and prerequisite queries."""
+import json
+import os
+
+from topic_graph import TopicGraph
+
+
+def _graph(tmp_path, topics):
+    path = tmp_path / 'topics.json'
+    path.write_text(json.dumps(topics))
+    return TopicGraph(path)
+
+
+def _topics(**prerequisites):
+    return {'GIS': {name: {'prerequisites': prereqs} for name, prereqs in prerequisites.items()}}
+
+
+def test_prerequisites_come_first(tmp_path):
+    graph = _graph(tmp_path, _topics(maps=[], rasters=['maps'], analysis=['rasters', 'maps']))
+    order = graph.topological_order()
+    assert order.index('maps') < order.index('rasters') < order.index('analysis')
+    assert graph.prerequisite_closure('analysis') == ['maps', 'rasters']
+    assert graph.get('rasters')['category'] == 'GIS'
+    assert graph.cycles == []
+
+
+def test_cycles_are_detected_and_their_closing_edge_ignored(tmp_path, capsys):
+    graph = _graph(tmp_path, _topics(a=['c'], b=['a'], c=['b'], d=['a']))
+    graph.refresh()
+    assert len(graph.cycles) == 1
+    cycle = graph.cycles[0]
+    assert cycle[0] == cycle[-1] and set(cycle) == {'a', 'b', 'c'}
+    assert 'prerequisite cycle' in capsys.readouterr().out
+
+    # Every query still terminates, and no topic is its own prerequisite
+    for topic in 'abcd':
+        assert topic not in graph.prerequisite_closure(topic)
+    assert set(graph.prerequisite_closure('d')) == {'a', 'b', 'c'}
+    assert sorted(graph.topological_order()) == ['a', 'b', 'c', 'd']
+
+
+def test_remaining_prerequisites_and_frontier_skip_mastered_topics(tmp_path):
+    graph = _graph(tmp_path, _topics(maps=[], crs=[], rasters=['maps'], analysis=['rasters', 'crs']))
+    mastery = {'maps': 'mastered', 'crs': 'beginner'}
+    assert graph.remaining_prerequisites('analysis', mastery) == ['crs', 'rasters']
+    assert graph.prerequisite_frontier('analysis', mastery) == ['crs', 'rasters']
+    assert graph.prerequisite_frontier('analysis', {}) == ['maps', 'crs']
+    assert graph.remaining_prerequisites('analysis', mastery, extra=['statistics'])[-1] == 'statistics'
+
+
+def test_graph_recompiles_when_the_file_changes(tmp_path):
+    graph = _graph(tmp_path, _topics(maps=[]))
+    assert graph.prerequisites('rasters') == []
+    digest = graph.digest
+    path = tmp_path / 'topics.json'
+    path.write_text(json.dumps(_topics(maps=[], rasters=['maps'])))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert graph.prerequisites('rasters') == ['maps']
+    assert graph.digest != digest
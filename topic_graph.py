@@ -0,0 +1,162 @@
+"""Precompiled prerequisite graph over topics.json."""
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+TOPICS_FILE = Path('topics.json')
+
+
+class TopicGraph:
+    """Topic metadata and prerequisite structure, compiled once per file change.
+
+    topics.json is re-read only when its mtime changes. On load the graph
+    flattens the parent categories into a topic index, detects prerequisite
+    cycles (the closing edge of each cycle is ignored), and precomputes a
+    topological order and each topic's transitive prerequisite closure.
+    """
+
+    def __init__(self, topics_file: Path = TOPICS_FILE):
+        self.topics_file = topics_file
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._loaded = False
+        self.raw: Dict = {}
+        self.digest = ''
+        self.topics: Dict[str, Dict] = {}
+        self.edges: Dict[str, List[str]] = {}
+        self.cycles: List[List[str]] = []
+        self.order: List[str] = []
+        self._position: Dict[str, int] = {}
+        self._closure: Dict[str, List[str]] = {}
+
+    # ---- Loading ----
+    def refresh(self) -> None:
+        """Recompile the graph if topics.json changed since the last load."""
+        try:
+            mtime = self.topics_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._loaded and mtime == self._mtime:
+            return
+
+        with self._lock:
+            if self._loaded and mtime == self._mtime:
+                return
+            raw, digest = {}, ''
+            if mtime is not None:
+                try:
+                    data = self.topics_file.read_bytes()
+                    raw = json.loads(data)
+                    digest = hashlib.sha1(data).hexdigest()
+                except Exception as e:
+                    print(f"Error loading {self.topics_file}: {e}")
+            self._compile(raw)
+            self.raw, self.digest, self._mtime = raw, digest, mtime
+            self._loaded = True
+
+    def _compile(self, raw: Dict) -> None:
+        topics: Dict[str, Dict] = {}
+        for parent, children in raw.items():
+            for name, info in children.items():
+                topics[name] = dict(info, category=parent)
+
+        edges: Dict[str, List[str]] = {}
+        for name, info in topics.items():
+            edges[name] = list(dict.fromkeys(info.get('prerequisites', [])))
+            for prereq in edges[name]:
+                edges.setdefault(prereq, [])
+
+        # Iterative DFS: post-order gives a prerequisites-first ordering, and
+        # any edge back to a node on the stack closes a cycle.
+        cycles, order, back_edges = [], [], set()
+        state: Dict[str, int] = {}  # 1 = on stack, 2 = done
+        for root in edges:
+            if root in state:
+                continue
+            stack = [(root, iter(edges[root]))]
+            path = [root]
+            state[root] = 1
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    path.pop()
+                    state[node] = 2
+                    order.append(node)
+                elif state.get(child) == 1:
+                    cycles.append(path[path.index(child):] + [child])
+                    back_edges.add((node, child))
+                elif child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(edges[child])))
+                    path.append(child)
+
+        position = {name: i for i, name in enumerate(order)}
+        closure: Dict[str, List[str]] = {}
+        for name in order:  # prerequisites are always closed before dependents
+            reachable = set()
+            for prereq in edges[name]:
+                if (name, prereq) in back_edges:
+                    continue
+                reachable.add(prereq)
+                reachable.update(closure[prereq])
+            reachable.discard(name)
+            closure[name] = sorted(reachable, key=position.__getitem__)
+
+        for cycle in cycles:
+            print(f"Warning: prerequisite cycle in {self.topics_file}: {' -> '.join(cycle)}")
+
+        self.topics, self.edges, self.cycles = topics, edges, cycles
+        self.order, self._position, self._closure = order, position, closure
+
+    # ---- Queries ----
+    def get(self, topic: str) -> Optional[Dict]:
+        """Metadata for a topic (including its parent ``category``), or None."""
+        self.refresh()
+        return self.topics.get(topic)
+
+    def prerequisites(self, topic: str) -> List[str]:
+        """Direct prerequisites of a topic."""
+        self.refresh()
+        return list(self.edges.get(topic, []))
+
+    def prerequisite_closure(self, topic: str) -> List[str]:
+        """Every transitive prerequisite of a topic, prerequisites first."""
+        self.refresh()
+        return list(self._closure.get(topic, []))
+
+    def topological_order(self) -> List[str]:
+        """All topics ordered so that prerequisites come before dependents."""
+        self.refresh()
+        return list(self.order)
+
+    def remaining_prerequisites(self, topic: str, mastery: Dict[str, str],
+                                extra: Iterable[str] = ()) -> List[str]:
+        """Prerequisites of ``topic`` (and of ``extra`` topics) not yet mastered, in learning order.
+
+        ``extra`` covers prerequisites that come from elsewhere, e.g. a
+        generated plan; those not in topics.json are placed last.
+        """
+        self.refresh()
+        needed = dict.fromkeys(self._closure.get(topic, []))
+        for prereq in extra:
+            needed.update(dict.fromkeys(self._closure.get(prereq, [])))
+            needed[prereq] = None
+        needed.pop(topic, None)
+
+        remaining = [name for name in needed if mastery.get(name) != 'mastered']
+        unknown = len(self._position)
+        return sorted(remaining, key=lambda name: self._position.get(name, unknown))
+
+    def prerequisite_frontier(self, topic: str, mastery: Dict[str, str]) -> List[str]:
+        """Unmastered prerequisites whose own prerequisites are all mastered."""
+        remaining = self.remaining_prerequisites(topic, mastery)
+        pending = set(remaining)
+        return [name for name in remaining if not pending.intersection(self._closure.get(name, []))]
+
+
+# Global topic graph instance
+topic_graph = TopicGraph()